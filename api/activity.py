@@ -0,0 +1,147 @@
+"""
+Write-behind activity logging.
+
+log_activity() doesn't INSERT inside the request. Entries are queued once the
+surrounding transaction commits, and a background thread writes them with one
+bulk_create per batch: when ACTIVITY_LOG_BATCH_SIZE entries are waiting, every
+ACTIVITY_LOG_FLUSH_SECONDS otherwise, and when the worker process exits.
+
+If the queue is full the entry is written right away instead of being dropped.
+If a batch can't be inserted its entries are inserted one by one, so an entry
+that can't be written (say its order was deleted meanwhile) is the only one lost.
+All of this only happens with ACTIVITY_LOG_BUFFERED = True, which is meant for
+long-running servers. By default each entry is written when its transaction
+commits, because a serverless function can be frozen before the buffer is flushed.
+"""
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, router, transaction
+from django.utils import timezone
+
+from .models import ActivityLog
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityBuffer:
+    def __init__(self, max_size, batch_size, flush_seconds):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._wakeup = threading.Event()
+        # Held while writing, so a flush at exit waits for the writer thread's batch
+        self._write_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def put(self, entry):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            write([entry])
+            return
+        if self.queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write everything queued so far, in batches."""
+        with self._write_lock:
+            while True:
+                batch = []
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    return
+                write(batch)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+
+def write(entries):
+    # A batch can have entries of restaurants on different database shards
+    by_db = {}
+    for entry in entries:
+        by_db.setdefault(router.db_for_write(ActivityLog, instance=entry), []).append(entry)
+    for db, batch in by_db.items():
+        try:
+            with transaction.atomic(using=db):
+                ActivityLog.objects.using(db).bulk_create(batch)
+        except Exception:
+            # One bad entry (e.g. its order was deleted since) fails the whole
+            # statement, so fall back to one INSERT each and only lose that one
+            logger.warning('Could not write %d activity log entries at once, writing them one by one',
+                           len(batch), exc_info=True)
+            _write_each(batch, db)
+
+
+def _write_each(entries, db):
+    for entry in entries:
+        # bulk_create may have set the id before the batch was rolled back
+        entry.pk = None
+        try:
+            with transaction.atomic(using=db):
+                entry.save(using=db, force_insert=True)
+        except Exception:
+            # An audit entry must never fail the request (or kill the writer thread)
+            logger.exception('Could not write the %s activity log entry of order %s', entry.action_type, entry.order_id)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ActivityBuffer(
+                    max_size=settings.ACTIVITY_LOG_QUEUE_SIZE,
+                    batch_size=settings.ACTIVITY_LOG_BATCH_SIZE,
+                    flush_seconds=settings.ACTIVITY_LOG_FLUSH_SECONDS,
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def log_activity(action_type, order, actor=None, details=''):
+    """Record an action on an order. The entry is written after the transaction commits."""
+    entry = ActivityLog(
+        actor=actor if actor is not None and actor.is_authenticated else None,
+        restaurant_id=order.restaurant_id,
+        order_id=order.pk,
+        action_type=action_type,
+        details=details,
+        timestamp=timezone.now(),
+    )
+    if settings.ACTIVITY_LOG_BUFFERED:
+        transaction.on_commit(lambda: get_buffer().put(entry), using=order._state.db)
+    else:
+        transaction.on_commit(lambda: write([entry]), using=order._state.db)
+
+
+def flush():
+    """Write all buffered entries now (management commands, tests, shutdown)."""
+    if _buffer is not None:
+        _buffer.flush()
@@ -1,9 +1,86 @@
+import json
+
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django import forms
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
 from .models import User, Restaurant, MenuItem, Order
 
+# --- Performance ---
+# Changelists of big tables (orders above all) shouldn't scan them: rows are
+# joined in the page query, big counts are estimated and search uses indexes.
+
+class EstimatedCountPaginator(Paginator):
+    """
+    On Postgres, counts exactly up to ADMIN_EXACT_COUNT_LIMIT rows and uses the
+    planner's row estimate above that, instead of a COUNT(*) over the whole
+    table. Other databases count exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return super().count
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        # COUNT(*) over a LIMITed subquery stops after limit + 1 rows
+        capped = queryset.order_by()[:limit + 1].count()
+        if capped <= limit:
+            return capped
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return max(capped, int(plan[0]['Plan']['Plan Rows']))
+
+
+class PerformanceAdminMixin:
+    paginator = EstimatedCountPaginator
+    # No second, unfiltered COUNT(*) for the "x of y" line
+    show_full_result_count = False
+    # {field: 'exact' | 'upper' | 'prefix'}. Searched with lookups an index can
+    # answer instead of search_fields' icontains: prefix is a case-insensitive
+    # istartswith, served on Postgres by the UPPER(...) text_pattern_ops indexes of
+    # migration 0027. A related field (customer__username) becomes a subquery on
+    # the related table.
+    indexed_search_fields = {}
+
+    def _indexed_condition(self, field, mode, term):
+        if mode == 'upper':
+            mode, term = 'exact', term.upper()
+        if mode == 'exact':
+            lookups = {field: term}
+        else:
+            lookups = {f'{field}__istartswith': term}
+        relation, _, remote_field = field.partition('__')
+        if not remote_field:
+            return Q(**lookups)
+        related_model = self.model._meta.get_field(relation).related_model
+        related = related_model._default_manager.filter(
+            **{lookup.split('__', 1)[1]: value for lookup, value in lookups.items()}
+        )
+        return Q(**{f'{relation}__in': related.values('pk')})
+
+    def get_search_results(self, request, queryset, search_term):
+        if not self.indexed_search_fields:
+            return super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        condition = Q()
+        for field, mode in self.indexed_search_fields.items():
+            condition |= self._indexed_condition(field, mode, term)
+        return queryset.filter(condition), False
+
+
 class CustomUserCreationForm(UserCreationForm):
     # Explicitly define the custom fields for the creation form
     role = forms.ChoiceField(choices=User.ROLE_CHOICES)
@@ -31,7 +108,7 @@ class CustomUserChangeForm(UserChangeForm):
         fields = '__all__'
 
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(PerformanceAdminMixin, BaseUserAdmin):
     add_form = CustomUserCreationForm
     form = CustomUserChangeForm
 
@@ -57,26 +134,37 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
-    list_display = ('username', 'email', 'role', 'is_staff', 'is_active')
+    list_display = ('username', 'email', 'role', 'restaurant', 'is_staff', 'is_active')
+    list_select_related = ('restaurant',)
     list_filter = ('role', 'is_staff', 'is_superuser', 'is_active', 'groups')
+    # Also used by the order autocomplete widget
     search_fields = ('username', 'first_name', 'last_name', 'email')
+    indexed_search_fields = {'username': 'prefix', 'first_name': 'prefix', 'last_name': 'prefix', 'email': 'prefix'}
+    autocomplete_fields = ('restaurant',)
     ordering = ('username',)
 
 @admin.register(Restaurant)
-class RestaurantAdmin(admin.ModelAdmin):
+class RestaurantAdmin(PerformanceAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'address', 'phone_number')
     search_fields = ('name',)
+    indexed_search_fields = {'name': 'prefix'}
 
 @admin.register(MenuItem)
-class MenuItemAdmin(admin.ModelAdmin):
+class MenuItemAdmin(PerformanceAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'restaurant', 'price')
+    list_select_related = ('restaurant',)
     list_filter = ('restaurant',)
     search_fields = ('name', 'restaurant__name')
+    indexed_search_fields = {'name': 'prefix', 'sku': 'exact', 'restaurant__name': 'prefix'}
+    autocomplete_fields = ('restaurant',)
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(PerformanceAdminMixin, admin.ModelAdmin):
     list_display = ('order_code', 'customer', 'restaurant', 'status', 'total_price', 'created_at')
+    list_select_related = ('customer', 'restaurant')
     list_filter = ('status', 'restaurant')
     search_fields = ('order_code', 'customer__username', 'restaurant__name')
+    indexed_search_fields = {'order_code': 'upper', 'customer__username': 'prefix', 'restaurant__name': 'prefix'}
+    autocomplete_fields = ('customer', 'restaurant')
     readonly_fields = ('created_at',)
 
@@ -0,0 +1,125 @@
+"""
+Work queue of the orders waiting for approval, shared by the sub-admins.
+
+POST /api/orders/claim/ hands a sub-admin the oldest Pending Approval orders
+nobody else holds, across all shards, and leases them to them for
+APPROVAL_CLAIM_SECONDS, so two sub-admins never review the same order. A claim
+ends when the order leaves Pending Approval, when it is released, or when the
+lease runs out (the sub-admin closed the page), after which the order goes to
+the next claimer.
+
+Where the database has row locks (PostgreSQL) the candidates are read with
+SELECT ... FOR UPDATE SKIP LOCKED: concurrent claimers skip each other's rows
+instead of waiting on them, so claiming scales with the number of sub-admins.
+SQLite has no row locks; there each row is taken with a conditional UPDATE
+that only matches it while it is still free, so of two claimers one gets it.
+"""
+import heapq
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Order
+
+# Claimers that lost a race on SQLite try the next candidates this many times
+CLAIM_ATTEMPTS = 3
+
+
+def claimable(user, now):
+    """Orders waiting for approval that are free, or already the user's"""
+    return Order.objects.filter(status='Pending Approval').filter(
+        Q(claimed_by__isnull=True) | Q(claim_expires_at__lt=now) | Q(claimed_by=user)
+    ).order_by('created_at', 'id')
+
+
+def claim(user, limit, aliases=('default',)):
+    """
+    Lease up to `limit` orders to `user`, oldest first across the databases in
+    `aliases`. Returns (orders, lease end).
+    """
+    now = timezone.now()
+    expires = now + timedelta(seconds=settings.APPROVAL_CLAIM_SECONDS)
+
+    if len(aliases) == 1:
+        quotas = {aliases[0]: limit}
+    else:
+        # The oldest candidates of each database, merged by age, say how many to
+        # take from each; otherwise the first one's backlog would starve the others
+        pages = [
+            [
+                (created_at, pk, alias)
+                for created_at, pk in claimable(user, now).using(alias).values_list('created_at', 'id')[:limit]
+            ]
+            for alias in aliases
+        ]
+        quotas = {}
+        for _, _, alias in islice(heapq.merge(*pages), limit):
+            quotas[alias] = quotas.get(alias, 0) + 1
+
+    claimed = []
+    for alias, quota in quotas.items():
+        if connections[alias].features.has_select_for_update_skip_locked:
+            ids = _claim_locked(user, quota, now, expires, alias)
+        else:
+            ids = _claim_conditional(user, quota, now, expires, alias)
+        if ids:
+            claimed.append(
+                Order.objects.using(alias).filter(pk__in=ids).order_by('created_at', 'id').select_related(
+                    'customer', 'restaurant'
+                ).prefetch_related('orderitem_set__menu_item', 'orderitem_set__addon')
+            )
+    return list(heapq.merge(*claimed, key=lambda order: (order.created_at, order.pk))), expires
+
+
+def _claim_locked(user, limit, now, expires, alias):
+    with transaction.atomic(using=alias):
+        ids = list(
+            claimable(user, now).using(alias).select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:limit]
+        )
+        Order.objects.using(alias).filter(pk__in=ids).update(claimed_by=user, claim_expires_at=expires)
+    return ids
+
+
+def _claim_conditional(user, limit, now, expires, alias):
+    ids = []
+    for _ in range(CLAIM_ATTEMPTS):
+        candidates = list(
+            claimable(user, now).using(alias).exclude(pk__in=ids).values_list('id', flat=True)[:limit - len(ids)]
+        )
+        if not candidates:
+            break
+        # Only rows still free when the UPDATE runs; a single statement is atomic on SQLite
+        claimable(user, now).using(alias).filter(pk__in=candidates).update(claimed_by=user, claim_expires_at=expires)
+        ids += Order.objects.using(alias).filter(
+            pk__in=candidates, claimed_by=user, claim_expires_at=expires
+        ).values_list('id', flat=True)
+        if len(ids) >= limit:
+            break
+    return ids
+
+
+def hold(order, user):
+    """
+    Whether the user may change an order waiting for approval: in one
+    conditional UPDATE, that no other sub-admin's lease on it is running. The
+    UPDATE also locks the row (the whole database on SQLite), so call this in
+    the transaction making the change and nobody can claim it meanwhile.
+    """
+    # A write that changes nothing but takes the lock while the row still matches
+    return bool(
+        claimable(user, timezone.now()).using(order._state.db).filter(pk=order.pk)
+        .update(status='Pending Approval')
+    )
+
+
+def release(order, user):
+    """Give back the user's claim on an order. Returns whether they held it."""
+    return bool(
+        Order.objects.using(order._state.db).filter(pk=order.pk, claimed_by=user)
+        .update(claimed_by=None, claim_expires_at=None)
+    )
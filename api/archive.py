@@ -0,0 +1,49 @@
+"""
+Hot/cold storage for orders. Finished orders older than ORDER_ARCHIVE_DAYS are
+moved, with their items and activity log, into the Archived* tables in short
+transactions. OrderViewSet reads the archive when asked for ?archived=1.
+"""
+from django.db import router, transaction
+
+from .models import Order, OrderItem, ActivityLog, ArchivedOrder, ArchivedOrderItem, ArchivedActivityLog
+
+ARCHIVABLE_STATUSES = ('Completed', 'Cancelled')
+
+ORDER_FIELDS = ('id', 'customer_id', 'restaurant_id', 'total_price', 'status', 'payment_proof',
+                'order_code', 'created_at', 'ready_for_pickup_at')
+ORDER_ITEM_FIELDS = ('id', 'order_id', 'menu_item_id', 'addon_id', 'quantity')
+ACTIVITY_LOG_FIELDS = ('id', 'actor_id', 'restaurant_id', 'order_id', 'action_type', 'details', 'timestamp')
+
+
+def archivable_orders(cutoff):
+    return Order.objects.filter(status__in=ARCHIVABLE_STATUSES, created_at__lt=cutoff)
+
+
+def archive_batch(cutoff, batch_size):
+    """Move up to batch_size finished orders created before cutoff. Returns how many were moved."""
+    with transaction.atomic(using=router.db_for_write(Order)):
+        # Rows another archiver is working on are skipped (where the database supports it)
+        order_ids = list(
+            archivable_orders(cutoff).order_by('id')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return 0
+
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(**row) for row in Order.objects.filter(id__in=order_ids).values(*ORDER_FIELDS)
+        ])
+        ArchivedOrderItem.objects.bulk_create([
+            ArchivedOrderItem(**row)
+            for row in OrderItem.objects.filter(order_id__in=order_ids).values(*ORDER_ITEM_FIELDS)
+        ])
+        ArchivedActivityLog.objects.bulk_create([
+            ArchivedActivityLog(**row)
+            for row in ActivityLog.objects.filter(order_id__in=order_ids).values(*ACTIVITY_LOG_FIELDS)
+        ])
+
+        ActivityLog.objects.filter(order_id__in=order_ids).delete()
+        OrderItem.objects.filter(order_id__in=order_ids).delete()
+        Order.objects.filter(id__in=order_ids).delete()
+    return len(order_ids)
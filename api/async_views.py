@@ -0,0 +1,202 @@
+"""
+Async versions of the hottest read endpoints: the menu catalogue, order status
+polling and chat polling. They use Django's async ORM, so under ASGI (see
+food_ordering_backend/asgi.py) a slow client or query doesn't hold a worker.
+They also work under WSGI, just without that benefit.
+
+These are plain Django views, not DRF: DRF has no async support. They only
+accept JWT authentication, which is what the frontend uses, and are throttled
+like their DRF counterparts (api/throttling.py).
+"""
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from . import sharding, throttling
+from .authentication import JWTAuthentication
+from .context import UserContext
+from .filters import MenuItemFilter, MENU_ITEM_ORDERING
+from .models import User, MenuItem, Order, Conversation, ChatMessage
+
+_datetime_field = serializers.DateTimeField()
+
+
+class NotAuthenticated(Exception):
+    pass
+
+
+async def _get_user(request):
+    """Return the JWT user (with restaurant joined), or None for guests."""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    if header is None:
+        return None
+    raw_token = authentication.get_raw_token(header)
+    if raw_token is None:
+        return None
+    try:
+        token = authentication.get_validated_token(raw_token)
+        user_id = token[api_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        raise NotAuthenticated('Given token not valid for any token type')
+    try:
+        return await User.objects.select_related('restaurant').aget(
+            **{api_settings.USER_ID_FIELD: user_id}, is_active=True
+        )
+    except User.DoesNotExist:
+        raise NotAuthenticated('User not found')
+
+
+def _unauthorized(message='Authentication credentials were not provided.'):
+    return JsonResponse({'detail': message}, status=401)
+
+
+def _datetime(value):
+    return _datetime_field.to_representation(value) if value else None
+
+
+def _file_url(request, field):
+    return request.build_absolute_uri(default_storage.url(field.name)) if field else None
+
+
+# --- Menu Catalogue ---
+async def menu_items(request):
+    """Same rows and fields as GET /api/menu-items/, for guests and users alike"""
+    try:
+        user = await _get_user(request)
+    except NotAuthenticated as exc:
+        return _unauthorized(str(exc))
+    throttled = await throttling.throttle(request, user, 'catalogue')
+    if throttled is not None:
+        return throttled
+
+    queryset = MenuItem.objects.order_by('id')
+
+    restaurant_id = request.GET.get('restaurant')
+    if restaurant_id:
+        if not restaurant_id.isdigit():
+            return JsonResponse({'error': 'restaurant must be an id'}, status=400)
+        queryset = queryset.filter(restaurant_id=restaurant_id)
+    elif user is not None:
+        # As MenuItemViewSet.get_queryset: guests, customers and sub-admins see every item
+        context = UserContext(user)
+        if not (context.is_sub_admin or context.is_customer):
+            if not context.restaurant_id:
+                return JsonResponse([], safe=False)
+            restaurant_id = context.restaurant_id
+            queryset = queryset.filter(restaurant_id=restaurant_id)
+
+    # Price/rating ranges and ?ordering= as in api/filters.py; restaurant is handled above
+    filterset = MenuItemFilter({key: value for key, value in request.GET.items() if key != 'restaurant'}, queryset)
+    if not filterset.is_valid():
+        return JsonResponse(filterset.errors, status=400)
+    ordering = [
+        term for term in request.GET.get('ordering', '').split(',')
+        if term.strip().lstrip('-') in MENU_ITEM_ORDERING
+    ]
+    queryset = filterset.qs.order_by(*[term.strip() for term in ordering], 'id')
+
+    if sharding.enabled() and not restaurant_id:
+        # Every restaurant's items: each shard's, merged in their ordering
+        rows = await sync_to_async(sharding.fan_out)(queryset)
+    else:
+        if sharding.enabled():
+            queryset = queryset.using(await sync_to_async(sharding.shard_for)(restaurant_id))
+        rows = [item async for item in queryset]
+
+    items = [
+        {
+            'id': item.id,
+            'average_rating': item.average_rating,
+            'rating_count': item.rating_count,
+            'sku': item.sku,
+            'name': item.name,
+            'description': item.description,
+            'price': str(item.price),
+            'image': _file_url(request, item.image),
+            'restaurant': item.restaurant_id,
+        }
+        for item in rows
+    ]
+    return JsonResponse(items, safe=False)
+
+
+# --- Order Status ---
+async def order_status(request, pk):
+    """Just the fields the under-review page polls for, instead of the full order"""
+    try:
+        user = await _get_user(request)
+    except NotAuthenticated as exc:
+        return _unauthorized(str(exc))
+    if user is None:
+        return _unauthorized()
+    throttled = await throttling.throttle(request, user, 'orders')
+    if throttled is not None:
+        return throttled
+
+    # None (the router's choice) without shards
+    alias = await sync_to_async(sharding.locate)(pk, Order)
+    queryset = Order.objects.using(alias).filter(pk=pk)
+    if user.role == 'customer':
+        queryset = queryset.filter(customer=user)
+    elif user.role == 'restaurant_admin' and not user.is_superuser:
+        queryset = queryset.filter(restaurant_id=user.restaurant_id).exclude(
+            status__in=['Pending Payment', 'Pending Approval']
+        )
+    elif user.role != 'sub_admin' and not user.is_superuser:
+        queryset = queryset.none()
+
+    order = await queryset.values('id', 'order_code', 'status', 'ready_for_pickup_at').afirst()
+    if order is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    order['ready_for_pickup_at'] = _datetime(order['ready_for_pickup_at'])
+    return JsonResponse(order)
+
+
+# --- Chat Polling ---
+async def chat_messages(request):
+    """Messages of a conversation, optionally only those after ?after=<message id>"""
+    try:
+        user = await _get_user(request)
+    except NotAuthenticated as exc:
+        return _unauthorized(str(exc))
+    if user is None:
+        return _unauthorized()
+    throttled = await throttling.throttle(request, user, 'chat')
+    if throttled is not None:
+        return throttled
+
+    conversation_id = request.GET.get('conversation')
+    if not conversation_id:
+        return JsonResponse([], safe=False)
+    if not conversation_id.isdigit():
+        return JsonResponse({'error': 'conversation must be an id'}, status=400)
+
+    conversations = Conversation.objects.filter(pk=conversation_id)
+    if user.role == 'customer':
+        conversations = conversations.filter(customer=user)
+    if not await conversations.aexists():
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    queryset = ChatMessage.objects.filter(conversation_id=conversation_id).select_related('sender').order_by('timestamp')
+    after = request.GET.get('after')
+    if after:
+        if not after.isdigit():
+            return JsonResponse({'error': 'after must be a message id'}, status=400)
+        queryset = queryset.filter(id__gt=after)
+
+    messages = [
+        {
+            'id': message.id,
+            'conversation': message.conversation_id,
+            'sender': message.sender_id,
+            'sender_username': message.sender.username,
+            'message': message.message,
+            'timestamp': _datetime(message.timestamp),
+        }
+        async for message in queryset
+    ]
+    return JsonResponse(messages, safe=False)
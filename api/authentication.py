@@ -0,0 +1,23 @@
+from rest_framework_simplejwt import authentication
+
+from .models import User
+
+
+class _UserLookup:
+    """
+    The parts of the user model that simplejwt's get_user() touches, with the
+    restaurant joined into the same query.
+    """
+    DoesNotExist = User.DoesNotExist
+
+    @property
+    def objects(self):
+        return User.objects.select_related('restaurant')
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    """JWT authentication that loads the user together with their restaurant"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_model = _UserLookup()
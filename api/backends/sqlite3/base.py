@@ -0,0 +1,62 @@
+"""
+SQLite tuned for a small production deployment with several workers.
+
+Set as the ENGINE (settings.py does this for SQLite DATABASE_URLs unless
+SQLITE_TUNED=False). On top of Django's backend it:
+
+- applies PRAGMAS to every new connection: WAL, so readers never block the
+  writer or the other way round; synchronous=NORMAL, which is safe with WAL and
+  saves an fsync per commit; a busy_timeout, so a writer waits for the lock
+  instead of failing with "database is locked"; and memory-mapped I/O and a
+  bigger page cache;
+- starts transactions with BEGIN IMMEDIATE. A plain BEGIN takes the write lock
+  at the first write, and a transaction that read first and then can't get it
+  fails at once, busy_timeout or not. BEGIN IMMEDIATE takes the lock up front,
+  where busy_timeout applies, so writers queue for a short serialized section.
+
+OPTIONS can override a pragma ({'pragmas': {'mmap_size': 0}}) or set
+'transaction_mode' to DEFERRED or EXCLUSIVE.
+"""
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = {
+    # First, so switching to WAL while another worker does too waits as well
+    'busy_timeout': 5000,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative: in KiB, so 64 MB
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
+}
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # Ours, not sqlite3.connect()'s
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    @property
+    def pragmas(self):
+        return {**PRAGMAS, **self.settings_dict['OPTIONS'].get('pragmas', {})}
+
+    # Not `transaction_mode`: Django 5.1+ sets an attribute of that name itself
+    @property
+    def _begin_mode(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode', 'IMMEDIATE').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ValueError(f'transaction_mode must be one of {", ".join(TRANSACTION_MODES)}')
+        return mode
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self._begin_mode}')
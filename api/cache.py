@@ -0,0 +1,139 @@
+"""
+Versioned response caching for the read-heavy API endpoints.
+
+Every cached model has a version counter stored in the cache. Saving or deleting
+a row bumps its counter (see api/signals.py), and because the counters are part
+of every cache key, entries built from old data are simply never read again.
+"""
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+VERSION_KEY = 'api:version:{}'
+
+
+def _version_key(model):
+    return VERSION_KEY.format(model._meta.label_lower)
+
+
+def _initial_version():
+    # Start counters at the current time instead of 1, so a counter that was
+    # evicted never comes back with a value that old entries were built with.
+    return int(time.time() * 1000)
+
+
+def get_versions(models):
+    """Return the current version counter of each model, creating missing ones."""
+    keys = [_version_key(model) for model in models]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            # add() so two workers starting at the same time agree on one value
+            cache.add(key, _initial_version(), timeout=None)
+        found.update(cache.get_many(missing))
+    return [found.get(key, 0) for key in keys]
+
+
+def bump_version(model):
+    """Invalidate everything cached from this model."""
+    key = _version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), timeout=None)
+
+
+def make_key(prefix, models, *parts):
+    """Build a cache key that changes whenever any of the given models change."""
+    versions = '.'.join(str(version) for version in get_versions(models))
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'api:{prefix}:{versions}:{digest}'
+
+
+# --- Metrics ---
+class CacheStats:
+    """Hit/miss counters per cached endpoint. Counts are per process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, name, hit):
+        with self._lock:
+            counts = self._counts.setdefault(name, {'hits': 0, 'misses': 0})
+            counts['hits' if hit else 'misses'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for name, counts in self._counts.items():
+                total = counts['hits'] + counts['misses']
+                result[name] = {
+                    **counts,
+                    'hit_rate': round(counts['hits'] / total, 3) if total else 0,
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+stats = CacheStats()
+
+
+# --- ViewSet decorator ---
+def _user_scope(user):
+    # The cached viewsets filter by role and restaurant, never by the individual
+    # user, so this is enough to keep different users' results apart.
+    if not user.is_authenticated:
+        return 'anon'
+    return f'{user.role}:{user.restaurant_id}:{int(user.is_superuser)}'
+
+
+def _cached_action(method, models, timeout):
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        name = f'{type(self).__name__}.{method.__name__}'
+        key = make_key(
+            name, models,
+            request.get_host(), request.get_full_path(), _user_scope(request.user),
+        )
+
+        data = cache.get(key)
+        if data is not None:
+            stats.record(name, hit=True)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        stats.record(name, hit=False)
+        response = method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, timeout or settings.API_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+
+def cache_responses(*models, timeout=None, actions=('list', 'retrieve')):
+    """
+    Class decorator for viewsets: cache the responses of the read actions.
+
+    Pass every model the serialized output depends on; a change to any of them
+    invalidates the cached responses. Only use it on endpoints whose results
+    depend on the user's role and restaurant, not on the individual user.
+    """
+    def decorator(viewset_class):
+        for action_name in actions:
+            method = getattr(viewset_class, action_name, None)
+            if method is not None:
+                setattr(viewset_class, action_name, _cached_action(method, models, timeout))
+        return viewset_class
+    return decorator
@@ -0,0 +1,41 @@
+from functools import cached_property
+
+
+class UserContext:
+    """
+    Who is making the request, resolved once and kept on the request so the
+    views and serializers don't each go back to the database for it.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.is_authenticated = user.is_authenticated
+        self.role = getattr(user, 'role', None)
+        self.restaurant_id = getattr(user, 'restaurant_id', None)
+        self.is_superuser = getattr(user, 'is_superuser', False)
+
+    @cached_property
+    def restaurant(self):
+        # Already joined for JWT requests (see api/authentication.py)
+        return self.user.restaurant if self.restaurant_id else None
+
+    @property
+    def is_customer(self):
+        return self.role == 'customer'
+
+    @property
+    def is_restaurant_admin(self):
+        return self.role == 'restaurant_admin'
+
+    @property
+    def is_sub_admin(self):
+        """Sub-admins and superusers see everything"""
+        return self.role == 'sub_admin' or self.is_superuser
+
+
+def get_user_context(request):
+    context = getattr(request, '_user_context', None)
+    if context is None or context.user is not request.user:
+        context = UserContext(request.user)
+        request._user_context = context
+    return context
@@ -0,0 +1,130 @@
+"""
+Live counters for the admin dashboards: open orders per status and open support
+conversations, per restaurant and for all restaurants.
+
+Order.save()/delete() and Conversation.save()/delete() change the counters in
+the same transaction as the row, with UPDATE ... SET value = value + n, so a
+dashboard reads them (GET /api/dashboard-counters/) in one indexed query
+instead of listing and counting orders. Only the open statuses are counted:
+finished orders never change them, so archiving doesn't either.
+
+With database shards each shard has its own all-restaurants rows for the
+restaurants on it; a sub-admin's read adds them up. Open conversations are
+counted on 'default', where the chat lives.
+
+Updates made behind the models' backs (queryset.update(), cascades from a
+deleted customer) make the counters drift; `manage.py reconcile_dashboard_counters`
+recounts them.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import DashboardCounter, Order, Conversation
+
+# Order status -> counter name
+ORDER_COUNTERS = {
+    'Pending Payment': 'pending_payment',
+    'Pending Approval': 'pending_approval',
+    'Preparing': 'preparing',
+    'Ready for Pickup': 'ready_for_pickup',
+}
+OPEN_CONVERSATIONS = 'open_conversations'
+# Restaurant admins don't see orders before a sub-admin approved them
+RESTAURANT_ADMIN_COUNTERS = ('preparing', 'ready_for_pickup')
+
+
+def add(restaurant_id, changes, using):
+    """Add {counter name: delta} to a restaurant's counters (None for the all-restaurants ones)"""
+    counters = DashboardCounter.objects.using(using)
+    for name, delta in changes.items():
+        if not delta:
+            continue
+        row = counters.filter(restaurant_id=restaurant_id, name=name)
+        if not row.update(value=F('value') + delta):
+            # First change of this counter; another transaction may be creating it too
+            counters.bulk_create([DashboardCounter(restaurant_id=restaurant_id, name=name)], ignore_conflicts=True)
+            row.update(value=F('value') + delta)
+
+
+def order_status_changed(order, previous_status):
+    """Count a new order, or an order that moved from previous_status to its status"""
+    changes = Counter()
+    if previous_status in ORDER_COUNTERS:
+        changes[ORDER_COUNTERS[previous_status]] -= 1
+    if order.status in ORDER_COUNTERS:
+        changes[ORDER_COUNTERS[order.status]] += 1
+    _add_order_changes(order, changes)
+
+
+def order_deleted(order):
+    if order.status in ORDER_COUNTERS:
+        _add_order_changes(order, {ORDER_COUNTERS[order.status]: -1})
+
+
+def _add_order_changes(order, changes):
+    # Always in the same order, so two transactions can't each hold the row the other wants
+    add(None, changes, order._state.db)
+    add(order.restaurant_id, changes, order._state.db)
+
+
+def conversation_changed(delta, using):
+    add(None, {OPEN_CONVERSATIONS: delta}, using)
+
+
+# --- Reading ---
+def read(restaurant_id=None, aliases=('default',), names=None):
+    """
+    {counter name: value} of a restaurant, or of all restaurants if None, summed
+    over the shards in `aliases`. Counters never changed read as 0.
+    """
+    names = names or (*ORDER_COUNTERS.values(), OPEN_CONVERSATIONS)
+    values = dict.fromkeys(names, 0)
+    for alias in aliases:
+        rows = DashboardCounter.objects.using(alias).filter(restaurant_id=restaurant_id, name__in=names)
+        for name, value in rows.values_list('name', 'value'):
+            values[name] += value
+    return values
+
+
+# --- Reconciling ---
+def actual_counts(using):
+    """{(restaurant id or None, counter name): value} counted from the orders and conversations"""
+    counts = Counter()
+    rows = (
+        Order.objects.using(using).filter(status__in=ORDER_COUNTERS).order_by()
+        .values_list('restaurant_id', 'status').annotate(count=Count('id'))
+    )
+    for restaurant_id, status, count in rows:
+        counts[restaurant_id, ORDER_COUNTERS[status]] += count
+        counts[None, ORDER_COUNTERS[status]] += count
+    if using == 'default':
+        counts[None, OPEN_CONVERSATIONS] = Conversation.objects.using(using).filter(is_open=True).count()
+    return counts
+
+
+def reconcile(using='default'):
+    """
+    Correct the counters of a database to the actual counts. Returns
+    [(restaurant id, counter name, old value, new value)] of the ones corrected.
+    """
+    corrections = []
+    with transaction.atomic(using=using):
+        # Locked first: a transaction changing a counter either committed before
+        # the count below, or waits and adds its change to the corrected value
+        stored = {
+            (row.restaurant_id, row.name): row
+            for row in DashboardCounter.objects.using(using).select_for_update()
+        }
+        counts = actual_counts(using)
+        for key in stored.keys() | counts.keys():
+            row, value = stored.get(key), counts.get(key, 0)
+            if (row.value if row is not None else 0) == value:
+                continue
+            if row is None:
+                DashboardCounter.objects.using(using).create(restaurant_id=key[0], name=key[1], value=value)
+            else:
+                DashboardCounter.objects.using(using).filter(pk=row.pk).update(value=value)
+            corrections.append((*key, row.value if row is not None else 0, value))
+    return corrections
@@ -0,0 +1,154 @@
+"""
+Preparation time estimates for pickup ETAs.
+
+Each restaurant has a PrepTimeSketch per hour of the day (plus one for all
+hours) holding P² estimators (Jain & Chlamtac, 1985) of the median and 90th
+percentile of its preparation time, order placed -> ready for pickup. An
+estimator is five numbers that are updated as each order becomes ready, so
+neither updating nor reading an estimate looks at past orders.
+"""
+from datetime import timedelta
+
+from django.db import router, transaction
+
+from .models import PrepTimeSketch
+
+QUANTILES = (0.5, 0.9)
+# Below this many orders an hour's own estimate is too noisy, use the all-hours one
+MIN_SAMPLES = 20
+# Orders in these states are still waiting to be ready for pickup
+WAITING_STATUSES = ('Pending Approval', 'Preparing')
+
+
+class P2Quantile:
+    """Streaming estimate of one quantile in constant space (the P² algorithm)"""
+
+    def __init__(self, p, heights=None, positions=None, desired=None):
+        self.p = p
+        self.heights = heights or []
+        self.positions = positions or [1, 2, 3, 4, 5]
+        self.desired = desired or [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        heights, positions = self.heights, self.positions
+        if len(heights) < 5:
+            # The first five observations are kept as they are
+            heights.append(x)
+            heights.sort()
+            return
+
+        if x < heights[0]:
+            heights[0] = x
+            cell = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            cell = 3
+        else:
+            cell = next(i for i in range(4) if heights[i] <= x < heights[i + 1])
+
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            offset = self.desired[i] - positions[i]
+            if ((offset >= 1 and positions[i + 1] - positions[i] > 1)
+                    or (offset <= -1 and positions[i - 1] - positions[i] < -1)):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, step)
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i, step):
+        q, n = self.heights, self.positions
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def _linear(self, i, step):
+        q, n = self.heights, self.positions
+        return q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+
+    def value(self):
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            return self.heights[min(len(self.heights) - 1, int(self.p * len(self.heights)))]
+        return self.heights[2]
+
+    def to_dict(self):
+        return {'heights': self.heights, 'positions': self.positions, 'desired': self.desired}
+
+    @classmethod
+    def from_dict(cls, p, data):
+        return cls(p, **data) if data else cls(p)
+
+
+def prep_seconds(order):
+    if not order.ready_for_pickup_at:
+        return None
+    return max(0.0, (order.ready_for_pickup_at - order.created_at).total_seconds())
+
+
+def add_sample(sketch, seconds):
+    """Add one preparation time (seconds) to a sketch, without saving it"""
+    for p in QUANTILES:
+        estimator = P2Quantile.from_dict(p, sketch.state.get(str(p)))
+        estimator.add(seconds)
+        sketch.state[str(p)] = estimator.to_dict()
+    sketch.count += 1
+
+
+def record(order):
+    """Add an order that just became ready for pickup to its restaurant's sketches"""
+    seconds = prep_seconds(order)
+    if seconds is None:
+        return
+    db = router.db_for_write(PrepTimeSketch, instance=order)
+    sketches = PrepTimeSketch.objects.db_manager(db)
+    with transaction.atomic(using=db):
+        for hour in (order.created_at.hour, PrepTimeSketch.ALL_HOURS):
+            sketches.get_or_create(restaurant_id=order.restaurant_id, hour=hour)
+            # Locked so two orders becoming ready at once don't lose an update
+            sketch = sketches.select_for_update().get(
+                restaurant_id=order.restaurant_id, hour=hour
+            )
+            add_sample(sketch, seconds)
+            sketch.save(update_fields=['state', 'count', 'updated_at'])
+
+
+def estimate(order):
+    """
+    p50/p90 preparation time and ready-at estimates for an order that is still
+    waiting, or None. Reads at most two sketch rows by their unique key.
+    """
+    if order.status not in WAITING_STATUSES:
+        return None
+    sketches = {
+        sketch.hour: sketch
+        for sketch in PrepTimeSketch.objects.filter(
+            restaurant_id=order.restaurant_id, hour__in=(order.created_at.hour, PrepTimeSketch.ALL_HOURS)
+        )
+    }
+    sketch = sketches.get(order.created_at.hour)
+    if sketch is None or sketch.count < MIN_SAMPLES:
+        sketch = sketches.get(PrepTimeSketch.ALL_HOURS)
+    if sketch is None or not sketch.count:
+        return None
+
+    p50 = P2Quantile.from_dict(0.5, sketch.state.get('0.5')).value()
+    p90 = P2Quantile.from_dict(0.9, sketch.state.get('0.9')).value()
+    return {
+        'p50_minutes': round(p50 / 60, 1),
+        'p90_minutes': round(p90 / 60, 1),
+        'p50_ready_at': order.created_at + timedelta(seconds=p50),
+        'p90_ready_at': order.created_at + timedelta(seconds=p90),
+        'samples': sketch.count,
+        'hourly': sketch.hour != PrepTimeSketch.ALL_HOURS,
+    }
@@ -0,0 +1,71 @@
+"""
+Query string filters for the list endpoints, e.g.
+    /api/menu-items/?restaurant=3&min_price=50&max_price=200&min_rating=4&ordering=-average_rating
+    /api/orders/?status=Preparing&status=Ready+for+Pickup&created_after=2026-10-01&ordering=created_at
+
+Each filter and ordering is backed by an index in api/models.py. Rating filters
+and sorts use MenuItem.average_rating/rating_count, kept current by
+refresh_rating_aggregates(), so no rating is averaged per request.
+"""
+from django_filters import rest_framework as filters
+
+from .models import MenuItem, Addon, Order, ArchivedOrder, Rating
+
+# Fields ?ordering= accepts (with - for descending); -id is newest first
+MENU_ITEM_ORDERING = ['price', 'average_rating', 'rating_count', 'name', 'id']
+ADDON_ORDERING = ['price', 'name', 'id']
+ORDER_ORDERING = ['created_at', 'total_price', 'status']
+RATING_ORDERING = ['created_at', 'stars']
+
+
+class MenuItemFilter(filters.FilterSet):
+    min_price = filters.NumberFilter(field_name='price', lookup_expr='gte')
+    max_price = filters.NumberFilter(field_name='price', lookup_expr='lte')
+    min_rating = filters.NumberFilter(field_name='average_rating', lookup_expr='gte')
+    max_rating = filters.NumberFilter(field_name='average_rating', lookup_expr='lte')
+    min_rating_count = filters.NumberFilter(field_name='rating_count', lookup_expr='gte')
+
+    class Meta:
+        model = MenuItem
+        fields = ['restaurant']
+
+
+class AddonFilter(filters.FilterSet):
+    min_price = filters.NumberFilter(field_name='price', lookup_expr='gte')
+    max_price = filters.NumberFilter(field_name='price', lookup_expr='lte')
+
+    class Meta:
+        model = Addon
+        fields = ['restaurant']
+
+
+class OrderFilter(filters.FilterSet):
+    # ?status=A&status=B for several
+    status = filters.MultipleChoiceFilter(choices=Order.STATUS_CHOICES)
+    # A date alone means its midnight
+    created_after = filters.DateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = filters.DateTimeFilter(field_name='created_at', lookup_expr='lt')
+    min_total = filters.NumberFilter(field_name='total_price', lookup_expr='gte')
+    max_total = filters.NumberFilter(field_name='total_price', lookup_expr='lte')
+
+    class Meta:
+        model = Order
+        fields = ['restaurant', 'customer']
+
+
+class ArchivedOrderFilter(OrderFilter):
+    class Meta:
+        model = ArchivedOrder
+        fields = ['restaurant', 'customer']
+
+
+class RatingFilter(filters.FilterSet):
+    min_stars = filters.NumberFilter(field_name='stars', lookup_expr='gte')
+    max_stars = filters.NumberFilter(field_name='stars', lookup_expr='lte')
+    restaurant = filters.NumberFilter(field_name='menu_item__restaurant')
+    created_after = filters.DateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = filters.DateTimeFilter(field_name='created_at', lookup_expr='lt')
+
+    class Meta:
+        model = Rating
+        fields = ['menu_item', 'stars']
@@ -0,0 +1,292 @@
+"""
+Production build of frontend/ (`manage.py build_frontend`).
+
+frontend/ is written by hand and works as it is from any static server. The
+build:
+
+- moves each page's large inline <script> blocks to files of their own, so a
+  browser downloads them once instead of with every page view;
+- minifies the JavaScript and CSS;
+- collects the result, with the admin and DRF static files, into STATIC_ROOT
+  through WhiteNoise's CompressedManifestStaticFilesStorage: every file gets
+  its content hash in its name (style.css -> style.3e1f0a9c2b4d.css) and gzip
+  (and, with the Brotli package installed, brotli) versions next to it;
+- rewrites the pages to reference the hashed names, and compresses them too.
+
+WhiteNoise serves hashed names with a far-future, immutable Cache-Control, so
+returning browsers only download files that changed. The pages keep their
+names and are served from FRONTEND_BUILD_DIR/pages at / with a short max-age.
+"""
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+from urllib.parse import quote
+
+from django.conf import settings
+
+# Built assets are collected under this prefix (see STATICFILES_DIRS)
+STATIC_PREFIX = 'frontend'
+# Smaller inline scripts are not worth a request of their own
+INLINE_SCRIPT_MIN_BYTES = 1024
+
+SCRIPT_RE = re.compile(r'<script>(.*?)</script>', re.S | re.I)
+REFERENCE_RE = re.compile(r'''(\s(?:src|href)=)(["'])([^"']+)\2''', re.I)
+IDENTIFIER_CHARS = re.compile(r'[\w$\u0080-\uffff]')
+# After these a "/" starts a regular expression rather than a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = {
+    'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw', 'instanceof',
+    'yield', 'await',
+}
+
+
+# --- Minifying ---
+def _quoted_end(source, start):
+    """Index after the '...' or "..." string starting at `start`"""
+    quote_char, i = source[start], start + 1
+    while i < len(source) and source[i] not in (quote_char, '\n'):
+        i += 2 if source[i] == '\\' else 1
+    return i + 1
+
+
+def _template_end(source, start):
+    """Index after the `...` template literal starting at `start`, ${} included"""
+    i = start + 1
+    while i < len(source):
+        if source[i] == '\\':
+            i += 2
+        elif source[i] == '`':
+            return i + 1
+        elif source.startswith('${', i):
+            i = _expression_end(source, i + 2)
+        else:
+            i += 1
+    return i
+
+
+def _expression_end(source, start):
+    """Index after the } closing a template literal's ${ expression"""
+    depth, i = 1, start
+    while i < len(source):
+        char = source[i]
+        if char in '\'"':
+            i = _quoted_end(source, i)
+            continue
+        if char == '`':
+            i = _template_end(source, i)
+            continue
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if not depth:
+                return i + 1
+        i += 1
+    return i
+
+
+def _regex_end(source, start):
+    """Index after the /.../flags regular expression literal starting at `start`"""
+    i, in_class = start + 1, False
+    while i < len(source) and source[i] != '\n':
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            i += 1
+            while i < len(source) and IDENTIFIER_CHARS.match(source[i]):
+                i += 1
+            return i
+        i += 1
+    return i
+
+
+def _starts_regex(output):
+    text = ''.join(output[-20:]).rstrip()
+    if not text:
+        return True
+    if text.endswith(('++', '--')):
+        # i++ / 2: after a postfix operator it's a division
+        return not re.search(r'[\w$)\]]\s*(\+\+|--)$', text)
+    if text[-1] in REGEX_PRECEDERS:
+        return True
+    word = re.search(r'[\w$]+$', text)
+    return bool(word) and word.group() in REGEX_KEYWORDS
+
+
+def minify_js(source):
+    """
+    Drop comments and indentation and collapse whitespace, leaving strings,
+    template literals and regular expressions as they are. Line breaks are only
+    removed where automatic semicolon insertion can't depend on them (after
+    { ; , ( [ and before ) ] }), so the code means exactly the same.
+
+    Whether a / starts a regular expression is decided from what precedes it,
+    without parsing: one straight after `)`, as in `if (x) /re/.test(s)`, is
+    taken for a division, so write such a test the other way round.
+    """
+    output = []
+    i, length = 0, len(source)
+    while i < length:
+        char = source[i]
+        if char in '\'"':
+            end = _quoted_end(source, i)
+        elif char == '`':
+            end = _template_end(source, i)
+        elif char.isspace() or source.startswith(('//', '/*'), i):
+            # Whitespace and comments: at most one space or line break
+            end, newline = i, False
+            while end < length:
+                if source[end].isspace():
+                    newline = newline or source[end] == '\n'
+                    end += 1
+                elif source.startswith('//', end):
+                    close = source.find('\n', end)
+                    end = length if close == -1 else close
+                elif source.startswith('/*', end):
+                    close = source.find('*/', end + 2)
+                    close = length if close == -1 else close + 2
+                    newline = newline or '\n' in source[end:close]
+                    end = close
+                else:
+                    break
+            previous = output[-1][-1] if output else ''
+            following = source[end] if end < length else ''
+            if newline:
+                if previous and previous not in '{;,([\n' and following not in ')]}':
+                    output.append('\n')
+            elif (IDENTIFIER_CHARS.match(previous) and IDENTIFIER_CHARS.match(following)) or (
+                    previous and previous in '+-' and following in ('+', '-')):
+                output.append(' ')
+            i = end
+            continue
+        elif char == '/' and _starts_regex(output):
+            end = _regex_end(source, i)
+        else:
+            end = i + 1
+        output.append(source[i:end])
+        i = end
+    return ''.join(output).strip() + '\n'
+
+
+def minify_css(source):
+    """Drop comments and collapse whitespace, leaving strings as they are"""
+    parts = re.split(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''', source)
+    for index in range(0, len(parts), 2):
+        text = re.sub(r'/\*.*?\*/', '', parts[index], flags=re.S)
+        text = re.sub(r'\s+', ' ', text)
+        text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+        text = re.sub(r':\s+', ':', text)
+        parts[index] = text.replace(';}', '}')
+    return ''.join(parts).strip() + '\n'
+
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+
+# --- Pages ---
+def extract_scripts(html, name):
+    """
+    Replace the page's large inline scripts with <script src> tags. Returns the
+    new html and {relative path: script} of the scripts taken out.
+    """
+    scripts = {}
+
+    def replace(match):
+        if len(match.group(1).strip()) < INLINE_SCRIPT_MIN_BYTES:
+            return match.group(0)
+        path = f'pages/{name}.js' if not scripts else f'pages/{name}-{len(scripts) + 1}.js'
+        scripts[path] = match.group(1)
+        return f'<script src="{path}"></script>'
+
+    return SCRIPT_RE.sub(replace, html), scripts
+
+
+def rewrite_references(html, urls):
+    """Point src/href attributes at built assets to their hashed URLs"""
+    def replace(match):
+        url = urls.get(match.group(3))
+        if url is None:
+            return match.group(0)
+        return f'{match.group(1)}{match.group(2)}{url}{match.group(2)}'
+
+    return REFERENCE_RE.sub(replace, html)
+
+
+# --- Build ---
+def collect_static():
+    """collectstatic into STATIC_ROOT with hashed names; returns the manifest's paths"""
+    result = subprocess.run(
+        [sys.executable, 'manage.py', 'collectstatic', '--noinput', '--clear', '-v0'],
+        cwd=settings.BASE_DIR, env={**os.environ, 'STATIC_MANIFEST': 'True'}, capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f'collectstatic failed:\n{result.stderr}')
+    with open(settings.STATIC_ROOT / 'staticfiles.json') as manifest:
+        return json.load(manifest)['paths']
+
+
+def build():
+    """Build frontend/ into FRONTEND_BUILD_DIR and STATIC_ROOT, returns size statistics"""
+    from whitenoise.compress import Compressor
+
+    source, target = settings.FRONTEND_DIR, settings.FRONTEND_BUILD_DIR
+    assets, pages = target / 'assets', target / 'pages'
+    shutil.rmtree(target, ignore_errors=True)
+    pages.mkdir(parents=True)
+    stats = {'pages': 0, 'assets': 0, 'source_bytes': 0, 'minified_bytes': 0, 'gzip_bytes': 0}
+
+    def write_asset(path, data):
+        destination = assets / path
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        destination.write_text(data, encoding='utf-8')
+        stats['assets'] += 1
+        stats['minified_bytes'] += len(data.encode())
+
+    html = {}
+    for path in sorted(source.rglob('*')):
+        if not path.is_file():
+            continue
+        relative = path.relative_to(source).as_posix()
+        if path.suffix == '.html':
+            html[relative], scripts = extract_scripts(path.read_text(encoding='utf-8'), path.stem)
+            for script_path, script in scripts.items():
+                stats['source_bytes'] += len(script.encode())
+                write_asset(script_path, minify_js(script))
+        elif path.suffix in MINIFIERS:
+            text = path.read_text(encoding='utf-8')
+            stats['source_bytes'] += len(text.encode())
+            write_asset(relative, MINIFIERS[path.suffix](text))
+        else:
+            destination = assets / relative
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(path, destination)
+            stats['assets'] += 1
+
+    manifest = collect_static()
+    urls = {}
+    for name, hashed in manifest.items():
+        if name.startswith(f'{STATIC_PREFIX}/'):
+            relative = name[len(STATIC_PREFIX) + 1:]
+            urls[relative] = urls[quote(relative)] = settings.STATIC_URL + quote(hashed)
+            if relative.endswith(('.js', '.css')):
+                compressed = settings.STATIC_ROOT / f'{hashed}.gz'
+                if compressed.exists():
+                    stats['gzip_bytes'] += compressed.stat().st_size
+
+    compressor = Compressor(quiet=True)
+    for relative, page in html.items():
+        destination = pages / relative
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        destination.write_text(rewrite_references(page, urls), encoding='utf-8')
+        compressor.compress(str(destination))
+        stats['pages'] += 1
+    return stats
@@ -0,0 +1,128 @@
+"""
+Idempotency-Key support for unsafe requests.
+
+A client that may retry a request (checkout on a flaky mobile network) sends
+the same Idempotency-Key header with every attempt. The first attempt claims the
+key through the unique constraint on IdempotencyKey and runs the view; its
+response is stored and replayed for every retry until the key expires, so a
+retry costs one lookup instead of another order write. A retry arriving while
+the first attempt is still running gets 409 with Retry-After.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# A key still marked in progress after this long belongs to a request whose
+# worker died; the next retry takes it over
+ABANDONED_AFTER = timedelta(minutes=1)
+
+
+def _fingerprint(request):
+    """Hash of what the request asks for, to catch a key reused for a different request"""
+    data = request.data
+    if hasattr(data, 'lists'):
+        items = sorted(data.lists())
+    else:
+        items = sorted(data.items()) if isinstance(data, dict) else data
+
+    def describe(value):
+        # Uploaded files are compared by name and size, not read again
+        if isinstance(value, UploadedFile):
+            return ['file', value.name, value.size]
+        return str(value)
+
+    payload = json.dumps(
+        [request.method, request.path, items], default=describe, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return Response(
+            {'error': f'{HEADER} was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if record.status_code is None:
+        return Response(
+            {'error': f'A request with this {HEADER} is still being processed'},
+            status=status.HTTP_409_CONFLICT,
+            headers={'Retry-After': '1'},
+        )
+    return Response(record.response_body, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def _claim(user, key, fingerprint):
+    """Create the key record; return the existing one instead if another request has it"""
+    now = timezone.now()
+    # A key is only reused after it expires, at which point it starts over
+    IdempotencyKey.objects.filter(user=user, key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=fingerprint, created_at=now,
+                expires_at=now + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS),
+            )
+        return None
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(user=user, key=key).first()
+
+
+def idempotent(view_method):
+    """
+    Decorator for viewset actions. Requests without the Idempotency-Key header,
+    or from anonymous users, run as usual.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = _fingerprint(request)
+        # Fast path for retries: one indexed lookup
+        record = IdempotencyKey.objects.filter(
+            user=request.user, key=key, expires_at__gt=timezone.now()
+        ).first()
+        if (record is not None and record.status_code is None
+                and record.created_at < timezone.now() - ABANDONED_AFTER):
+            IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True).delete()
+            record = None
+        if record is None:
+            record = _claim(request.user, key, fingerprint)
+        if record is not None:
+            return _replay(record, fingerprint)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            # Nothing to replay; let the client try again with the same key
+            IdempotencyKey.objects.filter(user=request.user, key=key).delete()
+            raise
+
+        if response.status_code >= 500 or not hasattr(response, 'data'):
+            IdempotencyKey.objects.filter(user=request.user, key=key).delete()
+        else:
+            IdempotencyKey.objects.filter(user=request.user, key=key).update(
+                status_code=response.status_code, response_body=response.data
+            )
+        return response
+
+    return wrapper
@@ -0,0 +1,185 @@
+"""
+Helpers for the load-testing management commands: running the app under
+gunicorn (sync workers) or uvicorn (ASGI), a minimal asyncio HTTP client that
+can hold hundreds of connections from one process, and latency statistics.
+"""
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+SERVER_KINDS = ('gunicorn', 'uvicorn')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(kind, port, workers):
+    if kind == 'gunicorn':
+        return [
+            sys.executable, '-m', 'gunicorn', 'food_ordering_backend.wsgi:application',
+            '--workers', str(workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+        ]
+    if kind == 'uvicorn':
+        return [
+            sys.executable, '-m', 'uvicorn', 'food_ordering_backend.asgi:application',
+            '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port),
+            '--log-level', 'warning',
+        ]
+    raise ValueError(f'Unknown server kind: {kind}')
+
+
+class Server:
+    """Run the app in a subprocess for the duration of a `with` block."""
+
+    def __init__(self, kind, workers=2, env=None, startup_timeout=30, stderr=None):
+        self.kind = kind
+        self.workers = workers
+        self.port = free_port()
+        self.env = {**os.environ, **(env or {})}
+        self.startup_timeout = startup_timeout
+        # A file for the server's log (its errors), inherited by default
+        self.stderr = stderr
+        self.process = None
+
+    @property
+    def address(self):
+        return ('127.0.0.1', self.port)
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            server_command(self.kind, self.port, self.workers),
+            cwd=settings.BASE_DIR, env=self.env, stderr=self.stderr,
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'{self.kind} exited with code {self.process.returncode}')
+            try:
+                socket.create_connection(self.address, timeout=0.5).close()
+                return self
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError(f'{self.kind} did not start within {self.startup_timeout}s')
+
+    def __exit__(self, *exc_info):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+# --- HTTP client ---
+class HTTPResponse:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+async def request(address, method, path, headers=None, body=None, timeout=30):
+    """
+    One HTTP/1.1 request on a fresh connection. `body` may be bytes or a
+    JSON-serializable object.
+    """
+    headers = dict(headers or {})
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+        headers.setdefault('Content-Type', 'application/json')
+    body = body or b''
+
+    host, port = address
+    head = [f'{method} {path} HTTP/1.1', f'Host: {host}:{port}', 'Connection: close',
+            f'Content-Length: {len(body)}']
+    head += [f'{name}: {value}' for name, value in headers.items()]
+
+    async def exchange():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+            raw = await reader.read()
+        finally:
+            writer.close()
+        header_block, _, payload = raw.partition(b'\r\n\r\n')
+        lines = header_block.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        response_headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        if response_headers.get('transfer-encoding') == 'chunked':
+            payload = _dechunk(payload)
+        return HTTPResponse(status, response_headers, payload)
+
+    return await asyncio.wait_for(exchange(), timeout)
+
+
+def _dechunk(payload):
+    body = b''
+    while payload:
+        size_line, _, payload = payload.partition(b'\r\n')
+        size = int(size_line.split(b';')[0], 16)
+        if size == 0:
+            break
+        body += payload[:size]
+        payload = payload[size + 2:]
+    return body
+
+
+# --- Statistics ---
+def percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+class Stats:
+    """Latency samples and outcomes, grouped by phase (endpoint, flow step...)"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+        self.started = time.monotonic()
+
+    def record(self, phase, seconds, outcome='ok'):
+        self.latencies[phase].append(seconds)
+        self.outcomes[phase][outcome] += 1
+
+    def summary(self, elapsed=None):
+        elapsed = elapsed or (time.monotonic() - self.started)
+        result = {}
+        for phase, samples in self.latencies.items():
+            outcomes = dict(self.outcomes[phase])
+            total = len(samples)
+            errors = total - outcomes.get('ok', 0)
+            result[phase] = {
+                'requests': total,
+                'errors': errors,
+                'error_rate': round(errors / total, 4) if total else 0,
+                'throughput': round(total / elapsed, 1) if elapsed else 0,
+                'p50_ms': round(percentile(samples, 50) * 1000, 1),
+                'p95_ms': round(percentile(samples, 95) * 1000, 1),
+                'p99_ms': round(percentile(samples, 99) * 1000, 1),
+                'max_ms': round(max(samples) * 1000, 1) if samples else 0,
+                'outcomes': outcomes,
+            }
+        return result
@@ -0,0 +1,297 @@
+"""
+Lunch-rush simulation of the whole order lifecycle over HTTP, for
+`manage.py simulate_lunch_rush`.
+
+Customers browse a menu, place an order (OrderListSerializer), upload a payment
+proof in chunks, wait for it to be approved and prepared, mark it delivered,
+rate it and sometimes open a support chat. Meanwhile sub-admins approve what is
+pending (claiming batches from the approval queue, or with approval='list'
+all of them reading the whole pending list) and each restaurant's admin marks what is prepared as ready for pickup
+(mark_as_ready_for_pickup_restaurant). Every request is timed under the phase
+it belongs to.
+
+An anomaly is a response the state machine shouldn't give at that point of the
+flow (an order that is no longer where the actor saw it, an approval of an
+already approved order...). check_events() then checks each order's OrderEvent
+history: legal transitions, each one starting where the previous one ended.
+"""
+import asyncio
+import json
+import random
+import re
+import struct
+import time
+import zlib
+from collections import defaultdict
+from urllib.parse import quote
+
+from .loadtesting import Stats, percentile, request
+
+PHASES = (
+    'browse', 'place_order', 'upload_proof', 'approve', 'mark_ready', 'mark_delivered',
+    'rate', 'chat', 'poll_status',
+)
+# Where each request path belongs, for the server's error log
+PATH_PHASES = (
+    (re.compile(r'^/api/(restaurants|menu-items)/'), 'browse'),
+    (re.compile(r'^/api/orders/$'), 'place_order'),
+    (re.compile(r'^/api/payment-proof-uploads/'), 'upload_proof'),
+    (re.compile(r'^/api/orders/\d+/mark_as_ready_for_pickup_restaurant/'), 'mark_ready'),
+    (re.compile(r'^/api/orders/\d+/mark_as_delivered/'), 'mark_delivered'),
+    (re.compile(r'^/api/orders/\d+/$'), 'approve'),
+    (re.compile(r'^/api/orders/claim/'), 'approve'),
+    (re.compile(r'^/api/ratings/'), 'rate'),
+    (re.compile(r'^/api/(conversations|chat-messages)/'), 'chat'),
+    (re.compile(r'^/api/async/orders/'), 'poll_status'),
+)
+# Errors of a database that couldn't get a lock in time, or gave up a deadlock
+LOCK_ERRORS = (
+    'database is locked', 'database table is locked', 'deadlock detected',
+    'could not serialize access', 'lock timeout', 'LockNotAvailable',
+)
+TRANSITIONS = {
+    '': {'Pending Payment'},
+    'Pending Payment': {'Pending Approval', 'Cancelled'},
+    'Pending Approval': {'Preparing', 'Cancelled'},
+    'Preparing': {'Ready for Pickup', 'Delivered', 'Cancelled'},
+    'Ready for Pickup': {'Delivered'},
+    'Delivered': {'Completed'},
+}
+
+
+def tiny_png():
+    """A valid 1x1 PNG, so processing an upload does the same work as a real one"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(b'\x00\xff\xff\xff')),
+        chunk(b'IEND', b''),
+    ])
+
+
+class Simulation:
+    """
+    Drives the actors against a server at `address` until `duration` seconds
+    have passed, then lets orders in flight finish for up to `drain` seconds.
+    `fixture` is what the setup step created (see simulate_lunch_rush).
+    """
+
+    def __init__(self, address, fixture, duration, drain=30, poll_interval=0.5, chat_probability=0.2,
+                 timeout=30, seed=None, approval='claim'):
+        self.address = address
+        self.fixture = fixture
+        self.duration = duration
+        self.drain = drain
+        self.poll_interval = poll_interval
+        self.chat_probability = chat_probability
+        self.approval = approval
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.stats = Stats()
+        self.anomalies = defaultdict(lambda: defaultdict(int))
+        self.flow_seconds = []
+        self.orders_started = self.orders_delivered = 0
+        self.proof = tiny_png()
+
+    async def call(self, phase, token, method, path, body=None, headers=None, expect=(200, 201)):
+        """One timed request; returns the response, None if there was none"""
+        headers = {'Authorization': f'Bearer {token}', **(headers or {})}
+        started = time.monotonic()
+        try:
+            response = await request(self.address, method, path, headers=headers, body=body, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.stats.record(phase, time.monotonic() - started, 'timeout')
+            return None
+        except OSError:
+            self.stats.record(phase, time.monotonic() - started, 'connection_error')
+            return None
+        outcome = 'ok' if response.status in expect else f'http_{response.status}'
+        self.stats.record(phase, time.monotonic() - started, outcome)
+        return response
+
+    def anomaly(self, phase, kind):
+        self.anomalies[phase][kind] += 1
+
+    # --- Actors ---
+    async def run(self):
+        self.deadline = time.monotonic() + self.duration
+        self.stop_at = self.deadline + self.drain
+        started = time.monotonic()
+        actors = [self.customer(customer) for customer in self.fixture['customers']]
+        actors += [self.sub_admin(token) for token in self.fixture['sub_admins']]
+        actors += [self.restaurant_admin(admin['token']) for admin in self.fixture['restaurant_admins']]
+        await asyncio.gather(*actors)
+        return time.monotonic() - started
+
+    async def customer(self, token):
+        while time.monotonic() < self.deadline:
+            await self.order_flow(token)
+
+    async def order_flow(self, token):
+        restaurant = self.random.choice(self.fixture['restaurants'])
+        await self.call('browse', token, 'GET', '/api/restaurants/')
+        await self.call('browse', token, 'GET', f"/api/menu-items/?restaurant={restaurant['id']}")
+
+        menu_item_ids = self.random.sample(restaurant['menu_item_ids'], min(3, len(restaurant['menu_item_ids'])))
+        items = [{'menu_item_id': item_id, 'quantity': self.random.randint(1, 3)} for item_id in menu_item_ids]
+        response = await self.call('place_order', token, 'POST', '/api/orders/', {
+            'restaurant': restaurant['id'], 'items': json.dumps(items),
+        }, expect=(201,))
+        if response is None or response.status != 201:
+            return
+        order = response.json()
+        self.orders_started += 1
+        placed = time.monotonic()
+        if order['status'] != 'Pending Payment':
+            self.anomaly('place_order', f"created in {order['status']}")
+
+        if not await self.upload_proof(token, order['id']):
+            return
+        # Picked up once the restaurant says it's ready
+        if not await self.wait_for(token, order['id'], ('Ready for Pickup',)):
+            return
+
+        response = await self.call('mark_delivered', token, 'PATCH', f"/api/orders/{order['id']}/mark_as_delivered/")
+        if response is None or response.status != 200:
+            if response is not None and response.status == 400:
+                self.anomaly('mark_delivered', 'refused by the state machine')
+            return
+        self.orders_delivered += 1
+        self.flow_seconds.append(time.monotonic() - placed)
+
+        response = await self.call('rate', token, 'POST', '/api/ratings/bulk/', {
+            'order': order['id'],
+            'ratings': [{'menu_item': item_id, 'stars': self.random.randint(3, 5)} for item_id in menu_item_ids],
+        }, expect=(201,))
+        if response is not None and response.status == 400:
+            self.anomaly('rate', 'order not rateable')
+
+        if self.random.random() < self.chat_probability:
+            response = await self.call('chat', token, 'POST', '/api/conversations/', {'subject': 'Lunch order'})
+            if response is not None and response.status == 201:
+                await self.call('chat', token, 'POST', '/api/chat-messages/', {
+                    'conversation': response.json()['id'], 'message': f"About order {order['order_code']}",
+                })
+
+    async def upload_proof(self, token, order_id):
+        response = await self.call('upload_proof', token, 'POST', '/api/payment-proof-uploads/', {
+            'order': order_id, 'filename': 'proof.png', 'size': len(self.proof),
+        }, expect=(201,))
+        if response is None or response.status != 201:
+            return False
+        session_id = response.json()['id']
+        response = await self.call(
+            'upload_proof', token, 'PUT', f'/api/payment-proof-uploads/{session_id}/', self.proof,
+            headers={'Upload-Offset': '0', 'Content-Type': 'application/offset+octet-stream'},
+        )
+        if response is None or response.status != 200:
+            return False
+        # Processed in the background, then the order moves to Pending Approval
+        return await self.wait_for(token, order_id, ('Pending Approval', 'Preparing', 'Ready for Pickup'))
+
+    async def wait_for(self, token, order_id, statuses):
+        while time.monotonic() < self.stop_at:
+            response = await self.call('poll_status', token, 'GET', f'/api/async/orders/{order_id}/status/')
+            if response is not None and response.status == 200:
+                current = response.json()['status']
+                if current in statuses:
+                    return True
+                if current in ('Cancelled', 'Delivered', 'Completed'):
+                    self.anomaly('poll_status', f'unexpected {current}')
+                    return False
+            await asyncio.sleep(self.poll_interval)
+        return False
+
+    async def sub_admin(self, token):
+        while time.monotonic() < self.stop_at:
+            orders = await self.pending_orders(token)
+            for order in orders:
+                response = await self.call('approve', token, 'PATCH', f"/api/orders/{order['id']}/", {
+                    'status': 'Preparing',
+                })
+                if response is not None and response.status == 409:
+                    # Only possible with claims if two sub-admins were handed the same order
+                    self.anomaly('approve', 'claimed by another sub-admin')
+                elif response is not None and response.status == 200 and response.json().get('status') != 'Preparing':
+                    self.anomaly('approve', 'approval not applied')
+            if not orders:
+                await asyncio.sleep(self.poll_interval)
+
+    async def pending_orders(self, token):
+        if self.approval == 'list':
+            response = await self.call('approve', token, 'GET', f"/api/orders/?status={quote('Pending Approval')}")
+            return response.json() if response is not None and response.status == 200 else []
+        response = await self.call('approve', token, 'POST', '/api/orders/claim/', {})
+        return response.json()['orders'] if response is not None and response.status == 200 else []
+
+    async def restaurant_admin(self, token):
+        while time.monotonic() < self.stop_at:
+            response = await self.call('mark_ready', token, 'GET', '/api/orders/?status=Preparing')
+            orders = response.json() if response is not None and response.status == 200 else []
+            for order in orders:
+                response = await self.call(
+                    'mark_ready', token, 'PATCH', f"/api/orders/{order['id']}/mark_as_ready_for_pickup_restaurant/"
+                )
+                if response is not None and response.status == 400:
+                    # The customer took it first, or it wasn't Preparing after all
+                    self.anomaly('mark_ready', 'not preparing any more')
+            if not orders:
+                await asyncio.sleep(self.poll_interval)
+
+    # --- Report ---
+    def report(self, elapsed, server_errors=None):
+        """Per phase statistics, with lock contention from the server's error log and anomalies"""
+        summary = self.stats.summary(elapsed=elapsed)
+        server_errors = server_errors or {}
+        for phase, result in summary.items():
+            errors = server_errors.get(phase, {})
+            result['lock_errors'] = errors.get('lock', 0)
+            result['lock_error_rate'] = round(result['lock_errors'] / result['requests'], 4) if result['requests'] else 0
+            result['anomalies'] = dict(self.anomalies.get(phase, {}))
+        minutes = elapsed / 60
+        return {
+            'phases': summary,
+            'orders_started': self.orders_started,
+            'orders_delivered': self.orders_delivered,
+            'orders_per_minute': round(self.orders_delivered / minutes, 1) if minutes else 0,
+            'flow_p50_s': round(percentile(self.flow_seconds, 50), 2),
+            'flow_p95_s': round(percentile(self.flow_seconds, 95), 2),
+        }
+
+
+def parse_server_errors(log):
+    """
+    {phase: {'lock': n, 'other': n}} from a server's stderr, where Django logs
+    each unhandled error as "Internal Server Error: <path>" and its traceback.
+    """
+    errors = defaultdict(lambda: defaultdict(int))
+    records = re.split(r'^(?=Internal Server Error: )', log, flags=re.MULTILINE)
+    for record in records:
+        match = re.match(r'Internal Server Error: (\S+)', record)
+        if not match:
+            continue
+        path = match.group(1)
+        phase = next((phase for pattern, phase in PATH_PHASES if pattern.match(path)), 'other')
+        kind = 'lock' if any(marker in record for marker in LOCK_ERRORS) else 'other'
+        errors[phase][kind] += 1
+    return errors
+
+
+def check_events(histories):
+    """
+    Problems in orders' event histories, {order id: [(from status, to status)]}
+    in id order. Returns {problem: count}.
+    """
+    problems = defaultdict(int)
+    for transitions in histories.values():
+        current = ''
+        for from_status, to_status in transitions:
+            if from_status != current:
+                # Two actors changed the order from the same state: one overwrote the other
+                problems['lost update'] += 1
+            if to_status not in TRANSITIONS.get(from_status, ()):
+                problems[f'illegal {from_status or "(new)"} -> {to_status}'] += 1
+            current = to_status
+    return dict(problems)
@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import sharding
+from api.archive import archivable_orders, archive_batch
+
+
+class Command(BaseCommand):
+    help = 'Move completed and cancelled orders older than N days into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ORDER_ARCHIVE_DAYS,
+                            help='Archive finished orders created more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Orders moved per transaction')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the orders that would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        if options['dry_run']:
+            count = sum(archivable_orders(cutoff).using(alias).count() for alias in sharding.shards())
+            self.stdout.write(self.style.SUCCESS(f'{count} order(s) would be archived'))
+            return
+
+        archived = 0
+        for alias in sharding.shards():
+            with sharding.using_shard(alias):
+                while True:
+                    moved = archive_batch(cutoff, options['batch_size'])
+                    if not moved:
+                        break
+                    archived += moved
+                    self.stdout.write(f'  archived {archived} order(s)...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} order(s) older than {options['days']} days"
+        ))
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
+from api import sharding
 from api.models import Order
 
 
@@ -15,7 +16,7 @@ class Command(BaseCommand):
         
         auto_delivered_count = 0
         
-        for order in orders_to_auto_deliver:
+        for order in sharding.fan_out(orders_to_auto_deliver):
             if order.should_auto_deliver():
                 order.status = 'Delivered'
                 order.save()
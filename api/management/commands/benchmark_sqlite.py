@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+
+from api.loadtesting import Stats
+from api.models import MenuItem, Order, OrderItem, Restaurant, User
+
+PROFILES = {
+    # Django's stock backend: rollback journal, deferred transactions
+    'default': {'SQLITE_TUNED': 'False'},
+    # api/backends/sqlite3: WAL, busy_timeout, BEGIN IMMEDIATE...
+    'tuned': {'SQLITE_TUNED': 'True'},
+}
+MENU_ITEMS = 50
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare order placement throughput on SQLite with the stock and the tuned '
+        'backend (api/backends/sqlite3), with several worker processes writing at once'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Processes placing orders concurrently')
+        parser.add_argument('--seconds', type=float, default=5, help='Duration of each run')
+        parser.add_argument('--profile', choices=PROFILES, action='append',
+                            help='Only this profile (can be repeated)')
+        # Used by the subprocesses the benchmark starts
+        parser.add_argument('--role', choices=['run', 'setup', 'worker'], default='run', help=argparse.SUPPRESS)
+        parser.add_argument('--start-at', type=float, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['role'] == 'setup':
+            return self.setup()
+        if options['role'] == 'worker':
+            return self.worker(options['start_at'], options['seconds'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            template = os.path.join(directory, 'template.sqlite3')
+            self.stdout.write('Preparing the database...')
+            self.manage(['migrate', '-v0'], template, PROFILES['default'])
+            self.manage(['benchmark_sqlite', '--role', 'setup'], template, PROFILES['default'])
+
+            results = {}
+            for profile in options['profile'] or PROFILES:
+                path = os.path.join(directory, f'{profile}.sqlite3')
+                shutil.copy(template, path)
+                results[profile] = self.run(profile, path, options['workers'], options['seconds'])
+
+        self.stdout.write(json.dumps(results, indent=2))
+        if {'default', 'tuned'} <= results.keys():
+            before, after = results['default'], results['tuned']
+            self.stdout.write(self.style.SUCCESS(
+                f"Orders/s {before['orders_per_second']} -> {after['orders_per_second']}, "
+                f"failed {before['errors']} -> {after['errors']}, "
+                f"p95 {before['p95_ms']}ms -> {after['p95_ms']}ms"
+            ))
+
+    # --- Parent ---
+    def environment(self, path, profile_env):
+        env = {**os.environ, **profile_env, 'DATABASE_URL': f'sqlite:///{path}'}
+        env.pop('DATABASE_REPLICA_URL', None)
+        return env
+
+    def manage(self, arguments, path, profile_env):
+        result = subprocess.run(
+            [sys.executable, 'manage.py', *arguments], cwd=settings.BASE_DIR,
+            env=self.environment(path, profile_env), capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"manage.py {' '.join(arguments)} failed:\n{result.stderr}")
+        return result.stdout
+
+    def run(self, profile, path, workers, seconds):
+        self.stdout.write(f'  {profile}: {workers} workers for {seconds}s')
+        # Start together once every worker has imported Django
+        start_at = time.time() + 3
+        processes = [
+            subprocess.Popen(
+                [sys.executable, 'manage.py', 'benchmark_sqlite', '--role', 'worker',
+                 '--start-at', str(start_at), '--seconds', str(seconds)],
+                cwd=settings.BASE_DIR, env=self.environment(path, PROFILES[profile]),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+            )
+            for _ in range(workers)
+        ]
+        stats = Stats()
+        for process in processes:
+            output, errors = process.communicate()
+            if process.returncode:
+                raise CommandError(f'A {profile} worker failed:\n{errors}')
+            for outcome, latency in json.loads(output.strip().splitlines()[-1]):
+                stats.record('place_order', latency, outcome)
+        summary = stats.summary(elapsed=seconds)['place_order']
+        summary['orders_per_second'] = round(summary['outcomes'].get('ok', 0) / seconds, 1)
+        return summary
+
+    # --- Subprocesses ---
+    def setup(self):
+        restaurant = Restaurant.objects.create(name='Benchmark Kitchen', address='-', phone_number='-')
+        MenuItem.objects.bulk_create([
+            MenuItem(restaurant=restaurant, name=f'Item {i}', description='-', price=5 + i % 10, image='bench.jpg')
+            for i in range(MENU_ITEMS)
+        ])
+        User.objects.create_user('benchmark', password='benchmark', role='customer')
+
+    def place_order(self, customer, restaurant, menu_item_ids):
+        # What OrderListSerializer.create does, inside one transaction: read the
+        # menu, then write the order, its items and the total
+        with transaction.atomic():
+            menu_items = list(MenuItem.objects.filter(pk__in=random.sample(menu_item_ids, 3)))
+            order = Order.objects.create(customer=customer, restaurant=restaurant)
+            OrderItem.objects.bulk_create([OrderItem(order=order, menu_item=item, quantity=2) for item in menu_items])
+            order.total_price = sum(item.price * 2 for item in menu_items)
+            order.save()
+
+    def worker(self, start_at, seconds):
+        customer = User.objects.get(username='benchmark')
+        restaurant = Restaurant.objects.get(name='Benchmark Kitchen')
+        menu_item_ids = list(MenuItem.objects.values_list('id', flat=True))
+        connection.close()
+
+        time.sleep(max(0, start_at - time.time()))
+        samples = []
+        deadline = start_at + seconds
+        while time.time() < deadline:
+            started = time.monotonic()
+            try:
+                self.place_order(customer, restaurant, menu_item_ids)
+                outcome = 'ok'
+            except OperationalError as exc:
+                outcome = 'locked' if 'locked' in str(exc) else 'error'
+            samples.append((outcome, time.monotonic() - started))
+        self.stdout.write(json.dumps(samples))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import sharding
+from api.models import Restaurant
+from api.recommendations import build_restaurant
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the "frequently ordered together" recommendations from the order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurant', type=int, action='append',
+                            help='Only this restaurant id (can be repeated)')
+        parser.add_argument('--top-k', type=int, help='Suggestions kept per menu item')
+
+    def handle(self, *args, **options):
+        restaurants = Restaurant.objects.order_by('id')
+        if options['restaurant']:
+            restaurants = restaurants.filter(id__in=options['restaurant'])
+
+        for restaurant in restaurants:
+            started = time.monotonic()
+            with sharding.using_shard(sharding.instance_shard(restaurant)):
+                pairs = build_restaurant(restaurant.id, top_k=options['top_k'])
+            self.stdout.write(
+                f'  {restaurant.name}: {pairs} item pairs in {time.monotonic() - started:.2f}s'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Recommendations rebuilt'))
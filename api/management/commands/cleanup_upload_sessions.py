@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import sharding, uploads
+from api.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Finish payment-proof uploads interrupted by a restart and remove abandoned ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.UPLOAD_SESSION_TTL_HOURS,
+                            help='Remove uploads not finished after this many hours')
+        parser.add_argument('--stuck-minutes', type=int, default=10,
+                            help='Process again uploads that have been processing this long')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        processed = removed = 0
+        for alias in sharding.shards():
+            with sharding.using_shard(alias):
+                stuck = UploadSession.objects.filter(
+                    status=UploadSession.Status.PROCESSING,
+                    updated_at__lt=now - timedelta(minutes=options['stuck_minutes']),
+                ).values_list('pk', flat=True)
+                for session_id in stuck:
+                    uploads.process(session_id)
+                    processed += 1
+
+                abandoned = UploadSession.objects.filter(
+                    status__in=[UploadSession.Status.RECEIVING, UploadSession.Status.FAILED],
+                    updated_at__lt=now - timedelta(hours=options['hours']),
+                )
+                for session in abandoned.iterator():
+                    uploads.remove_temp_file(session)
+                    session.delete()
+                    removed += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} interrupted upload(s), removed {removed} abandoned upload(s)'
+        ))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.webhooks import deliver_due
+
+
+class Command(BaseCommand):
+    help = 'Deliver order events to restaurant webhook endpoints (see api/webhooks.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run one delivery round and exit')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds between rounds when running continuously')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            delivered, failed = deliver_due()
+            self.stdout.write(self.style.SUCCESS(f'Delivered {delivered} event(s), {failed} failed delivery(ies)'))
+            return
+
+        self.stdout.write(self.style.SUCCESS('Delivering webhooks, press Ctrl+C to stop'))
+        try:
+            while True:
+                delivered, failed = deliver_due()
+                if delivered or failed:
+                    self.stdout.write(f'  {delivered} event(s) delivered, {failed} failed delivery(ies)')
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import sharding
+from api.menu_import import export_menu
+from api.models import Restaurant
+
+
+class Command(BaseCommand):
+    help = "Write a restaurant's menu in the import format (.csv or .xlsx)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('restaurant', type=int, help='Restaurant id')
+        parser.add_argument('file', help='Output file, the format follows its extension')
+
+    def handle(self, *args, **options):
+        restaurant = Restaurant.objects.filter(id=options['restaurant']).first()
+        if restaurant is None:
+            raise CommandError(f"Restaurant {options['restaurant']} does not exist")
+
+        file_format = 'xlsx' if options['file'].lower().endswith('.xlsx') else 'csv'
+        with open(options['file'], 'wb') as output, sharding.using_shard(sharding.instance_shard(restaurant)):
+            output.write(export_menu(restaurant, file_format))
+        self.stdout.write(self.style.SUCCESS(f"Menu written to {options['file']}"))
@@ -0,0 +1,49 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import sharding
+from api.menu_import import MenuImportError, import_menu
+from api.models import Restaurant
+
+
+class Command(BaseCommand):
+    help = 'Create and update a restaurant\'s menu items and addons from a CSV/XLSX file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('restaurant', type=int, help='Restaurant id')
+        parser.add_argument('file', help='Menu file (.csv or .xlsx)')
+        parser.add_argument('--images', help='Zip of the images named in the file')
+        parser.add_argument('--dry-run', action='store_true', help='Only show what would change')
+
+    def handle(self, *args, **options):
+        restaurant = Restaurant.objects.filter(id=options['restaurant']).first()
+        if restaurant is None:
+            raise CommandError(f"Restaurant {options['restaurant']} does not exist")
+
+        started = time.monotonic()
+        images = open(options['images'], 'rb') if options['images'] else None
+        try:
+            with open(options['file'], 'rb') as menu_file, sharding.using_shard(sharding.instance_shard(restaurant)):
+                diff = import_menu(restaurant, menu_file, options['file'], images, dry_run=options['dry_run'])
+        except MenuImportError as exc:
+            raise CommandError(str(exc))
+        finally:
+            if images is not None:
+                images.close()
+
+        for error in diff['errors']:
+            self.stderr.write(f"  line {error['line']}: {'; '.join(error['errors'])}")
+        for row in diff['update']:
+            self.stdout.write(f"  update {row['kind']} {row['sku']}: {json.dumps(row['changes'])}")
+        self.stdout.write(
+            f"  {len(diff['create'])} to create, {len(diff['update'])} to update, "
+            f"{diff['unchanged']} unchanged, {len(diff['missing'])} not in the file"
+        )
+        if diff['errors']:
+            raise CommandError(f"{len(diff['errors'])} line(s) have errors, nothing was imported")
+        if diff['applied']:
+            self.stdout.write(self.style.SUCCESS(f'Menu imported in {time.monotonic() - started:.2f}s'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Dry run, nothing was written'))
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.loadtesting import SERVER_KINDS, Server, Stats, request
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare how many concurrent connections the app handles under gunicorn sync '
+        'workers and under uvicorn (ASGI), on this machine and database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', default=','.join(SERVER_KINDS),
+                            help='Comma separated: gunicorn, uvicorn')
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes per server')
+        parser.add_argument('--concurrency', default='10,50,100,200,400',
+                            help='Comma separated numbers of concurrent connections to try')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per concurrency level')
+        parser.add_argument('--sync-path', default='/api/menu-items/',
+                            help='Endpoint requested from gunicorn')
+        parser.add_argument('--async-path', default='/api/async/menu-items/',
+                            help='Endpoint requested from uvicorn')
+        parser.add_argument('--token', help='JWT access token, for endpoints that need a login')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+        parser.add_argument('--max-error-rate', type=float, default=0.01,
+                            help='Highest error rate a level may have to count as handled')
+        parser.add_argument('--max-p95-ms', type=float, default=1000,
+                            help='Highest p95 latency a level may have to count as handled')
+
+    def handle(self, *args, **options):
+        servers = [kind.strip() for kind in options['servers'].split(',') if kind.strip()]
+        for kind in servers:
+            if kind not in SERVER_KINDS:
+                raise CommandError(f'Unknown server "{kind}", choose from {", ".join(SERVER_KINDS)}')
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        headers = {'Authorization': f"Bearer {options['token']}"} if options['token'] else {}
+
+        capacity = {}
+        for kind in servers:
+            path = options['sync_path'] if kind == 'gunicorn' else options['async_path']
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{kind} ({options['workers']} workers) -> GET {path}"
+            ))
+            self.stdout.write('  conc     req/s     p50 ms     p95 ms     p99 ms   errors')
+            capacity[kind] = 0
+            with Server(kind, workers=options['workers']) as server:
+                for level in levels:
+                    result = asyncio.run(self.run_level(
+                        server.address, path, headers, level, options['duration'], options['timeout']
+                    ))
+                    self.stdout.write(
+                        f"  {level:>4} {result['throughput']:>9} {result['p50_ms']:>10} "
+                        f"{result['p95_ms']:>10} {result['p99_ms']:>10} {result['error_rate']:>8.2%}"
+                    )
+                    if (result['error_rate'] <= options['max_error_rate']
+                            and result['p95_ms'] <= options['max_p95_ms']):
+                        capacity[kind] = level
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Capacity'))
+        for kind, level in capacity.items():
+            self.stdout.write(
+                f'  {kind}: {level} concurrent connections '
+                f"(error rate <= {options['max_error_rate']:.0%}, p95 <= {options['max_p95_ms']:.0f} ms)"
+            )
+
+    async def run_level(self, address, path, headers, concurrency, duration, timeout):
+        stats = Stats()
+        deadline = time.monotonic() + duration
+
+        async def client():
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    response = await request(address, 'GET', path, headers=headers, timeout=timeout)
+                    outcome = 'ok' if response.status < 400 else f'http_{response.status}'
+                except asyncio.TimeoutError:
+                    outcome = 'timeout'
+                except OSError:
+                    outcome = 'connection_error'
+                stats.record('request', time.monotonic() - started, outcome)
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        summary = stats.summary(elapsed=duration)
+        return summary.get('request', {
+            'throughput': 0, 'p50_ms': 0, 'p95_ms': 0, 'p99_ms': 0, 'error_rate': 1,
+        })
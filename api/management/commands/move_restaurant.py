@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import sharding
+from api.models import Restaurant
+
+
+class Command(BaseCommand):
+    help = 'Move a restaurant and everything it owns to another database shard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('restaurant', type=int, help='Restaurant id')
+        parser.add_argument('shard', help='Alias of the target shard (one of DATABASE_SHARDS)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows copied per INSERT')
+
+    def handle(self, *args, **options):
+        restaurant = Restaurant.objects.using('default').filter(id=options['restaurant']).first()
+        if restaurant is None:
+            raise CommandError(f"Restaurant {options['restaurant']} does not exist")
+
+        source = sharding.instance_shard(restaurant)
+        started = time.monotonic()
+        try:
+            moved = sharding.move_restaurant(restaurant, options['shard'], batch_size=options['batch_size'])
+        except sharding.ShardingError as exc:
+            raise CommandError(str(exc))
+
+        if not moved:
+            self.stdout.write(self.style.SUCCESS(f'{restaurant.name} is already on {source}'))
+            return
+        for label, count in moved.items():
+            if count:
+                self.stdout.write(f'  {label}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {restaurant.name} from {source} to {options['shard']} "
+            f"({sum(moved.values())} rows) in {time.monotonic() - started:.2f}s"
+        ))
@@ -0,0 +1,45 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import startup
+
+FUNCTIONS = {
+    # food_ordering_backend/wsgi.py: everything but /api/
+    'full': False,
+    # food_ordering_backend/api_wsgi.py: /api/ (API_ONLY)
+    'api': True,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure a cold start of the serverless functions: settings, django.setup(), '
+        'middleware, URL conf and first request, each in a fresh interpreter'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Cold starts per function (the median is shown)')
+        parser.add_argument('--path', default='/api/', help='Path of the first request')
+        parser.add_argument('--function', choices=FUNCTIONS, action='append',
+                            help='Only this function (can be repeated)')
+        parser.add_argument('--imports', type=int, default=15, help='Slowest imports to list (0 for none)')
+
+    def handle(self, *args, **options):
+        results = {}
+        for function in options['function'] or FUNCTIONS:
+            self.stdout.write(f"  {function}: {options['runs']} cold starts")
+            result = startup.measure(
+                options['path'], api_only=FUNCTIONS[function], runs=options['runs'],
+                importtime=bool(options['imports']),
+            )
+            imports = startup.slowest_imports(result.pop('imports', ''), options['imports'])
+            if imports:
+                result['slowest_imports_ms'] = {name: round(ms, 1) for ms, name in imports}
+            results[function] = result
+
+        self.stdout.write(json.dumps(results, indent=2))
+        self.stdout.write(self.style.SUCCESS(', '.join(
+            f"{function}: {result['total']}ms" for function, result in results.items()
+        ) + f' (budget {settings.COLD_START_BUDGET_MS}ms)'))
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import sharding
+from api.models import ActivityLog
+
+
+class Command(BaseCommand):
+    help = 'Delete activity log entries older than the retention period, in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ACTIVITY_LOG_RETENTION_DAYS,
+                            help='Keep entries from the last this many days')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows deleted per statement')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        deleted = 0
+        for alias in sharding.shards():
+            entries = ActivityLog.objects.using(alias)
+            old_entries = entries.filter(timestamp__lt=cutoff).order_by('timestamp')
+            while True:
+                # Short deletes by primary key, found through the timestamp index, so
+                # the table is never locked for long while the API is reading it
+                ids = list(old_entries.values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                deleted += entries.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} activity log entries older than {options['days']} days"
+        ))
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from api import sharding
+from api.models import OrderEvent, WebhookEndpoint
+
+
+class Command(BaseCommand):
+    help = 'Delete old order events that every webhook endpoint has received'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ORDER_EVENT_RETENTION_DAYS,
+                            help='Keep events from the last N days')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows deleted per statement')
+
+    def handle(self, *args, **options):
+        deleted = 0
+        # Event ids and endpoint cursors belong to one database shard
+        for alias in sharding.shards():
+            events = OrderEvent.objects.using(alias)
+            old = events.filter(created_at__lt=timezone.now() - timedelta(days=options['days']))
+            # Never delete what an active endpoint still has to get
+            behind = WebhookEndpoint.objects.using(alias).filter(is_active=True).aggregate(
+                cursor=Min('last_event_id')
+            )['cursor']
+            if behind is not None:
+                old = old.filter(id__lte=behind)
+
+            while True:
+                ids = list(old.values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                deleted += events.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} order event(s)'))
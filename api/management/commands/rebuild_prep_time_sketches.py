@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.eta import add_sample, prep_seconds
+from api.models import Order, ArchivedOrder, PrepTimeSketch
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the preparation time estimates behind order ETAs from the order history'
+
+    def handle(self, *args, **options):
+        sketches = {}
+        orders = 0
+        # Oldest first: archived orders, then the ones still in the hot table
+        for model in (ArchivedOrder, Order):
+            history = (
+                model.objects.filter(ready_for_pickup_at__isnull=False)
+                .order_by('ready_for_pickup_at')
+                .only('restaurant_id', 'created_at', 'ready_for_pickup_at')
+            )
+            for order in history.iterator():
+                seconds = prep_seconds(order)
+                for hour in (order.created_at.hour, PrepTimeSketch.ALL_HOURS):
+                    key = (order.restaurant_id, hour)
+                    if key not in sketches:
+                        sketches[key] = PrepTimeSketch(restaurant_id=order.restaurant_id, hour=hour)
+                    add_sample(sketches[key], seconds)
+                orders += 1
+
+        with transaction.atomic():
+            PrepTimeSketch.objects.all().delete()
+            PrepTimeSketch.objects.bulk_create(sketches.values(), batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(sketches)} preparation time sketches from {orders} orders'
+        ))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for menu items, addons and restaurants'
+
+    def handle(self, *args, **options):
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} entries'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api import counters, sharding
+
+
+class Command(BaseCommand):
+    help = 'Recount the dashboard counters from the orders and conversations and correct any drift'
+
+    def handle(self, *args, **options):
+        corrected = 0
+        for alias in sharding.shards():
+            for restaurant_id, name, old, new in counters.reconcile(alias):
+                self.stdout.write(f"  {alias}: {name} of {restaurant_id or 'all restaurants'} {old} -> {new}")
+                corrected += 1
+        self.stdout.write(self.style.SUCCESS(f'Corrected {corrected} counter(s)'))
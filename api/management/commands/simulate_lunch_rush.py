@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+
+from api.loadtesting import SERVER_KINDS, Server
+from api.lunch_rush import PHASES, Simulation, check_events, parse_server_errors
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate a lunch rush: concurrent customers, sub-admins and restaurant admins '
+        'going through the whole order lifecycle against a local server, on a scratch database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=SERVER_KINDS, default='gunicorn',
+                            help='gunicorn (sync workers) or uvicorn (ASGI)')
+        parser.add_argument('--workers', type=int, default=4, help='Server worker processes')
+        parser.add_argument('--customers', type=int, default=50, help='Concurrent customers')
+        parser.add_argument('--sub-admins', type=int, default=2, help='Concurrent sub-admins approving orders')
+        parser.add_argument('--approval', choices=['claim', 'list'], default='claim',
+                            help='Sub-admins claim batches from the approval queue, or all read the pending list')
+        parser.add_argument('--restaurants', type=int, default=5, help='Restaurants, each with its own admin')
+        parser.add_argument('--menu-items', type=int, default=20, help='Menu items per restaurant')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds customers keep placing orders')
+        parser.add_argument('--drain', type=float, default=30,
+                            help='Seconds orders in flight get to finish afterwards')
+        parser.add_argument('--poll-interval', type=float, default=0.5,
+                            help='Seconds between polls of an order or a to-do list')
+        parser.add_argument('--chat-probability', type=float, default=0.2,
+                            help='Share of customers who open a support chat after their order')
+        parser.add_argument('--database-url',
+                            help='Empty database to run on (migrated first), a temporary SQLite file by default')
+        parser.add_argument('--seed', type=int, help='Random seed, for repeatable runs')
+        parser.add_argument('--json', action='store_true', help='Print the full report as JSON')
+        # Used by the subprocesses the simulation starts
+        parser.add_argument('--role', choices=['run', 'setup', 'verify'], default='run', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['role'] == 'setup':
+            return self.setup(options)
+        if options['role'] == 'verify':
+            return self.verify()
+
+        with tempfile.TemporaryDirectory() as directory:
+            env = self.environment(directory, options['database_url'])
+            self.stdout.write('Preparing the database...')
+            self.manage(['migrate', '-v0'], env)
+            fixture = json.loads(self.manage([
+                'simulate_lunch_rush', '--role', 'setup', '--customers', str(options['customers']),
+                '--sub-admins', str(options['sub_admins']), '--restaurants', str(options['restaurants']),
+                '--menu-items', str(options['menu_items']),
+            ], env).strip().splitlines()[-1])
+
+            self.stdout.write(
+                f"{options['server']} ({options['workers']} workers): {options['customers']} customers, "
+                f"{options['sub_admins']} sub-admins ({options['approval']}), {options['restaurants']} restaurants "
+                f"for {options['duration']:.0f}s"
+            )
+            log_path = os.path.join(directory, 'server.log')
+            with open(log_path, 'w') as log, Server(options['server'], options['workers'], env=env, stderr=log) as server:
+                simulation = Simulation(
+                    server.address, fixture, options['duration'], drain=options['drain'],
+                    poll_interval=options['poll_interval'], chat_probability=options['chat_probability'],
+                    seed=options['seed'], approval=options['approval'],
+                )
+                elapsed = asyncio.run(simulation.run())
+            with open(log_path) as log:
+                server_errors = parse_server_errors(log.read())
+            report = simulation.report(elapsed, server_errors)
+            report['consistency'] = json.loads(
+                self.manage(['simulate_lunch_rush', '--role', 'verify'], env).strip().splitlines()[-1]
+            )
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    # --- Parent ---
+    def environment(self, directory, database_url):
+        env = {
+            **os.environ,
+            'DATABASE_URL': database_url or f"sqlite:///{os.path.join(directory, 'lunch_rush.sqlite3')}",
+            'MEDIA_ROOT': os.path.join(directory, 'media'),
+            'UPLOAD_SESSION_DIR': os.path.join(directory, 'uploads'),
+        }
+        # Only the scratch database
+        env.pop('DATABASE_REPLICA_URL', None)
+        env.pop('DATABASE_SHARDS', None)
+        return env
+
+    def manage(self, arguments, env):
+        result = subprocess.run(
+            [sys.executable, 'manage.py', *arguments], cwd=settings.BASE_DIR, env=env,
+            capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"manage.py {' '.join(arguments)} failed:\n{result.stderr}")
+        return result.stdout
+
+    def print_report(self, report):
+        self.stdout.write(self.style.MIGRATE_HEADING('Phases'))
+        self.stdout.write(
+            '  phase            req    req/s   p50 ms   p95 ms   p99 ms   errors    locks  anomalies'
+        )
+        phases = report['phases']
+        for phase in [*PHASES, *sorted(phases.keys() - set(PHASES))]:
+            if phase not in phases:
+                continue
+            result = phases[phase]
+            self.stdout.write(
+                f"  {phase:<14} {result['requests']:>5} {result['throughput']:>8} {result['p50_ms']:>8} "
+                f"{result['p95_ms']:>8} {result['p99_ms']:>8} {result['error_rate']:>8.2%} "
+                f"{result['lock_error_rate']:>8.2%}  {sum(result['anomalies'].values()):>9}"
+            )
+            for kind, count in result['anomalies'].items():
+                self.stdout.write(f'      {count} x {kind}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Orders'))
+        self.stdout.write(
+            f"  {report['orders_delivered']} of {report['orders_started']} delivered, "
+            f"{report['orders_per_minute']} per minute; placed -> delivered "
+            f"p50 {report['flow_p50_s']}s, p95 {report['flow_p95_s']}s"
+        )
+        consistency = report['consistency']
+        self.stdout.write(f"  final statuses: {json.dumps(consistency['statuses'])}")
+        if consistency['problems']:
+            for problem, count in consistency['problems'].items():
+                self.stdout.write(self.style.WARNING(f'  {count} x {problem}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('  every order went through legal transitions'))
+
+    # --- Subprocesses ---
+    def setup(self, options):
+        from rest_framework_simplejwt.tokens import AccessToken
+        from api.models import MenuItem, Restaurant, User
+
+        restaurants = [
+            Restaurant.objects.create(name=f'Rush Kitchen {i}', address='-', phone_number='-')
+            for i in range(options['restaurants'])
+        ]
+        MenuItem.objects.bulk_create([
+            MenuItem(restaurant=restaurant, name=f'Dish {i}', description='-', price=50 + i * 5, image='rush.jpg')
+            for restaurant in restaurants for i in range(options['menu_items'])
+        ])
+        # Hashed once: create_user() would hash each password on its own
+        password = make_password('lunch-rush')
+        User.objects.bulk_create(
+            [User(username=f'customer{i}', password=password, role='customer') for i in range(options['customers'])]
+            + [User(username=f'subadmin{i}', password=password, role='sub_admin') for i in range(options['sub_admins'])]
+            + [User(username=f'restaurant{restaurant.pk}', password=password, role='restaurant_admin',
+                    restaurant=restaurant) for restaurant in restaurants]
+        )
+
+        # Logged in already: the rush is about orders, not password hashing
+        def tokens(role):
+            return [str(AccessToken.for_user(user)) for user in User.objects.filter(role=role).order_by('pk')]
+        self.stdout.write(json.dumps({
+            'restaurants': [
+                {'id': restaurant.pk,
+                 'menu_item_ids': list(restaurant.menu_items.values_list('pk', flat=True))}
+                for restaurant in restaurants
+            ],
+            'customers': tokens('customer'),
+            'sub_admins': tokens('sub_admin'),
+            'restaurant_admins': [
+                {'restaurant': user.restaurant_id, 'token': str(AccessToken.for_user(user))}
+                for user in User.objects.filter(role='restaurant_admin')
+            ],
+        }))
+
+    def verify(self):
+        from django.db.models import Count
+        from api.models import Order, OrderEvent
+
+        histories = {}
+        events = OrderEvent.objects.order_by('pk').values_list('order_id', 'from_status', 'to_status')
+        for order_id, from_status, to_status in events.iterator():
+            histories.setdefault(order_id, []).append((from_status, to_status))
+        self.stdout.write(json.dumps({
+            'problems': check_events(histories),
+            'statuses': dict(Order.objects.order_by().values_list('status').annotate(count=Count('id'))),
+        }))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api import sharding
+
+
+class Command(BaseCommand):
+    help = 'Copy the users and restaurants to every database shard and reserve their id ranges'
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            self.stdout.write(self.style.SUCCESS('No DATABASE_SHARDS besides default, nothing to do'))
+            return
+        for alias in sharding.shards()[1:]:
+            sharding.reserve_id_ranges(alias)
+            copied, deleted = sharding.sync_mirrors(alias)
+            self.stdout.write(f'  {alias}: {copied} copied, {deleted} deleted')
+        self.stdout.write(self.style.SUCCESS(f'{len(sharding.shards()) - 1} shard(s) in sync'))
@@ -0,0 +1,30 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database onto the replica SQLite file. Stands in for '
+        'real replication when trying the read replica setup locally.'
+    )
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        replica = settings.DATABASES.get('replica')
+        if replica is None:
+            raise CommandError('No replica configured, set DATABASE_REPLICA_URL')
+        for name, database in (('primary', primary), ('replica', replica)):
+            if database['ENGINE'] not in ('django.db.backends.sqlite3', 'api.backends.sqlite3'):
+                raise CommandError(f'The {name} database is not SQLite')
+
+        # The backup API gives a consistent copy even while the app is writing
+        source = sqlite3.connect(primary['NAME'])
+        target = sqlite3.connect(replica['NAME'])
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        self.stdout.write(self.style.SUCCESS(f"Copied {primary['NAME']} to {replica['NAME']}"))
@@ -0,0 +1,29 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.webhooks import make_receiver
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in webhook receiver that checks signatures and prints deliveries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('secret', help="The endpoint's secret")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--status', type=int, default=200, help='Status code to answer with')
+
+    def handle(self, *args, **options):
+        def on_delivery(body):
+            for event in body['events']:
+                self.stdout.write(json.dumps(event))
+
+        server = make_receiver(options['secret'], port=options['port'], on_delivery=on_delivery, status=options['status'])
+        self.stdout.write(self.style.SUCCESS(f"Receiving webhooks on http://127.0.0.1:{options['port']}/"))
+        self.stdout.write('The delivery worker only calls it with WEBHOOK_ALLOW_PRIVATE_URLS=True')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,146 @@
+# Generated by Django 5.0.4 on 2026-10-19 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE api_searchentry_fts USING fts5(
+        title, body, content='api_searchentry', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER api_searchentry_ai AFTER INSERT ON api_searchentry BEGIN
+        INSERT INTO api_searchentry_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER api_searchentry_ad AFTER DELETE ON api_searchentry BEGIN
+        INSERT INTO api_searchentry_fts(api_searchentry_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER api_searchentry_au AFTER UPDATE ON api_searchentry BEGIN
+        INSERT INTO api_searchentry_fts(api_searchentry_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO api_searchentry_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+]
+
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS api_searchentry_ai',
+    'DROP TRIGGER IF EXISTS api_searchentry_ad',
+    'DROP TRIGGER IF EXISTS api_searchentry_au',
+    'DROP TABLE IF EXISTS api_searchentry_fts',
+]
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE api_searchentry ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(body, '')), 'B')
+    ) STORED
+    """,
+    'CREATE INDEX api_searchentry_vector_idx ON api_searchentry USING GIN (search_vector)',
+]
+
+POSTGRES_REVERSE = [
+    'DROP INDEX IF EXISTS api_searchentry_vector_idx',
+    'ALTER TABLE api_searchentry DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        # Some SQLite builds ship without FTS5; search falls back to LIKE there.
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            if not cursor.fetchone()[0]:
+                return
+        _run(schema_editor, SQLITE_FORWARD)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_FORWARD)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_REVERSE)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_REVERSE)
+
+
+def index_existing_rows(apps, schema_editor):
+    """
+    Index what is already there, as api/search.py would have (no ratings yet
+    at this point). Runs after the triggers, so the FTS table is filled too.
+    """
+    db = schema_editor.connection.alias
+    Restaurant = apps.get_model('api', 'Restaurant')
+    MenuItem = apps.get_model('api', 'MenuItem')
+    Addon = apps.get_model('api', 'Addon')
+    SearchEntry = apps.get_model('api', 'SearchEntry')
+
+    entries = []
+    for restaurant in Restaurant.objects.using(db).iterator():
+        entries.append(SearchEntry(
+            kind='restaurant', object_id=restaurant.pk, restaurant=restaurant,
+            restaurant_name=restaurant.name, title=restaurant.name, body=restaurant.address,
+            image=restaurant.logo.name if restaurant.logo else '',
+        ))
+    for menu_item in MenuItem.objects.using(db).select_related('restaurant').iterator():
+        restaurant = menu_item.restaurant
+        entries.append(SearchEntry(
+            kind='menu_item', object_id=menu_item.pk, restaurant=restaurant,
+            restaurant_name=restaurant.name, title=menu_item.name,
+            body=f"{menu_item.description}\n{restaurant.name}", price=menu_item.price,
+            image=menu_item.image.name if menu_item.image else '',
+        ))
+    for addon in Addon.objects.using(db).select_related('restaurant').iterator():
+        restaurant = addon.restaurant
+        entries.append(SearchEntry(
+            kind='addon', object_id=addon.pk, restaurant=restaurant,
+            restaurant_name=restaurant.name, title=addon.name, body=restaurant.name,
+            price=addon.price, image=addon.image.name if addon.image else '',
+        ))
+    SearchEntry.objects.using(db).bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_add_ready_for_pickup_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('menu_item', 'Menu Item'), ('addon', 'Addon'), ('restaurant', 'Restaurant')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('restaurant_name', models.CharField(max_length=100)),
+                ('title', models.CharField(max_length=200)),
+                ('body', models.TextField(blank=True)),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True)),
+                ('image', models.CharField(blank=True, max_length=255)),
+                ('average_rating', models.FloatField(default=0)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='api.restaurant')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchentry',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_search_entry'),
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(index_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.4 on 2026-10-19 11:46
+
+from django.db import migrations, models
+
+
+def remove_duplicate_ratings(apps, schema_editor):
+    """Keep only the latest rating per (customer, menu_item) before adding the constraint"""
+    Rating = apps.get_model('api', 'Rating')
+    latest_ids = (
+        Rating.objects.values('customer_id', 'menu_item_id')
+        .annotate(latest=models.Max('id'))
+        .values_list('latest', flat=True)
+    )
+    Rating.objects.exclude(id__in=list(latest_ids)).delete()
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    MenuItem = apps.get_model('api', 'MenuItem')
+    items = list(MenuItem.objects.annotate(avg=models.Avg('ratings__stars'), count=models.Count('ratings')))
+    for item in items:
+        item.average_rating = item.avg or 0
+        item.rating_count = item.count
+    MenuItem.objects.bulk_update(items, ['average_rating', 'rating_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_searchentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menuitem',
+            name='average_rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='menuitem',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(remove_duplicate_ratings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.UniqueConstraint(fields=('customer', 'menu_item'), name='unique_rating_per_customer_item'),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.4 on 2026-10-19 11:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activitylog',
+            name='action_type',
+            field=models.CharField(choices=[('ORDER_APPROVED', 'Order Approved'), ('ORDER_CANCELLED', 'Order Cancelled'), ('ORDER_READY', 'Order Ready for Pickup'), ('ORDER_DELIVERED', 'Order Delivered')], max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='activitylog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['-timestamp'], name='activitylog_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['restaurant', '-timestamp'], name='activitylog_restaurant_idx'),
+        ),
+    ]
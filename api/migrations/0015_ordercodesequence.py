@@ -0,0 +1,21 @@
+# Generated by Django 5.0.4 on 2026-10-19 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_order_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderCodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
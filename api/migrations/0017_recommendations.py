@@ -0,0 +1,38 @@
+# Generated by Django 5.0.4 on 2026-10-19 11:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('other_kind', models.CharField(choices=[('menu_item', 'Menu Item'), ('addon', 'Addon')], max_length=20)),
+                ('other_id', models.PositiveBigIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('menu_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.menuitem')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.restaurant')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Recommendation',
+            fields=[
+                ('menu_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recommendation', serialize=False, to='api.menuitem')),
+                ('suggestions', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.restaurant')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='itempair',
+            constraint=models.UniqueConstraint(fields=('menu_item', 'other_kind', 'other_id'), name='unique_item_pair'),
+        ),
+    ]
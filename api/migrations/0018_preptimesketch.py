@@ -0,0 +1,29 @@
+# Generated by Django 5.0.4 on 2026-10-19 11:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrepTimeSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.PositiveSmallIntegerField(help_text='Hour of day the orders were placed (UTC), 24 for all hours')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('state', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prep_time_sketches', to='api.restaurant')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='preptimesketch',
+            constraint=models.UniqueConstraint(fields=('restaurant', 'hour'), name='unique_prep_time_sketch'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_preptimesketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='addon',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='menuitem',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='addon',
+            constraint=models.UniqueConstraint(fields=('restaurant', 'sku'), name='unique_addon_sku'),
+        ),
+        migrations.AddConstraint(
+            model_name='menuitem',
+            constraint=models.UniqueConstraint(fields=('restaurant', 'sku'), name='unique_menu_item_sku'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.4 on 2026-10-19 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_upload_session'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='menuitem',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='restaurant',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.4 on 2026-10-19 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_order_events_webhooks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='shard',
+            # Every restaurant so far is on 'default'
+            field=models.CharField(blank=True, db_index=True, default='default', editable=False, max_length=32),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0.4 on 2026-10-19 13:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# api.counters.ORDER_COUNTERS as of this migration
+ORDER_COUNTERS = {
+    'Pending Payment': 'pending_payment',
+    'Pending Approval': 'pending_approval',
+    'Preparing': 'preparing',
+    'Ready for Pickup': 'ready_for_pickup',
+}
+
+
+def count_existing(apps, schema_editor):
+    """Start the counters from the open orders and conversations there are"""
+    DashboardCounter = apps.get_model('api', 'DashboardCounter')
+    Order = apps.get_model('api', 'Order')
+    Conversation = apps.get_model('api', 'Conversation')
+    using = schema_editor.connection.alias
+
+    counters, totals = [], {}
+    rows = (
+        Order.objects.using(using).filter(status__in=ORDER_COUNTERS).order_by()
+        .values_list('restaurant_id', 'status').annotate(count=models.Count('id'))
+    )
+    for restaurant_id, status, count in rows:
+        name = ORDER_COUNTERS[status]
+        counters.append(DashboardCounter(restaurant_id=restaurant_id, name=name, value=count))
+        totals[name] = totals.get(name, 0) + count
+    counters += [DashboardCounter(restaurant_id=None, name=name, value=value) for name, value in totals.items()]
+    if using == 'default':
+        counters.append(DashboardCounter(
+            restaurant_id=None, name='open_conversations',
+            value=Conversation.objects.using(using).filter(is_open=True).count(),
+        ))
+    DashboardCounter.objects.using(using).bulk_create(counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_listing_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('value', models.IntegerField(default=0)),
+                ('restaurant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dashboard_counters', to='api.restaurant')),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(fields=('restaurant', 'name'), name='unique_dashboard_counter'),
+                    models.UniqueConstraint(condition=models.Q(('restaurant__isnull', True)), fields=('name',), name='unique_global_dashboard_counter'),
+                ],
+            },
+        ),
+        migrations.RunPython(count_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.4 on 2026-10-19 13:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_dashboard_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='claimed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='claim_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.4 on 2026-10-19 14:10
+
+from django.db import migrations
+
+# Admin search (api/admin.py) looks these up with istartswith, which Postgres runs
+# as UPPER(col::text) LIKE 'TERM%'. text_pattern_ops lets an index answer that
+# LIKE whatever the database collation. SQLite has no such index for LIKE.
+PATTERN_INDEXES = [
+    ('api_user', 'username'),
+    ('api_user', 'email'),
+    ('api_user', 'first_name'),
+    ('api_user', 'last_name'),
+    ('api_restaurant', 'name'),
+    ('api_menuitem', 'name'),
+]
+
+
+def create_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in PATTERN_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {table}_{column}_upper_like ON {table} (UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in PATTERN_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{column}_upper_like')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_order_approval_claim'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_pattern_indexes, drop_pattern_indexes),
+    ]
@@ -1,7 +1,54 @@
-from django.db import models
-from django.contrib.auth.models import AbstractUser
 import uuid
 
+from django.db import models, router, transaction
+from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class ShardedQuerySet(models.QuerySet):
+    """
+    Manager of the sharded models (api/sharding.py). Django only hands the router
+    the row being written on save() and related managers; create(), get_or_create(),
+    update_or_create() and bulk_create() here pass the new row (or its field
+    values) too, so it goes to its restaurant's shard and not to 'default'. An
+    explicit using() wins.
+    """
+
+    def _write_shard(self, values):
+        # The field values as a hint rather than an instance built from them, so
+        # no default runs (ShardRouter reads the restaurant from them)
+        return router.db_for_write(self.model, values=values)
+
+    def create(self, **kwargs):
+        if self._db is None:
+            return self.using(self._write_shard(kwargs)).create(**kwargs)
+        return super().create(**kwargs)
+
+    def get_or_create(self, defaults=None, **kwargs):
+        if self._db is None:
+            alias = self._write_shard({**(defaults or {}), **kwargs})
+            return self.using(alias).get_or_create(defaults, **kwargs)
+        return super().get_or_create(defaults, **kwargs)
+
+    def update_or_create(self, defaults=None, create_defaults=None, **kwargs):
+        if self._db is None:
+            alias = self._write_shard({**(create_defaults or defaults or {}), **kwargs})
+            return self.using(alias).update_or_create(defaults, create_defaults, **kwargs)
+        return super().update_or_create(defaults, create_defaults, **kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None:
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        by_shard = {}
+        for obj in objs:
+            by_shard.setdefault(router.db_for_write(self.model, instance=obj), []).append(obj)
+        for alias, shard_objs in by_shard.items():
+            self.using(alias).bulk_create(shard_objs, *args, **kwargs)
+        return objs
+
+
 class User(AbstractUser):
     ROLE_CHOICES = (
         ('customer', 'Customer'),
@@ -12,48 +59,79 @@ class User(AbstractUser):
     restaurant = models.ForeignKey('Restaurant', on_delete=models.SET_NULL, null=True, blank=True)
 
 class Restaurant(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)
     address = models.CharField(max_length=200)
     phone_number = models.CharField(max_length=15)
     logo = models.ImageField(upload_to='restaurant_logos/', blank=True, null=True)
+    # Database alias holding the restaurant's menu, orders etc. (see api/sharding.py);
+    # only `manage.py move_restaurant` changes it
+    shard = models.CharField(max_length=32, blank=True, editable=False, db_index=True)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if not self.shard:
+            from .sharding import place_restaurant
+            self.shard = place_restaurant()
+        super().save(*args, **kwargs)
+
 class PaymentAccount(models.Model):
     ACCOUNT_TYPES = ( ('CBE', 'CBE'), ('Telebirr', 'Telebirr'), ('Awash', 'Awash'), ('Dashin', 'Dashin'), ('Other', 'Other'), )
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='payment_accounts')
     account_type = models.CharField(max_length=50, choices=ACCOUNT_TYPES)
     account_number = models.CharField(max_length=100)
+
+    objects = ShardedQuerySet.as_manager()
     def __str__(self):
         return f"{self.restaurant.name} - {self.account_type}"
 
 class MenuItem(models.Model):
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='menu_items')
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)
     description = models.TextField()
     price = models.DecimalField(max_digits=8, decimal_places=2)
     image = models.ImageField(upload_to='menu_images/')
+    # Restaurant's own code for the item, matches rows of a menu import (api/menu_import.py)
+    sku = models.CharField(max_length=64, null=True, blank=True)
+    # Denormalized from Rating, kept current by refresh_rating_aggregates()
+    average_rating = models.FloatField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['restaurant', 'sku'], name='unique_menu_item_sku'),
+        ]
+        # Price and rating ranges/sorts (api/filters.py), within a restaurant and across all
+        indexes = [
+            models.Index(fields=['restaurant', 'price'], name='menuitem_restaurant_price_idx'),
+            models.Index(fields=['restaurant', '-average_rating'], name='menuitem_restaurant_rating_idx'),
+            models.Index(fields=['price'], name='menuitem_price_idx'),
+            models.Index(fields=['-average_rating'], name='menuitem_rating_idx'),
+        ]
     
     def __str__(self):
         return self.name
-    
-    @property
-    def average_rating(self):
-        ratings = self.ratings.all()
-        if not ratings.exists():
-            return 0
-        return sum(rating.stars for rating in ratings) / ratings.count()
-    
-    @property
-    def rating_count(self):
-        return self.ratings.count()
 
 class Addon(models.Model):
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='addons')
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=8, decimal_places=2)
     image = models.ImageField(upload_to='addon_images/', blank=True, null=True)
+    sku = models.CharField(max_length=64, null=True, blank=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['restaurant', 'sku'], name='unique_addon_sku'),
+        ]
+        indexes = [
+            models.Index(fields=['restaurant', 'price'], name='addon_restaurant_price_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.restaurant.name})"
 
@@ -65,11 +143,53 @@ class Rating(models.Model):
     comment = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # One rating per customer and item; rating again updates it
+            models.UniqueConstraint(fields=['customer', 'menu_item'], name='unique_rating_per_customer_item'),
+        ]
+        indexes = [
+            models.Index(fields=['menu_item', '-created_at'], name='rating_menu_item_idx'),
+        ]
+
     def __str__(self):
         return f"{self.stars} stars for {self.menu_item.name} by {self.customer.username}"
 
+
+def refresh_rating_aggregates(menu_item_ids):
+    """Recompute MenuItem.average_rating/rating_count from the ratings, in one query"""
+    menu_item_ids = list(menu_item_ids)
+    stats = {
+        row['menu_item_id']: row
+        for row in Rating.objects.filter(menu_item_id__in=menu_item_ids)
+        .values('menu_item_id')
+        .annotate(avg=models.Avg('stars'), count=models.Count('id'))
+    }
+    MenuItem.objects.bulk_update(
+        [
+            MenuItem(
+                id=menu_item_id,
+                average_rating=stats[menu_item_id]['avg'] if menu_item_id in stats else 0,
+                rating_count=stats[menu_item_id]['count'] if menu_item_id in stats else 0,
+            )
+            for menu_item_id in menu_item_ids
+        ],
+        ['average_rating', 'rating_count'],
+    )
+
+class OrderCodeSequence(models.Model):
+    """Counter behind the order codes, handed out in blocks (see api/order_codes.py)"""
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
 def generate_order_code():
-    return str(uuid.uuid4().hex[:8].upper())
+    from .order_codes import next_order_code
+    return next_order_code()
 
 class Order(models.Model):
     STATUS_CHOICES = ( ('Pending Payment', 'Pending Payment'), ('Pending Approval', 'Pending Approval'), ('Preparing', 'Preparing'), ('Ready for Pickup', 'Ready for Pickup'), ('Delivered', 'Delivered'), ('Completed', 'Completed'), ('Cancelled', 'Cancelled'), )
@@ -81,6 +201,48 @@ class Order(models.Model):
     order_code = models.CharField(max_length=8, default=generate_order_code, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     ready_for_pickup_at = models.DateTimeField(null=True, blank=True, help_text='When the order was marked as ready for pickup')
+    # Sub-admin reviewing the order while it waits for approval, until claim_expires_at (api/approval_queue.py)
+    claimed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    claim_expires_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        # The order lists (api/filters.py): by status and date, per restaurant, customer or overall
+        indexes = [
+            models.Index(fields=['restaurant', 'status', '-created_at'], name='order_restaurant_status_idx'),
+            models.Index(fields=['customer', '-created_at'], name='order_customer_idx'),
+            models.Index(fields=['status', '-created_at'], name='order_status_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        order = super().from_db(db, field_names, values)
+        # The status as loaded, to tell in save() whether it changed
+        order._loaded_status = order.__dict__.get('status')
+        return order
+
+    def save(self, *args, **kwargs):
+        """Saves the order and, if its status changed, an OrderEvent in the same transaction"""
+        adding = self._state.adding
+        # None if the status wasn't loaded (deferred), then no event can be told
+        previous_status = None if adding else getattr(self, '_loaded_status', None)
+        update_fields = kwargs.get('update_fields')
+        status_saved = update_fields is None or 'status' in update_fields
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Order, instance=self)):
+            super().save(*args, **kwargs)
+            if status_saved and (adding or previous_status not in (None, self.status)):
+                OrderEvent.record(self, previous_status)
+                from .counters import order_status_changed
+                order_status_changed(self, previous_status)
+        if status_saved:
+            self._loaded_status = self.status
+
+    def delete(self, *args, **kwargs):
+        from .counters import order_deleted
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Order, instance=self)):
+            order_deleted(self)
+            return super().delete(*args, **kwargs)
     
     def __str__(self):
         return f"Order {self.order_code} by {self.customer.username}"
@@ -102,6 +264,8 @@ class OrderItem(models.Model):
     menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE, null=True, blank=True)
     addon = models.ForeignKey(Addon, on_delete=models.CASCADE, null=True, blank=True)
     quantity = models.PositiveIntegerField(default=1)
+
+    objects = ShardedQuerySet.as_manager()
     def __str__(self):
         if self.menu_item: return f"{self.quantity} of {self.menu_item.name}"
         if self.addon: return f"{self.quantity} of {self.addon.name} (Addon)"
@@ -112,6 +276,30 @@ class Conversation(models.Model):
     subject = models.CharField(max_length=255, default="General Inquiry")
     created_at = models.DateTimeField(auto_now_add=True)
     is_open = models.BooleanField(default=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        conversation = super().from_db(db, field_names, values)
+        conversation._loaded_is_open = conversation.__dict__.get('is_open')
+        return conversation
+
+    def save(self, *args, **kwargs):
+        """Saves the conversation and, if it was opened or closed, the open conversations counter"""
+        from .counters import conversation_changed
+        was_open = False if self._state.adding else getattr(self, '_loaded_is_open', None)
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Conversation, instance=self)):
+            super().save(*args, **kwargs)
+            if was_open is not None and was_open != self.is_open:
+                conversation_changed(1 if self.is_open else -1, self._state.db)
+        self._loaded_is_open = self.is_open
+
+    def delete(self, *args, **kwargs):
+        from .counters import conversation_changed
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Conversation, instance=self)):
+            if self.is_open:
+                conversation_changed(-1, self._state.db)
+            return super().delete(*args, **kwargs)
+
     def __str__(self):
         return f"Chat with {self.customer.username}"
 
@@ -127,6 +315,8 @@ class ChatMessage(models.Model):
 class ActivityLog(models.Model):
     class ActionType(models.TextChoices):
         ORDER_APPROVED = 'ORDER_APPROVED', 'Order Approved'
+        ORDER_CANCELLED = 'ORDER_CANCELLED', 'Order Cancelled'
+        ORDER_READY = 'ORDER_READY', 'Order Ready for Pickup'
         ORDER_DELIVERED = 'ORDER_DELIVERED', 'Order Delivered'
 
     actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, help_text='The sub-admin who performed the action.')
@@ -134,10 +324,322 @@ class ActivityLog(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     action_type = models.CharField(max_length=50, choices=ActionType.choices)
     details = models.TextField(blank=True, help_text='Extra details like customer name, order total, etc.')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the action happened, not when api/activity.py got round to writing it
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['-timestamp'], name='activitylog_timestamp_idx'),
+            models.Index(fields=['restaurant', '-timestamp'], name='activitylog_restaurant_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.action_type} by {self.actor} on {self.order}"
+
+# --- Search Index ---
+class SearchEntry(models.Model):
+    """
+    One row per searchable menu item, addon or restaurant, kept in sync by the
+    signals in api/signals.py. The full-text index itself (FTS5 on SQLite, a
+    tsvector column on Postgres) is created in the migration, see api/search.py.
+    """
+    class Kind(models.TextChoices):
+        MENU_ITEM = 'menu_item', 'Menu Item'
+        ADDON = 'addon', 'Addon'
+        RESTAURANT = 'restaurant', 'Restaurant'
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    object_id = models.PositiveBigIntegerField()
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='search_entries')
+    restaurant_name = models.CharField(max_length=100)
+    title = models.CharField(max_length=200)
+    body = models.TextField(blank=True)
+    price = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    image = models.CharField(max_length=255, blank=True)
+    average_rating = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_search_entry'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}: {self.title}"
+
+# --- Order Archive ---
+# Completed and cancelled orders are moved here by `manage.py archive_orders`, so
+# the hot Order/OrderItem/ActivityLog tables only hold recent and open orders.
+# Rows keep the primary key they had in the hot table.
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='archived_orders')
+    total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    payment_proof = models.ImageField(upload_to='payment_proofs/', blank=True, null=True)
+    order_code = models.CharField(max_length=8, db_index=True)
+    created_at = models.DateTimeField()
+    ready_for_pickup_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['customer', '-created_at'], name='archivedorder_customer_idx'),
+            models.Index(fields=['restaurant', '-created_at'], name='archivedorder_restaurant_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.order_code}"
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    addon = models.ForeignKey(Addon, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    quantity = models.PositiveIntegerField(default=1)
+
+    objects = ShardedQuerySet.as_manager()
+
+class ArchivedActivityLog(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='+')
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='activity_logs')
+    action_type = models.CharField(max_length=50, choices=ActivityLog.ActionType.choices)
+    details = models.TextField(blank=True)
+    timestamp = models.DateTimeField()
+
+    objects = ShardedQuerySet.as_manager()
 
     class Meta:
         ordering = ['-timestamp']
 
+# --- Idempotency Keys ---
+class IdempotencyKey(models.Model):
+    """
+    A client-supplied Idempotency-Key and the response it got, so retries of the
+    same request are answered from here (see api/idempotency.py). status_code is
+    null while the first request is still running.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text='Hash of the method, path and payload')
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.user_id})"
+
+# --- Recommendations ---
+class ItemPair(models.Model):
+    """
+    One nonzero cell of a restaurant's co-occurrence matrix: how many completed
+    orders contained both this menu item and the other item. The pair of a menu
+    item with itself counts the orders containing that item. See
+    api/recommendations.py.
+    """
+    class Kind(models.TextChoices):
+        MENU_ITEM = 'menu_item', 'Menu Item'
+        ADDON = 'addon', 'Addon'
+
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='+')
+    menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+    other_kind = models.CharField(max_length=20, choices=Kind.choices)
+    other_id = models.PositiveBigIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['menu_item', 'other_kind', 'other_id'], name='unique_item_pair'),
+        ]
+
+class Recommendation(models.Model):
+    """The precomputed "frequently ordered together" list of a menu item"""
+    menu_item = models.OneToOneField(MenuItem, on_delete=models.CASCADE, primary_key=True, related_name='recommendation')
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='+')
+    # [{"kind": "addon", "id": 3, "count": 12, "confidence": 0.4}, ...], best first
+    suggestions = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Recommendations for {self.menu_item_id}"
+
+# --- Preparation Time ---
+class PrepTimeSketch(models.Model):
+    """
+    Streaming quantile estimates of a restaurant's preparation time (order
+    placed -> ready for pickup) for one hour of the day, or for all hours
+    together (hour = ALL_HOURS). See api/eta.py.
+    """
+    ALL_HOURS = 24
+
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='prep_time_sketches')
+    hour = models.PositiveSmallIntegerField(help_text='Hour of day the orders were placed (UTC), 24 for all hours')
+    count = models.PositiveIntegerField(default=0)
+    state = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['restaurant', 'hour'], name='unique_prep_time_sketch'),
+        ]
+
+    def __str__(self):
+        return f"Prep time of {self.restaurant_id} at {self.hour}h ({self.count} orders)"
+
+# --- Dashboard Counters ---
+class DashboardCounter(models.Model):
+    """
+    Live count of open orders in one status, or of open conversations, for one
+    restaurant or (restaurant = None) for all of them. Changed in the same
+    transaction as the order or conversation, see api/counters.py.
+    """
+    restaurant = models.ForeignKey(
+        Restaurant, on_delete=models.CASCADE, null=True, blank=True, related_name='dashboard_counters'
+    )
+    name = models.CharField(max_length=32)
+    value = models.IntegerField(default=0)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['restaurant', 'name'], name='unique_dashboard_counter'),
+            # NULLs are distinct in the constraint above
+            models.UniqueConstraint(
+                fields=['name'], condition=models.Q(restaurant__isnull=True), name='unique_global_dashboard_counter'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} of {self.restaurant_id or 'all restaurants'}: {self.value}"
+
+# --- Resumable Uploads ---
+class UploadSession(models.Model):
+    """
+    A payment proof being uploaded in chunks (see api/uploads.py). The bytes go to
+    a temporary file; `received` is how many of them arrived, so an interrupted
+    upload resumes from there. Once complete the image is processed in the
+    background and attached to the order.
+    """
+    class Status(models.TextChoices):
+        RECEIVING = 'receiving', 'Receiving'
+        PROCESSING = 'processing', 'Processing'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(help_text='Total size in bytes, declared when the upload starts')
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.RECEIVING)
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='uploadsession_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} for order {self.order_id} ({self.status})"
+
+# --- Order Events ---
+class OrderEvent(models.Model):
+    """
+    Outbox of order status changes, written in the same transaction as the
+    change (see Order.save). Webhooks are delivered from here and the change feed
+    reads it; the id orders the events. See api/webhooks.py.
+    """
+    class EventType(models.TextChoices):
+        ORDER_CREATED = 'order.created', 'Order Created'
+        STATUS_CHANGED = 'order.status_changed', 'Order Status Changed'
+
+    event_type = models.CharField(max_length=40, choices=EventType.choices)
+    # Not foreign keys: events outlive orders that get archived
+    order_id = models.BigIntegerField()
+    order_code = models.CharField(max_length=8)
+    customer_id = models.BigIntegerField(db_index=True)
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='order_events')
+    from_status = models.CharField(max_length=20, blank=True)
+    to_status = models.CharField(max_length=20)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['restaurant', 'id'], name='orderevent_restaurant_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.order_code}: {self.from_status or '-'} -> {self.to_status}"
+
+    @classmethod
+    def record(cls, order, previous_status):
+        # On the order's database, so it is part of the same transaction
+        return cls.objects.using(order._state.db).create(
+            event_type=cls.EventType.STATUS_CHANGED if previous_status else cls.EventType.ORDER_CREATED,
+            order_id=order.pk, order_code=order.order_code, customer_id=order.customer_id,
+            restaurant_id=order.restaurant_id, from_status=previous_status or '', to_status=order.status,
+        )
+
+    def to_payload(self):
+        return {
+            'id': self.pk,
+            'type': self.event_type,
+            'created_at': self.created_at.isoformat(),
+            'order': {
+                'id': self.order_id,
+                'order_code': self.order_code,
+                'restaurant': self.restaurant_id,
+                'previous_status': self.from_status or None,
+                'status': self.to_status,
+            },
+        }
+
+class WebhookEndpoint(models.Model):
+    """
+    A URL a restaurant wants its order events POSTed to. `last_event_id` is how far
+    delivery got; failures push `next_attempt_at` back exponentially.
+    """
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='webhook_endpoints')
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=64, help_text='Key of the HMAC-SHA256 signature of each delivery')
+    is_active = models.BooleanField(default=True)
+    last_event_id = models.BigIntegerField(default=0)
+    failure_count = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # Set while a worker delivers to the endpoint, so two workers never both do
+    leased_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ShardedQuerySet.as_manager()
+
     def __str__(self):
-        return f"{self.action_type} by {self.actor} on {self.order}"
\ No newline at end of file
+        return f"{self.url} ({self.restaurant_id})"
@@ -0,0 +1,127 @@
+"""
+Order code allocation.
+
+Order codes are 8 characters, like the old ones, but are built from a counter
+instead of a random uuid, so two orders can never get the same code:
+
+  counter -> 38 bit Feistel permutation -> 8 character code
+
+The permutation is a bijection on [0, 2**38), so distinct counter values always
+give distinct codes, while consecutive orders still get unrelated-looking codes.
+The first character is one of GHJKMNPQ (the top 3 bits), which never occurs in
+the old hex codes, and the other 7 are Crockford base32 (35 bits).
+
+Counter values come from the OrderCodeSequence row in blocks of
+ORDER_CODE_BLOCK_SIZE, so each worker only touches the database once per block.
+Unused values of a block are lost when the worker exits; there are 2**38 of them.
+
+Never change ROUND_KEYS or the alphabets: codes already issued would collide
+with new ones.
+"""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .models import OrderCodeSequence
+
+SEQUENCE_NAME = 'order_code'
+
+HALF_BITS = 19
+HALF_MASK = (1 << HALF_BITS) - 1
+CODE_BITS = 2 * HALF_BITS
+CODE_SPACE = 1 << CODE_BITS
+
+ROUND_KEYS = (0x1B873593, 0x0CC9E2D5, 0x2545F491, 0x165667B1)
+
+FIRST_ALPHABET = 'GHJKMNPQ'
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+
+# --- Permutation ---
+def _round(half, key):
+    # Only +, *, ^, >> and & on values kept below 2**63, so it gives the same
+    # result for Python ints and for numpy uint64 arrays (see api/tests.py)
+    h = (half * 0x9E3779B1 + key) & 0xFFFFFFFF
+    h ^= h >> 15
+    h = (h * 0x2C1B3C6D) & 0xFFFFFFFF
+    h ^= h >> 12
+    return h & HALF_MASK
+
+
+def permute(value):
+    """Map a counter value in [0, 2**38) to a unique, scrambled value in the same range"""
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for key in ROUND_KEYS:
+        left, right = right, left ^ _round(right, key)
+    return (left << HALF_BITS) | right
+
+
+def encode(value):
+    chars = []
+    for _ in range(7):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return FIRST_ALPHABET[value] + ''.join(reversed(chars))
+
+
+def code_for(counter):
+    if not 0 <= counter < CODE_SPACE:
+        raise ValueError('Order code space exhausted')
+    return encode(permute(counter))
+
+
+# --- Counter blocks ---
+def reserve_block(size):
+    """Take `size` counter values from the sequence row and return the first one"""
+    for _ in range(2):
+        with transaction.atomic():
+            updated = OrderCodeSequence.objects.filter(name=SEQUENCE_NAME).update(
+                next_value=F('next_value') + size
+            )
+            if updated:
+                # The row stays locked until the end of the transaction, so this
+                # reads our own update
+                return OrderCodeSequence.objects.get(name=SEQUENCE_NAME).next_value - size
+        try:
+            with transaction.atomic():
+                OrderCodeSequence.objects.create(name=SEQUENCE_NAME)
+        except IntegrityError:
+            pass  # Another worker created it first
+    raise RuntimeError('Could not reserve order codes')
+
+
+class OrderCodeAllocator:
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next_code(self):
+        if connection.in_atomic_block:
+            # A block reserved here would be handed back if the transaction rolls
+            # back, while this process kept using it. Take a single value instead,
+            # which is rolled back together with the order that uses it.
+            return code_for(reserve_block(1))
+        with self._lock:
+            if self._next >= self._end:
+                self._next = reserve_block(self.block_size)
+                self._end = self._next + self.block_size
+            counter = self._next
+            self._next += 1
+        return code_for(counter)
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def next_order_code():
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                _allocator = OrderCodeAllocator(settings.ORDER_CODE_BLOCK_SIZE)
+    return _allocator.next_code()
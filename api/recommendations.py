@@ -0,0 +1,279 @@
+"""
+"Frequently ordered together" recommendations.
+
+For each restaurant, the co-occurrence matrix C counts, for every pair of items
+(menu items and addons), how many completed orders contained both; C[i, i] is
+the number of orders containing item i. Its nonzero cells are stored as
+ItemPair rows, and each menu item's top suggestions (largest C[i, j], with
+confidence C[i, j] / C[i, i]) as a Recommendation row.
+
+- build_restaurant() recomputes everything for a restaurant from the order
+  history (hot and archived) with NumPy: `manage.py build_recommendations`.
+- record_order() adds one newly completed order to the counts and refreshes
+  the suggestions of its menu items.
+- suggestions_for() serves a menu item's list from the cache, so a request
+  costs two cache reads rather than queries. Entries are per menu item and only
+  dropped when that item's list, or its restaurant's menu, changes.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import router, transaction
+from django.db.models import F, Q
+
+from .models import (
+    MenuItem, Addon, OrderItem, ArchivedOrderItem, ItemPair, Recommendation,
+)
+
+MENU_ITEM = ItemPair.Kind.MENU_ITEM
+ADDON = ItemPair.Kind.ADDON
+
+# Orders per matrix multiplication, bounds memory to ORDER_CHUNK x items
+ORDER_CHUNK = 5000
+
+
+# --- Batch build ---
+def _order_rows(restaurant_id):
+    """(order_id, menu_item_id, addon_id) of every completed order of the restaurant"""
+    hot = OrderItem.objects.filter(
+        order__restaurant_id=restaurant_id, order__status='Completed'
+    ).values_list('order_id', 'menu_item_id', 'addon_id')
+    archived = ArchivedOrderItem.objects.filter(
+        order__restaurant_id=restaurant_id, order__status='Completed'
+    ).values_list('order_id', 'menu_item_id', 'addon_id')
+    return list(hot.iterator()) + list(archived.iterator())
+
+
+def cooccurrence_counts(rows, menu_item_ids, addon_ids):
+    """
+    The nonzero cells of C = B.T @ B, where B is the order x item incidence
+    matrix, as (row, column, count) arrays sorted by row then column. Menu items
+    are columns 0..M-1, addons come after them.
+
+    C is sparse (a restaurant's orders hold a few items each), so it is never
+    built densely: the pairs of items of each order are generated with NumPy and
+    counted with np.unique, ORDER_CHUNK orders at a time. Memory follows the
+    number of distinct pairs, not the square of the menu size.
+    """
+    # Imported here rather than at the top: views import this module, and NumPy
+    # would otherwise add ~40ms to every cold start of the API
+    import numpy as np
+
+    column = {(MENU_ITEM, item_id): index for index, item_id in enumerate(menu_item_ids)}
+    column.update({(ADDON, addon_id): len(menu_item_ids) + index for index, addon_id in enumerate(addon_ids)})
+    size = len(column)
+    empty = np.zeros(0, dtype=np.int64)
+
+    orders, columns = [], []
+    for order_id, menu_item_id, addon_id in rows:
+        key = (MENU_ITEM, menu_item_id) if menu_item_id else (ADDON, addon_id)
+        if key in column:
+            orders.append(order_id)
+            columns.append(column[key])
+    if not orders:
+        return empty, empty, empty
+    _, order_index = np.unique(np.array(orders), return_inverse=True)
+    # An item ordered twice (two rows or quantity > 1) still counts once
+    cells = np.unique(order_index.astype(np.int64) * size + np.array(columns, dtype=np.int64))
+    order_index, columns = cells // size, cells % size
+
+    keys, counts = [empty], [empty]
+    for start in range(0, int(order_index[-1]) + 1, ORDER_CHUNK):
+        first, last = np.searchsorted(order_index, [start, start + ORDER_CHUNK])
+        chunk_orders, chunk_columns = order_index[first:last], columns[first:last]
+        if not len(chunk_orders):
+            continue
+        # Every (entry, entry of the same order) pair: each entry repeated once
+        # per item of its order, against that order's entries in turn
+        _, group_start, group_size = np.unique(chunk_orders, return_index=True, return_counts=True)
+        group = np.searchsorted(group_start, np.arange(len(chunk_orders)), side='right') - 1
+        repeats = group_size[group]
+        left = np.repeat(np.arange(len(chunk_orders)), repeats)
+        offset = np.arange(len(left)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        right = group_start[group[left]] + offset
+        chunk_keys, chunk_counts = np.unique(chunk_columns[left] * size + chunk_columns[right], return_counts=True)
+        keys.append(chunk_keys)
+        counts.append(chunk_counts)
+
+    # Chunks can share cells: add them up
+    cells, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+    return cells // size, cells % size, totals
+
+
+def top_suggestions(cells, menu_item_count, keys, top_k):
+    """Top-k suggestions for each menu item row of the cells, as lists of dicts"""
+    import numpy as np
+
+    rows, columns, counts = cells
+    menu_rows = rows < menu_item_count
+    rows, columns, counts = rows[menu_rows], columns[menu_rows], counts[menu_rows]
+    on_diagonal = rows == columns
+    totals = np.zeros(menu_item_count, dtype=np.int64)
+    totals[rows[on_diagonal]] = counts[on_diagonal]
+    rows, columns, counts = rows[~on_diagonal], columns[~on_diagonal], counts[~on_diagonal]
+    # By row, then count descending, then column: menu items before addons, then id
+    order = np.lexsort((columns, -counts, rows))
+    result = [[] for _ in range(menu_item_count)]
+    for row, column, count in zip(rows[order].tolist(), columns[order].tolist(), counts[order].tolist()):
+        if len(result[row]) < top_k:
+            result[row].append({
+                'kind': keys[column][0], 'id': keys[column][1], 'count': count,
+                'confidence': round(count / int(totals[row]), 3),
+            })
+    return result
+
+
+def build_restaurant(restaurant_id, top_k=None):
+    """Recompute the co-occurrence counts and suggestions of one restaurant"""
+    top_k = top_k or settings.RECOMMENDATIONS_TOP_K
+    menu_item_ids = list(MenuItem.objects.filter(restaurant_id=restaurant_id).order_by('id').values_list('id', flat=True))
+    addon_ids = list(Addon.objects.filter(restaurant_id=restaurant_id).order_by('id').values_list('id', flat=True))
+    keys = [(MENU_ITEM, item_id) for item_id in menu_item_ids] + [(ADDON, addon_id) for addon_id in addon_ids]
+
+    cells = cooccurrence_counts(_order_rows(restaurant_id), menu_item_ids, addon_ids)
+    rows, columns, counts = cells
+    pairs = [
+        ItemPair(
+            restaurant_id=restaurant_id, menu_item_id=menu_item_ids[row],
+            other_kind=keys[column][0], other_id=keys[column][1], count=count,
+        )
+        for row, column, count in zip(rows.tolist(), columns.tolist(), counts.tolist())
+        if row < len(menu_item_ids)
+    ]
+    suggestions = top_suggestions(cells, len(menu_item_ids), keys, top_k)
+
+    db = router.db_for_write(ItemPair)
+    with transaction.atomic(using=db):
+        ItemPair.objects.filter(restaurant_id=restaurant_id).delete()
+        ItemPair.objects.bulk_create(pairs, batch_size=1000)
+        Recommendation.objects.filter(restaurant_id=restaurant_id).delete()
+        Recommendation.objects.bulk_create([
+            Recommendation(menu_item_id=item_id, restaurant_id=restaurant_id, suggestions=items)
+            for item_id, items in zip(menu_item_ids, suggestions)
+        ], batch_size=1000)
+        transaction.on_commit(lambda: forget(menu_item_ids), using=db)
+    return len(pairs)
+
+
+# --- Incremental updates ---
+def record_order(order):
+    """Add a newly completed order to its restaurant's counts"""
+    items = list(OrderItem.objects.filter(order=order).values_list('menu_item_id', 'addon_id'))
+    menu_item_ids = sorted({menu_item_id for menu_item_id, _ in items if menu_item_id})
+    others = sorted(
+        {(MENU_ITEM, item_id) for item_id in menu_item_ids}
+        | {(ADDON, addon_id) for menu_item_id, addon_id in items if addon_id and not menu_item_id}
+    )
+    if not menu_item_ids:
+        return
+
+    with transaction.atomic(using=router.db_for_write(ItemPair, instance=order)):
+        ItemPair.objects.bulk_create([
+            ItemPair(restaurant_id=order.restaurant_id, menu_item_id=item_id,
+                     other_kind=kind, other_id=other_id, count=0)
+            for item_id in menu_item_ids for kind, other_id in others
+        ], ignore_conflicts=True)
+        pairs = Q()
+        for kind, other_id in others:
+            pairs |= Q(other_kind=kind, other_id=other_id)
+        ItemPair.objects.filter(pairs, menu_item_id__in=menu_item_ids).update(count=F('count') + 1)
+        refresh_suggestions(order.restaurant_id, menu_item_ids)
+
+
+def refresh_suggestions(restaurant_id, menu_item_ids, top_k=None):
+    """Recompute the suggestions of some menu items from their stored counts"""
+    top_k = top_k or settings.RECOMMENDATIONS_TOP_K
+    counts = {item_id: {} for item_id in menu_item_ids}
+    for item_id, kind, other_id, count in ItemPair.objects.filter(menu_item_id__in=menu_item_ids).values_list(
+        'menu_item_id', 'other_kind', 'other_id', 'count'
+    ):
+        counts[item_id][(kind, other_id)] = count
+
+    recommendations = []
+    for item_id, row in counts.items():
+        total = row.pop((MENU_ITEM, item_id), 0)
+        # Same order as the batch build: count, then menu items before addons, then id
+        best = sorted(row.items(), key=lambda pair: (-pair[1], pair[0][0] == ADDON, pair[0][1]))[:top_k]
+        recommendations.append(Recommendation(
+            menu_item_id=item_id, restaurant_id=restaurant_id,
+            suggestions=[
+                {'kind': kind, 'id': other_id, 'count': count, 'confidence': round(count / total, 3)}
+                for (kind, other_id), count in best if count > 0 and total
+            ],
+        ))
+    Recommendation.objects.bulk_create(
+        recommendations, update_conflicts=True,
+        unique_fields=['menu_item'], update_fields=['suggestions', 'updated_at'],
+    )
+    transaction.on_commit(lambda: forget(menu_item_ids), using=router.db_for_write(Recommendation))
+
+
+# --- Lookups ---
+def _resolve(suggestions):
+    """Add names, prices and images to stored suggestions, dropping deleted items"""
+    menu_items = MenuItem.objects.in_bulk([s['id'] for s in suggestions if s['kind'] == MENU_ITEM])
+    addons = Addon.objects.in_bulk([s['id'] for s in suggestions if s['kind'] == ADDON])
+    resolved = []
+    for suggestion in suggestions:
+        item = (menu_items if suggestion['kind'] == MENU_ITEM else addons).get(suggestion['id'])
+        if item is None:
+            continue
+        resolved.append({
+            **suggestion,
+            'name': item.name,
+            'price': str(item.price),
+            'image': default_storage.url(item.image.name) if item.image else None,
+        })
+    return resolved
+
+
+# --- Cache ---
+# Each menu item's resolved list is cached on its own, with the menu version of
+# its restaurant: a new order only drops the lists of the items in it (forget()),
+# a menu edit only those of that restaurant (menu_changed(), from api/signals.py).
+SUGGESTIONS_KEY = 'recommendations:{}'
+MENU_VERSION_KEY = 'recommendations:menu:{}'
+
+
+def _menu_version(restaurant_id):
+    key = MENU_VERSION_KEY.format(restaurant_id)
+    version = cache.get(key)
+    if version is None:
+        # add() so two workers starting at the same time agree on one value
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def menu_changed(restaurant_id):
+    """Names, prices or images of a restaurant's items changed: resolve its lists again"""
+    try:
+        cache.incr(MENU_VERSION_KEY.format(restaurant_id))
+    except ValueError:
+        cache.set(MENU_VERSION_KEY.format(restaurant_id), time.time_ns(), timeout=None)
+
+
+def forget(menu_item_ids):
+    """The stored suggestions of these menu items changed"""
+    cache.delete_many([SUGGESTIONS_KEY.format(item_id) for item_id in menu_item_ids])
+
+
+def suggestions_for(menu_item_id):
+    """A menu item's suggestions, best first: two cache reads unless they changed"""
+    key = SUGGESTIONS_KEY.format(menu_item_id)
+    cached = cache.get(key)
+    if cached is not None:
+        restaurant_id, version, suggestions = cached
+        if restaurant_id is None or version == _menu_version(restaurant_id):
+            return suggestions
+
+    stored = Recommendation.objects.filter(menu_item_id=menu_item_id).values_list('restaurant_id', 'suggestions').first()
+    restaurant_id, stored = stored or (None, [])
+    # Read before the items, so an edit made meanwhile isn't cached as current
+    version = _menu_version(restaurant_id) if restaurant_id is not None else None
+    suggestions = _resolve(stored)
+    cache.set(key, (restaurant_id, version, suggestions), settings.API_CACHE_TIMEOUT)
+    return suggestions
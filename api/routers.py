@@ -0,0 +1,92 @@
+"""
+Primary/replica database routing.
+
+When a `replica` database is configured, viewsets using ReplicaReadMixin serve
+their list/retrieve actions from it. Everything else, and any read that follows
+a write in the same request, goes to the primary. After a user writes, their
+reads stay on the primary for REPLICA_STICKY_SECONDS so they don't read their
+own changes back from a replica that hasn't caught up yet.
+
+The replica is a copy of 'default' only. With DATABASE_SHARDS set, ShardRouter
+(api/sharding.py) runs first and routes every sharded model (menus, addons,
+payment accounts, ratings, orders...) to its shard, so only the global models,
+e.g. restaurants and users, are read from the replica then.
+"""
+import contextvars
+
+from django.conf import settings
+from django.core.cache import cache
+
+REPLICA = 'replica'
+STICKY_KEY = 'db:sticky:{}'
+
+_routing = contextvars.ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    def __init__(self):
+        self.use_replica = False
+        self.wrote = False
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is not None and state.use_replica and not state.wrote and replica_configured():
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, so rows from either can be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary through replication
+        return db != REPLICA
+
+
+class ReplicaRoutingMiddleware:
+    """Gives each request its own routing state and records sticky writes"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RoutingState()
+        token = _routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+
+        # DRF copies the authenticated (JWT) user back onto the Django request
+        user = getattr(request, 'user', None)
+        if state.wrote and user is not None and user.is_authenticated:
+            cache.set(STICKY_KEY.format(user.pk), True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+
+class ReplicaReadMixin:
+    """ViewSet mixin: serve the read-only actions from the replica"""
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        # Authentication runs in here, so the user is always read from the primary
+        super().initial(request, *args, **kwargs)
+
+        state = _routing.get()
+        if state is None or not replica_configured() or self.action not in self.replica_actions:
+            return
+        if request.user.is_authenticated and cache.get(STICKY_KEY.format(request.user.pk)):
+            return
+        state.use_replica = True
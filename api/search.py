@@ -0,0 +1,274 @@
+"""
+Full-text search over menu items, addons and restaurants.
+
+SearchEntry rows are the precomputed documents. The 0011 migration puts a
+full-text index on top of them: an external-content FTS5 table kept in sync by
+triggers on SQLite, and a generated tsvector column with a GIN index on Postgres.
+Other backends (or SQLite builds without FTS5) fall back to LIKE queries.
+
+Typos are handled by retrying a query that found nothing with each word replaced
+by its closest matches from the indexed vocabulary.
+"""
+import difflib
+import re
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+
+from . import sharding
+from .cache import bump_version, make_key
+from .models import SearchEntry, MenuItem, Addon, Restaurant
+
+# How much one star of average rating is worth next to text relevance
+RATING_WEIGHT = 0.25
+MIN_FUZZY_LENGTH = 3
+
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    return WORD_RE.findall((text or '').lower())
+
+
+# --- Indexing ---
+def _save_entry(kind, obj, restaurant, title, body, price=None, image='', average_rating=0):
+    SearchEntry.objects.update_or_create(
+        kind=kind,
+        object_id=obj.pk,
+        defaults={
+            'restaurant': restaurant,
+            'restaurant_name': restaurant.name,
+            'title': title,
+            'body': body,
+            'price': price,
+            'image': image or '',
+            'average_rating': average_rating or 0,
+        },
+    )
+    bump_version(SearchEntry)
+
+
+def _menu_item_entry(menu_item):
+    restaurant = menu_item.restaurant
+    return dict(
+        kind=SearchEntry.Kind.MENU_ITEM, obj=menu_item, restaurant=restaurant,
+        title=menu_item.name,
+        body=f"{menu_item.description}\n{restaurant.name}",
+        price=menu_item.price,
+        image=menu_item.image.name if menu_item.image else '',
+        average_rating=menu_item.average_rating,
+    )
+
+
+def _addon_entry(addon):
+    restaurant = addon.restaurant
+    return dict(
+        kind=SearchEntry.Kind.ADDON, obj=addon, restaurant=restaurant,
+        title=addon.name,
+        body=restaurant.name,
+        price=addon.price,
+        image=addon.image.name if addon.image else '',
+    )
+
+
+def index_menu_item(menu_item):
+    _save_entry(**_menu_item_entry(menu_item))
+
+
+def index_addon(addon):
+    _save_entry(**_addon_entry(addon))
+
+
+def index_many(menu_items=(), addons=()):
+    """
+    Index many menu items and addons in one upsert, for bulk writes that don't
+    send signals (see api/menu_import.py)
+    """
+    entries = []
+    for entry in [_menu_item_entry(item) for item in menu_items] + [_addon_entry(addon) for addon in addons]:
+        obj, restaurant = entry.pop('obj'), entry['restaurant']
+        entry['average_rating'] = entry.get('average_rating') or 0
+        entries.append(SearchEntry(object_id=obj.pk, restaurant_name=restaurant.name, **entry))
+    SearchEntry.objects.bulk_create(
+        entries, batch_size=500, update_conflicts=True, unique_fields=['kind', 'object_id'],
+        update_fields=['restaurant', 'restaurant_name', 'title', 'body', 'price', 'image', 'average_rating'],
+    )
+    bump_version(SearchEntry)
+
+
+def index_restaurant(restaurant, include_menu=False):
+    _save_entry(
+        SearchEntry.Kind.RESTAURANT, restaurant, restaurant,
+        title=restaurant.name,
+        body=restaurant.address,
+        image=restaurant.logo.name if restaurant.logo else '',
+    )
+    if include_menu:
+        # Menu entries carry the restaurant name, so a rename touches them too
+        for menu_item in restaurant.menu_items.all():
+            index_menu_item(menu_item)
+        for addon in restaurant.addons.all():
+            index_addon(addon)
+
+
+def update_ratings(menu_item_ids):
+    """Copy the (already refreshed) rating aggregates of these items into the index"""
+    for menu_item_id, average_rating in MenuItem.objects.filter(
+        pk__in=menu_item_ids
+    ).values_list('id', 'average_rating'):
+        SearchEntry.objects.filter(
+            kind=SearchEntry.Kind.MENU_ITEM, object_id=menu_item_id
+        ).update(average_rating=average_rating)
+
+
+def remove(kind, object_id):
+    SearchEntry.objects.filter(kind=kind, object_id=object_id).delete()
+    bump_version(SearchEntry)
+
+
+def rebuild_index():
+    """Reindex everything from scratch. Returns the number of entries."""
+    SearchEntry.objects.all().delete()
+    for restaurant in Restaurant.objects.all():
+        index_restaurant(restaurant)
+    # Menus are spread over the database shards, the index is on 'default'
+    for alias in sharding.shards():
+        for menu_item in MenuItem.objects.using(alias).select_related('restaurant'):
+            index_menu_item(menu_item)
+        for addon in Addon.objects.using(alias).select_related('restaurant'):
+            index_addon(addon)
+    return SearchEntry.objects.count()
+
+
+# --- Querying ---
+def _fts_table_exists():
+    key = f'_fts_exists_{connection.alias}'
+    if not hasattr(connection, key):
+        setattr(connection, key, 'api_searchentry_fts' in connection.introspection.table_names())
+    return getattr(connection, key)
+
+
+def _backend():
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite' and _fts_table_exists():
+        return 'sqlite'
+    return 'fallback'
+
+
+def _vocabulary():
+    key = make_key('search-vocabulary', (SearchEntry,))
+    words = cache.get(key)
+    if words is None:
+        words = set()
+        for title, body in SearchEntry.objects.values_list('title', 'body').iterator():
+            words.update(tokenize(title))
+            words.update(tokenize(body))
+        words = sorted(word for word in words if len(word) >= MIN_FUZZY_LENGTH)
+        cache.set(key, words, None)
+    return words
+
+
+def _expand(tokens):
+    """Turn each token into a list of alternatives: itself plus close matches."""
+    vocabulary = _vocabulary()
+    groups = []
+    for token in tokens:
+        alternatives = [token]
+        if len(token) >= MIN_FUZZY_LENGTH:
+            for match in difflib.get_close_matches(token, vocabulary, n=3, cutoff=0.75):
+                if match not in alternatives:
+                    alternatives.append(match)
+        groups.append(alternatives)
+    return groups
+
+
+def _filters(restaurant_id, kinds, alias='e'):
+    sql, params = [], []
+    if restaurant_id:
+        sql.append(f'{alias}.restaurant_id = %s')
+        params.append(restaurant_id)
+    if kinds:
+        sql.append(f"{alias}.kind IN ({', '.join(['%s'] * len(kinds))})")
+        params.extend(kinds)
+    return ''.join(f' AND {clause}' for clause in sql), params
+
+
+def _search_sqlite(groups, restaurant_id, kinds, limit):
+    # Every word must match; a word matches if any of its alternatives prefix-match
+    match = ' AND '.join(
+        '(' + ' OR '.join(f'"{word}"*' for word in alternatives) + ')'
+        for alternatives in groups
+    )
+    extra, params = _filters(restaurant_id, kinds)
+    sql = (
+        'SELECT e.*, -bm25(api_searchentry_fts, 10.0, 1.0) AS relevance '
+        'FROM api_searchentry_fts JOIN api_searchentry e ON e.id = api_searchentry_fts.rowid '
+        f'WHERE api_searchentry_fts MATCH %s{extra} '
+        'ORDER BY relevance + e.average_rating * %s DESC LIMIT %s'
+    )
+    return list(SearchEntry.objects.raw(sql, [match, *params, RATING_WEIGHT, limit]))
+
+
+def _search_postgres(groups, restaurant_id, kinds, limit):
+    query = ' & '.join(
+        '(' + ' | '.join(f'{word}:*' for word in alternatives) + ')'
+        for alternatives in groups
+    )
+    extra, params = _filters(restaurant_id, kinds)
+    rank = "ts_rank(e.search_vector, to_tsquery('simple', %s))"
+    sql = (
+        f'SELECT e.*, {rank} AS relevance '
+        'FROM api_searchentry e '
+        f"WHERE e.search_vector @@ to_tsquery('simple', %s){extra} "
+        f'ORDER BY {rank} + e.average_rating * %s DESC LIMIT %s'
+    )
+    # ts_rank scores are much smaller than bm25 ones, so scale the rating down
+    return list(SearchEntry.objects.raw(
+        sql, [query, query, *params, query, RATING_WEIGHT / 10, limit]
+    ))
+
+
+def _search_fallback(groups, restaurant_id, kinds, limit):
+    queryset = SearchEntry.objects.all()
+    for alternatives in groups:
+        condition = Q()
+        for word in alternatives:
+            condition |= Q(title__icontains=word) | Q(body__icontains=word)
+        queryset = queryset.filter(condition)
+    if restaurant_id:
+        queryset = queryset.filter(restaurant_id=restaurant_id)
+    if kinds:
+        queryset = queryset.filter(kind__in=kinds)
+    results = list(queryset.order_by('-average_rating')[:limit])
+    for entry in results:
+        entry.relevance = 0
+    return results
+
+
+SEARCH_BACKENDS = {
+    'sqlite': _search_sqlite,
+    'postgresql': _search_postgres,
+    'fallback': _search_fallback,
+}
+
+
+def search(query, restaurant_id=None, kinds=None, limit=20):
+    """
+    Return (entries, corrected). `corrected` is True when nothing matched the
+    query as typed and the results come from the typo-tolerant retry.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return [], False
+
+    run = SEARCH_BACKENDS[_backend()]
+    results = run([[token] for token in tokens], restaurant_id, kinds, limit)
+    if results:
+        return results, False
+
+    groups = _expand(tokens)
+    if all(len(alternatives) == 1 for alternatives in groups):
+        return [], False
+    return run(groups, restaurant_id, kinds, limit), True
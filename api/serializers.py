@@ -1,6 +1,13 @@
 import json
+from django.conf import settings
+from django.db import router, transaction
 from rest_framework import serializers
-from .models import User, Restaurant, MenuItem, Order, Addon, PaymentAccount, OrderItem, Conversation, ChatMessage, ActivityLog, Rating
+from . import eta, search, webhooks
+from .cache import bump_version
+from .models import (
+    User, Restaurant, MenuItem, Order, Addon, PaymentAccount, OrderItem, Conversation, ChatMessage, ActivityLog, Rating,
+    ArchivedOrder, ArchivedOrderItem, UploadSession, WebhookEndpoint, refresh_rating_aggregates,
+)
 
 # --- User Serializers ---
 
@@ -49,12 +56,16 @@ class UserProfileSerializer(serializers.ModelSerializer):
 class MenuItemSerializer(serializers.ModelSerializer):
     average_rating = serializers.ReadOnlyField()
     rating_count = serializers.ReadOnlyField()
+    # Optional; (restaurant, sku) is unique when given. Left out of a PUT, it stays as it is
+    sku = serializers.CharField(max_length=64, required=False, allow_null=True)
     
     class Meta:
         model = MenuItem
         fields = '__all__'
 
 class AddonSerializer(serializers.ModelSerializer):
+    sku = serializers.CharField(max_length=64, required=False, allow_null=True)
+
     class Meta:
         model = Addon
         fields = '__all__'
@@ -68,6 +79,64 @@ class RatingSerializer(serializers.ModelSerializer):
         fields = ['id', 'menu_item', 'menu_item_name', 'customer', 'customer_username', 'stars', 'comment', 'created_at']
         read_only_fields = ['customer', 'customer_username', 'menu_item_name', 'created_at']
 
+class BulkRatingItemSerializer(serializers.Serializer):
+    menu_item = serializers.IntegerField()
+    stars = serializers.IntegerField(min_value=1, max_value=5)
+    comment = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+# For rating every item of an order in one request
+class BulkRatingSerializer(serializers.Serializer):
+    RATEABLE_STATUSES = ['Delivered', 'Completed']
+
+    order = serializers.IntegerField()
+    ratings = BulkRatingItemSerializer(many=True, allow_empty=False)
+
+    def validate(self, attrs):
+        customer = self.context['request'].user
+        # One query: the menu items of this customer's order
+        ordered_items = set(
+            OrderItem.objects.filter(
+                order_id=attrs['order'],
+                order__customer=customer,
+                order__status__in=self.RATEABLE_STATUSES,
+                menu_item__isnull=False,
+            ).values_list('menu_item_id', flat=True)
+        )
+        if not ordered_items:
+            raise serializers.ValidationError({'order': 'No delivered order with menu items found.'})
+
+        unknown = sorted({rating['menu_item'] for rating in attrs['ratings']} - ordered_items)
+        if unknown:
+            raise serializers.ValidationError({'ratings': f'Menu items not in this order: {unknown}'})
+        return attrs
+
+    def create(self, validated_data):
+        customer = self.context['request'].user
+        # If an item is listed twice, the last rating wins
+        by_item = {rating['menu_item']: rating for rating in validated_data['ratings']}
+
+        db = router.db_for_write(Rating)
+        with transaction.atomic(using=db):
+            Rating.objects.bulk_create(
+                [
+                    Rating(customer=customer, menu_item_id=menu_item_id,
+                           stars=rating['stars'], comment=rating.get('comment'))
+                    for menu_item_id, rating in by_item.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['customer', 'menu_item'],
+                update_fields=['stars', 'comment'],
+            )
+            refresh_rating_aggregates(by_item)
+            search.update_ratings(by_item)
+            # bulk_create/bulk_update send no signals, so invalidate by hand
+            transaction.on_commit(lambda: (bump_version(Rating), bump_version(MenuItem)), using=db)
+
+        return list(
+            Rating.objects.filter(customer=customer, menu_item_id__in=by_item)
+            .select_related('customer', 'menu_item')
+        )
+
 # --- Order Serializers ---
 
 # For displaying simplified item details within an order
@@ -100,10 +169,15 @@ class OrderDetailSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(source='orderitem_set', many=True, read_only=True)
     restaurant = RestaurantSerializer(read_only=True)
     customer = SimpleUserSerializer(read_only=True)
+    # Expected preparation time while the order is waiting, see api/eta.py
+    eta = serializers.SerializerMethodField()
 
     class Meta:
         model = Order
-        fields = ['id', 'order_code', 'total_price', 'status', 'payment_proof', 'items', 'restaurant', 'customer', 'created_at']
+        fields = ['id', 'order_code', 'total_price', 'status', 'payment_proof', 'items', 'restaurant', 'customer', 'created_at', 'eta']
+
+    def get_eta(self, obj):
+        return eta.estimate(obj)
 
 # For the LIST view of all orders and for CREATING a new order
 class OrderListSerializer(serializers.ModelSerializer):
@@ -154,6 +228,69 @@ class OrderListSerializer(serializers.ModelSerializer):
         return order
 
 
+# --- Archived Order Serializers ---
+# Same shape as the order serializers above, so the frontend can show both alike
+
+class ArchivedOrderItemSerializer(OrderItemSerializer):
+    class Meta(OrderItemSerializer.Meta):
+        model = ArchivedOrderItem
+
+class ArchivedOrderDetailSerializer(serializers.ModelSerializer):
+    items = ArchivedOrderItemSerializer(many=True, read_only=True)
+    restaurant = RestaurantSerializer(read_only=True)
+    customer = SimpleUserSerializer(read_only=True)
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ['id', 'order_code', 'total_price', 'status', 'payment_proof', 'items', 'restaurant', 'customer', 'created_at', 'archived_at']
+
+class ArchivedOrderListSerializer(serializers.ModelSerializer):
+    order_items = ArchivedOrderItemSerializer(source='items', many=True, read_only=True)
+    customer_details = SimpleUserSerializer(source='customer', read_only=True)
+    restaurant_details = SimpleRestaurantSerializer(source='restaurant', read_only=True)
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ['id', 'customer', 'customer_details', 'restaurant', 'restaurant_details', 'order_items', 'total_price', 'status', 'payment_proof', 'order_code', 'created_at', 'archived_at']
+
+
+# --- Upload Serializers ---
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'order', 'filename', 'size', 'received', 'status', 'error', 'created_at']
+        read_only_fields = ['received', 'status', 'error']
+
+    def validate_order(self, order):
+        if order.customer_id != self.context['request'].user.id:
+            raise serializers.ValidationError('You can only upload a payment proof for your own order.')
+        if order.status != 'Pending Payment':
+            raise serializers.ValidationError('This order is not waiting for a payment proof.')
+        return order
+
+    def validate_size(self, size):
+        if not 0 < size <= settings.PAYMENT_PROOF_MAX_BYTES:
+            raise serializers.ValidationError(f'The file must be at most {settings.PAYMENT_PROOF_MAX_BYTES} bytes.')
+        return size
+
+# --- Webhook Serializers ---
+
+class WebhookEndpointSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WebhookEndpoint
+        fields = ['id', 'restaurant', 'url', 'secret', 'is_active', 'last_event_id', 'failure_count',
+                  'next_attempt_at', 'last_error', 'created_at']
+        read_only_fields = ['secret', 'last_event_id', 'failure_count', 'next_attempt_at', 'last_error']
+        extra_kwargs = {'restaurant': {'required': False}}
+
+    def validate_url(self, value):
+        try:
+            webhooks.check_url(value)
+        except webhooks.UnsafeURL as exc:
+            raise serializers.ValidationError(str(exc))
+        return value
+
 # --- Chat Serializers ---
 
 class ChatMessageSerializer(serializers.ModelSerializer):
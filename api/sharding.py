@@ -0,0 +1,604 @@
+"""
+Restaurant-keyed database sharding.
+
+Everything a restaurant owns (menu, addons, payment accounts, ratings, orders,
+activity log, archive, recommendations, order events, webhooks) lives on one
+database, the restaurant's shard: Restaurant.shard holds its alias. The shards
+are DATABASE_SHARDS, 'default' first. With only 'default' there is nothing to
+route and everything works as it did before sharding.
+
+- ShardRouter sends a query on a sharded model (SHARDED_MODELS) to the shard of
+  the row it is about when Django passes one as a hint (a related manager, a
+  save, the models' ShardedQuerySet creating a row), otherwise to the shard of the current request or command
+  (using_shard()), otherwise to 'default'.
+- ShardRoutingMixin picks a viewset request's shard from the restaurant or the
+  object it is about. Lists with no restaurant (a sub-admin's "all
+  restaurants", a customer's orders) run on every shard and the rows are merged
+  in the queryset's ordering (fan_out()).
+- Users and restaurants are global: they are written to 'default' and copied to
+  the other shards (mirror()), so sharded rows keep their foreign keys and
+  joins. Chat, idempotency keys, order codes and the search index are only on
+  'default'.
+- Each shard's tables hand out ids from a range of their own (reserve_id_ranges(),
+  run after migrate), so an id is unique across shards and a restaurant keeps
+  its ids when `manage.py move_restaurant` moves it to another shard.
+
+The admin only shows the rows on 'default'.
+
+To try it locally with SQLite files:
+    DATABASE_SHARDS=shard1=sqlite:///shard1.sqlite3,shard2=sqlite:///shard2.sqlite3
+    python manage.py migrate --database shard1   (and shard2)
+    python manage.py sync_shards
+"""
+import contextvars
+import heapq
+from bisect import bisect_right
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+from django.db.models import Count, F, Max
+
+from . import counters
+from .context import get_user_context
+from .models import Restaurant, User, OrderEvent, WebhookEndpoint, DashboardCounter
+
+# Each shard's ids start at its index times this; 2**40 ids per table and shard
+SHARD_ID_RANGE = 2 ** 40
+MAP_KEY = 'sharding:map'
+
+# Sharded model -> lookup from it to its restaurant, in the order a move copies
+# them (a row's foreign keys point to rows copied before it)
+SHARDED_MODELS = {
+    'api.PaymentAccount': 'restaurant',
+    'api.MenuItem': 'restaurant',
+    'api.Addon': 'restaurant',
+    'api.Rating': 'menu_item__restaurant',
+    'api.Order': 'restaurant',
+    'api.OrderItem': 'order__restaurant',
+    'api.ActivityLog': 'restaurant',
+    'api.ArchivedOrder': 'restaurant',
+    'api.ArchivedOrderItem': 'order__restaurant',
+    'api.ArchivedActivityLog': 'restaurant',
+    'api.ItemPair': 'restaurant',
+    'api.Recommendation': 'restaurant',
+    'api.PrepTimeSketch': 'restaurant',
+    'api.DashboardCounter': 'restaurant',
+    'api.UploadSession': 'order__restaurant',
+    'api.WebhookEndpoint': 'restaurant',
+    'api.OrderEvent': 'restaurant',
+}
+# Global models copied to every shard
+MIRRORED_MODELS = (Restaurant, User)
+
+_current = contextvars.ContextVar('shard', default=None)
+
+
+class ShardingError(Exception):
+    pass
+
+
+def shards():
+    return settings.DATABASE_SHARDS
+
+
+def enabled():
+    return len(settings.DATABASE_SHARDS) > 1
+
+
+def sharded_models():
+    from django.apps import apps
+    return [(apps.get_model(label), path) for label, path in SHARDED_MODELS.items()]
+
+
+# --- Shard map ---
+def shard_map(refresh=False):
+    """{restaurant id: shard alias}, cached for SHARD_MAP_TIMEOUT seconds"""
+    mapping = None if refresh else cache.get(MAP_KEY)
+    if mapping is None:
+        mapping = dict(Restaurant.objects.using('default').values_list('id', 'shard'))
+        cache.set(MAP_KEY, mapping, settings.SHARD_MAP_TIMEOUT)
+    return mapping
+
+
+def shard_for(restaurant_id):
+    """Alias of the restaurant's shard, None if there is no such restaurant"""
+    if not enabled():
+        return 'default'
+    try:
+        restaurant_id = int(restaurant_id)
+    except (TypeError, ValueError):
+        return None
+    if restaurant_id in (mapping := shard_map()):
+        return mapping[restaurant_id] or 'default'
+    # Created since the map was cached, or no such restaurant
+    shard = Restaurant.objects.using('default').filter(pk=restaurant_id).values_list('shard', flat=True).first()
+    return None if shard is None else shard or 'default'
+
+
+def place_restaurant():
+    """Shard for a new restaurant: the one with the fewest restaurants"""
+    if not enabled():
+        return 'default'
+    counts = dict(Restaurant.objects.using('default').values_list('shard').annotate(count=Count('id')))
+    return min(shards(), key=lambda alias: counts.get(alias, 0))
+
+
+def instance_shard(instance):
+    """Shard of a restaurant or of a sharded row, None if it can't be told"""
+    if isinstance(instance, Restaurant):
+        shard = instance.__dict__.get('shard')
+        return shard or (shard_for(instance.pk) if instance.pk else None)
+    path = SHARDED_MODELS.get(instance._meta.label)
+    if path is None:
+        return None
+    if not instance._state.adding:
+        return instance._state.db
+    # A new row goes where its restaurant (or parent row) is
+    field = instance._meta.get_field(path.split('__')[0])
+    if field.is_cached(instance):
+        related = field.get_cached_value(instance)
+        return instance_shard(related) if related is not None else None
+    return _related_shard(field, getattr(instance, field.attname))
+
+
+def values_shard(model, values):
+    """
+    Shard of a row about to be created from these field values (create(),
+    get_or_create() ...), None if they don't tell. Reads the restaurant (or
+    parent row) from them without building the row, whose defaults could have
+    side effects: an Order would take an order code.
+    """
+    path = SHARDED_MODELS.get(model._meta.label)
+    if path is None:
+        return None
+    field = model._meta.get_field(path.split('__')[0])
+    if field.name in values:
+        related = values[field.name]
+        return instance_shard(related) if related is not None else None
+    return _related_shard(field, values.get(field.attname))
+
+
+def _related_shard(field, pk):
+    if pk is None:
+        return None
+    if field.related_model is Restaurant:
+        return shard_for(pk)
+    return locate(pk, field.related_model)
+
+
+def locate(pk, *models):
+    """Alias of the shard holding the row with this primary key, None if none does"""
+    if not enabled():
+        return None
+    candidates = list(shards())
+    # Rows are usually still on the shard whose range their id is from
+    if str(pk).isdigit() and int(pk) // SHARD_ID_RANGE < len(candidates):
+        candidates.insert(0, candidates.pop(int(pk) // SHARD_ID_RANGE))
+    for alias in candidates:
+        for model in models:
+            try:
+                if model._base_manager.using(alias).filter(pk=pk).exists():
+                    return alias
+            except (ValueError, ValidationError):
+                return None
+    return None
+
+
+# --- Routing ---
+def current_shard():
+    return _current.get()
+
+
+@contextmanager
+def using_shard(alias):
+    """Route the sharded queries in this block that have no better hint to `alias`"""
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+class ShardRouter:
+    """Routes the sharded models; global models are left to the next router"""
+
+    def _route(self, model, hints):
+        if not enabled() or model._meta.label not in SHARDED_MODELS:
+            return None
+        instance, values = hints.get('instance'), hints.get('values')
+        return (
+            (instance is not None and instance_shard(instance))
+            or (values is not None and values_shard(model, values))
+            or _current.get() or 'default'
+        )
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users and restaurants are on every shard
+        return True if enabled() else None
+
+
+class ShardRoutingMixin:
+    """
+    ViewSet mixin: run the request on the shard of what it is about, found from
+    the object of a detail route, ?restaurant= or the restaurant field, the
+    fields in shard_lookups, or the restaurant admin's restaurant. A list with
+    none of these reads every shard.
+    """
+    # Request field -> model of the row it holds the id of, e.g. {'order': Order}
+    shard_lookups = {}
+    # Models a detail route's object can be of, the queryset's model if empty
+    shard_models = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _current.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if enabled():
+            _current.set(self.get_shard())
+
+    def get_shard(self):
+        """Alias of the shard this request is about, None for all of them"""
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if lookup is not None:
+            return locate(lookup, *(self.shard_models or (self.get_queryset().model,)))
+
+        # Reading request.data of a GET would parse a body nobody sent
+        data = self.request.data if self.request.method not in ('GET', 'HEAD', 'OPTIONS') else {}
+        if not isinstance(data, dict):
+            data = {}
+        restaurant_id = self.request.query_params.get('restaurant') or data.get('restaurant')
+        if restaurant_id:
+            return shard_for(restaurant_id)
+        for field, model in self.shard_lookups.items():
+            if data.get(field):
+                return locate(data[field], model)
+
+        context = get_user_context(self.request)
+        if context.is_restaurant_admin and context.restaurant_id:
+            return instance_shard(context.restaurant)
+        return None
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list' and enabled() and _current.get() is None:
+            return fan_out(queryset)
+        return queryset
+
+
+# --- Fan-out ---
+class _Descending:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _ordering(queryset):
+    query = queryset.query
+    ordering = list(query.order_by or (query.default_ordering and queryset.model._meta.ordering) or ())
+    # Rows equal in the ordering come out in primary key order
+    return [term for term in ordering if isinstance(term, str) and term != '?'] + ['pk']
+
+
+def sort_key(model, ordering):
+    """Key function sorting model instances like ORDER BY `ordering` (nulls last)"""
+    getters = []
+    for term in ordering:
+        descending = term.startswith('-')
+        names = term.lstrip('-').split('__')
+        # A foreign key orders by its id
+        current = model
+        for index, name in enumerate(names):
+            if name == 'pk':
+                break
+            field = current._meta.get_field(name)
+            if field.is_relation and index == len(names) - 1:
+                names[index] = field.attname
+            elif field.is_relation:
+                current = field.related_model
+        getters.append((descending, names))
+
+    def key(row):
+        values = []
+        for descending, names in getters:
+            value = row
+            for name in names:
+                value = getattr(value, name) if value is not None else None
+            value = (value is None, value)
+            values.append(_Descending(value) if descending else value)
+        return values
+    return key
+
+
+def merge(results, model, ordering):
+    """Merge lists of rows, each already in `ordering`, into one"""
+    return heapq.merge(*results, key=sort_key(model, ordering))
+
+
+def fan_out(queryset, limit=None):
+    """
+    Evaluate a queryset of model instances on every shard and merge the rows in
+    its ordering. With `limit`, the first `limit` rows of the merged result.
+    """
+    if not enabled():
+        return list(queryset if limit is None else queryset[:limit])
+    results = [
+        list(queryset.using(alias) if limit is None else queryset.using(alias)[:limit])
+        for alias in shards()
+    ]
+    return list(islice(merge(results, queryset.model, _ordering(queryset)), limit))
+
+
+# --- Mirrors ---
+def _insert(alias, model, fields, rows):
+    """INSERT rows (lists of values of `fields`) as they are, no defaults or auto_now"""
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table),
+        ', '.join(quote(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+            for row in rows
+        ])
+
+
+def mirror(instance):
+    """Copy a user or restaurant from 'default' to the other shards"""
+    model = instance._meta.concrete_model
+    fields = model._meta.concrete_fields
+    values = {field.attname: getattr(instance, field.attname) for field in fields}
+    changes = {name: value for name, value in values.items() if name != model._meta.pk.attname}
+    for alias in shards()[1:]:
+        if not model._base_manager.using(alias).filter(pk=instance.pk).update(**changes):
+            _insert(alias, model, fields, [[values[field.attname] for field in fields]])
+
+
+def unmirror(model, pk):
+    """Delete a user or restaurant (and what it cascades to) from the other shards"""
+    for alias in shards()[1:]:
+        model._base_manager.using(alias).filter(pk=pk).delete()
+
+
+def sync_mirrors(alias):
+    """Make a shard's users and restaurants match 'default'. Returns (copied, deleted)."""
+    copied = deleted = 0
+    for model in MIRRORED_MODELS:
+        fields = model._meta.concrete_fields
+        names = [field.attname for field in fields]
+        primary = model._base_manager.using('default')
+        present = set(model._base_manager.using(alias).values_list('pk', flat=True))
+        kept = set()
+        for instance in primary.order_by('pk').iterator():
+            kept.add(instance.pk)
+            if instance.pk in present:
+                model._base_manager.using(alias).filter(pk=instance.pk).update(
+                    **{name: getattr(instance, name) for name in names if name != model._meta.pk.attname}
+                )
+            else:
+                _insert(alias, model, fields, [[getattr(instance, name) for name in names]])
+                copied += 1
+        gone = present - kept
+        if gone:
+            model._base_manager.using(alias).filter(pk__in=gone).delete()
+            deleted += len(gone)
+    return copied, deleted
+
+
+# --- Id ranges ---
+def reserve_id_ranges(alias):
+    """
+    Make the sharded tables of a shard hand out ids from its range. Only moves
+    the counters forward, so it can run again after every migrate.
+    """
+    if alias not in shards() or not shards().index(alias):
+        return
+    start = shards().index(alias) * SHARD_ID_RANGE
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for model, _ in sharded_models():
+            pk = model._meta.pk
+            if pk.get_internal_type() not in ('AutoField', 'BigAutoField'):
+                continue
+            table = model._meta.db_table
+            if connection.vendor == 'sqlite':
+                # The next id is one more than the larger of seq and the largest id
+                cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, start])
+                elif row[0] < start:
+                    cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [start, table])
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    f'SELECT setval(pg_get_serial_sequence(%s, %s), '
+                    f'GREATEST(%s, (SELECT COALESCE(MAX({quote(pk.column)}), 0) FROM {quote(table)})))',
+                    [quote(table), pk.column, start],
+                )
+            else:
+                raise ShardingError(f'Sharding supports SQLite and PostgreSQL, not {connection.vendor}')
+
+
+# --- Moving a restaurant ---
+def _restaurant_column(model, path):
+    """(column, subquery table, subquery column) selecting a model's rows by restaurant"""
+    field = model._meta.get_field(path.split('__')[0])
+    if '__' not in path:
+        return field.column, None, None
+    parent = field.related_model
+    return field.column, parent, parent._meta.get_field('restaurant').column
+
+
+def _delete_rows(alias, restaurant_id):
+    """Delete a restaurant's rows from a shard, children first, without signals"""
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for model, path in reversed(sharded_models()):
+            column, parent, parent_column = _restaurant_column(model, path)
+            if parent is None:
+                where = f'{quote(column)} = %s'
+            else:
+                where = (
+                    f'{quote(column)} IN (SELECT {quote(parent._meta.pk.column)} FROM '
+                    f'{quote(parent._meta.db_table)} WHERE {quote(parent_column)} = %s)'
+                )
+            cursor.execute(f'DELETE FROM {quote(model._meta.db_table)} WHERE {where}', [restaurant_id])
+
+
+def _lock(alias, restaurant_id):
+    """Hold off writes to the shard's sharded tables until the move commits"""
+    connection = connections[alias]
+    # On SQLite this first write takes the database's write lock
+    Restaurant._base_manager.using(alias).filter(pk=restaurant_id).update(shard=F('shard'))
+    if connection.vendor == 'postgresql':
+        quote = connection.ops.quote_name
+        tables = ', '.join(quote(model._meta.db_table) for model, _ in sharded_models())
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {tables} IN EXCLUSIVE MODE')
+
+
+def _check_ids(restaurant_id, source, target):
+    """
+    Explicit ids move SQLite's counters up to them, so rows from a later shard's
+    range would make the target hand out that shard's ids. Postgres sequences
+    don't move.
+    """
+    if connections[target].vendor != 'sqlite':
+        return
+    end = (shards().index(target) + 1) * SHARD_ID_RANGE
+    for model, path in sharded_models():
+        if model is OrderEvent or model._meta.pk.get_internal_type() not in ('AutoField', 'BigAutoField'):
+            continue
+        top = model._base_manager.using(source).filter(**{path: restaurant_id}).aggregate(top=Max('pk'))['top']
+        if top is not None and top >= end:
+            raise ShardingError(
+                f'{model._meta.verbose_name} {top} is from a later shard\'s id range; on SQLite a '
+                f'restaurant can only move to a shard listed after those its rows were created on'
+            )
+
+
+def _copy_events(restaurant_id, source, target, batch_size):
+    """
+    Copy the restaurant's order events. Webhook endpoints and the change feed
+    read them in id order, so if the target hands out smaller ids than the
+    moved ones, the events get new ids after the target's and the endpoints'
+    cursors are translated.
+    """
+    fields = OrderEvent._meta.concrete_fields
+    events = OrderEvent._base_manager.using(source).filter(restaurant_id=restaurant_id).order_by('pk')
+    moved_top = events.aggregate(top=Max('pk'))['top']
+    if moved_top is None:
+        return 0
+    target_top = OrderEvent._base_manager.using(target).aggregate(top=Max('pk'))['top'] or 0
+    renumber = moved_top >= max(target_top, shards().index(target) * SHARD_ID_RANGE)
+    if renumber:
+        fields = [field for field in fields if not field.primary_key]
+
+    old_ids, count, batch = [], 0, []
+    for row in events.values_list('pk', *[field.attname for field in fields]).iterator(chunk_size=batch_size):
+        old_ids.append(row[0])
+        batch.append(row[1:])
+        if len(batch) >= batch_size:
+            _insert(target, OrderEvent, fields, batch)
+            count, batch = count + len(batch), []
+    if batch:
+        _insert(target, OrderEvent, fields, batch)
+        count += len(batch)
+
+    if renumber:
+        new_ids = list(
+            OrderEvent._base_manager.using(target).filter(restaurant_id=restaurant_id).order_by('pk')
+            .values_list('pk', flat=True)
+        )
+        for endpoint in WebhookEndpoint._base_manager.using(target).filter(restaurant_id=restaurant_id):
+            # The new id of the last event the endpoint got, or just before the first new id
+            delivered = bisect_right(old_ids, endpoint.last_event_id)
+            WebhookEndpoint._base_manager.using(target).filter(pk=endpoint.pk).update(
+                last_event_id=new_ids[delivered - 1] if delivered else new_ids[0] - 1
+            )
+    return count
+
+
+def move_restaurant(restaurant, target, batch_size=1000):
+    """
+    Move a restaurant and all its rows to the `target` shard, keeping their ids.
+    Writes to the source shard wait until the move commits. Returns
+    {model label: rows moved}.
+
+    Servers read the shard map from the cache: with a shared cache (CACHE_URL)
+    they see the move at once, with per-process caches within SHARD_MAP_TIMEOUT.
+    """
+    source = instance_shard(restaurant) or 'default'
+    if target not in shards():
+        raise ShardingError(f'{target} is not one of DATABASE_SHARDS: {", ".join(shards())}')
+    if source == target:
+        return {}
+    _check_ids(restaurant.pk, source, target)
+
+    moved = {}
+    with ExitStack() as stack:
+        # Entered first, committed last: the map only changes once the rows are there
+        for alias in dict.fromkeys(('default', source, target)):
+            stack.enter_context(transaction.atomic(using=alias))
+        _lock(source, restaurant.pk)
+        # Leftovers of an earlier move that failed halfway
+        _delete_rows(target, restaurant.pk)
+
+        for model, path in sharded_models():
+            if model is OrderEvent:
+                moved[model._meta.label] = _copy_events(restaurant.pk, source, target, batch_size)
+                continue
+            fields = model._meta.concrete_fields
+            rows = model._base_manager.using(source).filter(**{path: restaurant.pk}).order_by('pk').values_list(
+                *[field.attname for field in fields]
+            )
+            count, batch = 0, []
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    _insert(target, model, fields, batch)
+                    count, batch = count + len(batch), []
+            if batch:
+                _insert(target, model, fields, batch)
+                count += len(batch)
+            moved[model._meta.label] = count
+
+        # The shards' all-restaurants dashboard counters stop/start counting its orders
+        moved_counters = dict(
+            DashboardCounter._base_manager.using(source).filter(restaurant_id=restaurant.pk).values_list('name', 'value')
+        )
+        counters.add(None, {name: -value for name, value in moved_counters.items()}, source)
+        counters.add(None, moved_counters, target)
+
+        _delete_rows(source, restaurant.pk)
+        for alias in shards():
+            Restaurant._base_manager.using(alias).filter(pk=restaurant.pk).update(shard=target)
+    cache.delete(MAP_KEY)
+    restaurant.shard = target
+    return moved
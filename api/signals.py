@@ -0,0 +1,100 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, post_migrate
+from django.dispatch import receiver
+
+from . import recommendations, search, sharding
+from .cache import bump_version
+from .models import (
+    User, Restaurant, MenuItem, Addon, PaymentAccount, Rating, SearchEntry, refresh_rating_aggregates
+)
+
+# --- Cache invalidation ---
+# Models whose changes must invalidate cached API responses (see api/cache.py).
+# Note: queryset.update() and bulk_create() don't send signals, so code using
+# them has to call bump_version() itself.
+CACHED_MODELS = (Restaurant, MenuItem, Addon, PaymentAccount, Rating)
+
+
+def invalidate_model_cache(sender, using=None, **kwargs):
+    # Wait for the commit, otherwise another request could cache the old rows
+    # again between the bump and the end of the transaction.
+    transaction.on_commit(lambda: bump_version(sender), using=using)
+
+
+for model in CACHED_MODELS:
+    uid = model._meta.label_lower
+    post_save.connect(invalidate_model_cache, sender=model, dispatch_uid=f'cache-save-{uid}')
+    post_delete.connect(invalidate_model_cache, sender=model, dispatch_uid=f'cache-delete-{uid}')
+
+
+# --- Recommendations ---
+@receiver(post_save, sender=MenuItem, dispatch_uid='recommendations-menu-item-save')
+@receiver(post_delete, sender=MenuItem, dispatch_uid='recommendations-menu-item-delete')
+@receiver(post_save, sender=Addon, dispatch_uid='recommendations-addon-save')
+@receiver(post_delete, sender=Addon, dispatch_uid='recommendations-addon-delete')
+def invalidate_recommendations(sender, instance, using=None, raw=False, **kwargs):
+    if not raw:
+        restaurant_id = instance.restaurant_id
+        transaction.on_commit(lambda: recommendations.menu_changed(restaurant_id), using=using)
+
+
+# --- Rating aggregates ---
+@receiver(post_save, sender=Rating, dispatch_uid='rating-aggregates-save')
+@receiver(post_delete, sender=Rating, dispatch_uid='rating-aggregates-delete')
+def update_rating_aggregates(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_rating_aggregates([instance.menu_item_id])
+        search.update_ratings([instance.menu_item_id])
+
+
+# --- Search index ---
+@receiver(post_save, sender=MenuItem, dispatch_uid='search-index-menu-item')
+def index_menu_item(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_menu_item(instance)
+
+
+@receiver(post_save, sender=Addon, dispatch_uid='search-index-addon')
+def index_addon(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_addon(instance)
+
+
+@receiver(post_save, sender=Restaurant, dispatch_uid='search-index-restaurant')
+def index_restaurant(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        search.index_restaurant(instance, include_menu=not created)
+
+
+@receiver(post_delete, sender=MenuItem, dispatch_uid='search-remove-menu-item')
+def remove_menu_item(sender, instance, **kwargs):
+    search.remove(SearchEntry.Kind.MENU_ITEM, instance.pk)
+
+
+@receiver(post_delete, sender=Addon, dispatch_uid='search-remove-addon')
+def remove_addon(sender, instance, **kwargs):
+    search.remove(SearchEntry.Kind.ADDON, instance.pk)
+
+
+# --- Shard mirrors ---
+# Users and restaurants are written to 'default' and copied to the other shards
+# (see api/sharding.py). The copies are written without signals.
+@receiver(post_save, sender=User, dispatch_uid='shard-mirror-user')
+@receiver(post_save, sender=Restaurant, dispatch_uid='shard-mirror-restaurant')
+def mirror_to_shards(sender, instance, using, raw=False, **kwargs):
+    if not raw and using == 'default' and sharding.enabled():
+        transaction.on_commit(lambda: sharding.mirror(instance), using=using)
+
+
+@receiver(post_delete, sender=User, dispatch_uid='shard-unmirror-user')
+@receiver(post_delete, sender=Restaurant, dispatch_uid='shard-unmirror-restaurant')
+def remove_from_shards(sender, instance, using, **kwargs):
+    if using == 'default' and sharding.enabled():
+        pk = instance.pk
+        transaction.on_commit(lambda: sharding.unmirror(sender, pk), using=using)
+
+
+@receiver(post_migrate, dispatch_uid='shard-id-ranges')
+def reserve_shard_id_ranges(sender, using, **kwargs):
+    if sender.name == 'api':
+        sharding.reserve_id_ranges(using)
@@ -0,0 +1,131 @@
+"""
+Cold start profiling and warm-up.
+
+On Vercel the first request after the function has been idle pays for a cold
+start: importing Django and every app, django.setup(), building the middleware
+chain and loading the URL conf. measure() times each of these phases in a fresh
+interpreter, the way a new function instance starts; `manage.py profile_startup`
+prints them along with the slowest imports.
+
+warm_up() is called from wsgi.py, so the URL resolver is built and its patterns
+compiled while the function initializes instead of during the first request.
+
+Nothing Django is imported at the top of this module: `python -m api.startup`
+is the fresh interpreter measure() runs, and it times those imports itself.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PHASES = ('settings', 'setup', 'middleware', 'urls', 'first_request')
+# Only the code paths that need them import these (recommendation builds, menu
+# import and export, image processing), never a cold start
+HEAVY_MODULES = ('numpy', 'openpyxl', 'PIL')
+
+
+def warm_up():
+    """Load the URL conf and compile every URL pattern"""
+    from django.urls import get_resolver
+
+    # Reading reverse_dict populates the resolver and its includes, which
+    # compiles each pattern's regex
+    get_resolver().reverse_dict
+
+
+# --- Measuring ---
+def measure(path='/api/', api_only=False, runs=1, importtime=False):
+    """
+    Start `runs` fresh interpreters that each set Django up and serve one GET of
+    `path`. Returns the median milliseconds of each phase and of the total, the
+    status of the request, and which HEAVY_MODULES were imported. With
+    `importtime`, also the `-X importtime` report of the last run.
+    """
+    from django.conf import settings
+
+    env = {**os.environ, 'API_ONLY': str(api_only)}
+    options = ['-X', 'importtime'] if importtime else []
+    results = []
+    for _ in range(runs):
+        process = subprocess.run(
+            [sys.executable, *options, '-m', 'api.startup', path],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if process.returncode:
+            raise RuntimeError(f'The startup profile failed:\n{process.stderr}')
+        results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    summary = {
+        phase: round(statistics.median(result['phases'][phase] for result in results), 1)
+        for phase in (*PHASES, 'total')
+    }
+    summary['status'] = results[-1]['status']
+    summary['heavy_modules'] = results[-1]['heavy_modules']
+    if importtime:
+        summary['imports'] = process.stderr
+    return summary
+
+
+def slowest_imports(report, limit=15):
+    """(milliseconds, module) of the slowest top-level imports in an -X importtime report"""
+    imports = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Nested imports are indented, their time is in their parent's
+        if name.startswith('  '):
+            continue
+        imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:limit]
+
+
+def _cold_start(path):
+    """What a new function instance does, phase by phase (runs in the fresh interpreter)"""
+    started = time.perf_counter()
+    marks = {}
+
+    def mark(phase):
+        marks[phase] = (time.perf_counter() - started) * 1000
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'food_ordering_backend.settings')
+    import django
+    from django.conf import settings
+    settings.INSTALLED_APPS
+    mark('settings')
+
+    django.setup(set_prefix=False)
+    mark('setup')
+
+    from django.core.handlers.wsgi import WSGIHandler
+    application = WSGIHandler()
+    mark('middleware')
+
+    warm_up()
+    mark('urls')
+
+    from wsgiref.util import setup_testing_defaults
+    environ = {'PATH_INFO': path, 'HTTP_HOST': '127.0.0.1', 'HTTP_ACCEPT': 'application/json'}
+    setup_testing_defaults(environ)
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(response)
+    response.close()
+    mark('first_request')
+
+    previous, phases = 0, {}
+    for phase in PHASES:
+        phases[phase] = round(marks[phase] - previous, 1)
+        previous = marks[phase]
+    phases['total'] = round(previous, 1)
+    return {
+        'phases': phases,
+        'status': int(statuses[0].split()[0]),
+        'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(_cold_start(sys.argv[1] if len(sys.argv) > 1 else '/api/')))
@@ -1,3 +1,1543 @@
-from django.test import TestCase
+import importlib
+import io
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connections, router
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework import viewsets
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import (
+    activity, approval_queue, counters, eta, frontend, idempotency, lunch_rush, menu_import, order_codes,
+    recommendations, routers, search, sharding, startup, throttling, uploads, webhooks,
+)
+from .backends.sqlite3 import base as sqlite3_backend
+from .cache import get_versions
+from .models import (
+    ActivityLog, Addon, ArchivedActivityLog, ArchivedOrder, ChatMessage, Conversation, IdempotencyKey, ItemPair,
+    MenuItem, Order, OrderEvent, OrderItem, PaymentAccount, Rating, Recommendation, Restaurant, SearchEntry,
+    ShardedQuerySet, User, WebhookEndpoint,
+)
+from .order_codes import CODE_SPACE, FIRST_ALPHABET, code_for, encode, permute
+from .serializers import AddonSerializer, WebhookEndpointSerializer
+from .views import OrderViewSet
 
 # Create your tests here.
+
+
+class OrderCodeTests(SimpleTestCase):
+    ORDERS = 10_000_000
+
+    def test_permutation_is_collision_free_at_10m_orders(self):
+        # The old uuid4()[:8] codes would be expected to collide about
+        # n**2 / (2 * 16**8) = 11,600 times over the same number of orders
+        values = np.sort(permute(np.arange(self.ORDERS, dtype=np.uint64)))
+        self.assertEqual(np.count_nonzero(values[1:] == values[:-1]), 0)
+        self.assertLess(int(values[-1]), CODE_SPACE)
+
+    def test_numpy_and_python_permutations_agree(self):
+        counters = [0, 1, 2, 12345, 999_999, CODE_SPACE - 1]
+        vectorized = permute(np.array(counters, dtype=np.uint64))
+        self.assertEqual([int(value) for value in vectorized], [permute(counter) for counter in counters])
+
+    def test_codes_never_look_like_legacy_hex_codes(self):
+        for counter in (0, 1, 1000, CODE_SPACE - 1):
+            code = code_for(counter)
+            self.assertEqual(len(code), 8)
+            self.assertIn(code[0], FIRST_ALPHABET)
+            self.assertNotIn(code[0], '0123456789ABCDEF')
+        self.assertEqual(encode(0), 'G0000000')
+        self.assertEqual(encode(CODE_SPACE - 1), 'QZZZZZZZ')
+
+    def test_counter_out_of_range_is_rejected(self):
+        with self.assertRaises(ValueError):
+            code_for(CODE_SPACE)
+
+
+class OrderCodeAllocationTests(TestCase):
+    def test_orders_get_distinct_allocated_codes(self):
+        restaurant = Restaurant.objects.create(name='Test Kitchen')
+        customer = User.objects.create_user('customer', password='pw', role='customer')
+        codes = {Order.objects.create(customer=customer, restaurant=restaurant).order_code for _ in range(20)}
+        self.assertEqual(len(codes), 20)
+        self.assertTrue(all(code[0] in FIRST_ALPHABET for code in codes))
+
+    def test_create_takes_one_code_per_order(self):
+        # Routing create() to a shard mustn't build a throwaway order (and code)
+        restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        customer = User.objects.create_user('customer', password='pw', role='customer')
+        with mock.patch.object(order_codes, 'next_order_code', wraps=order_codes.next_order_code) as next_order_code:
+            for _ in range(3):
+                Order.objects.create(customer=customer, restaurant=restaurant)
+        self.assertEqual(next_order_code.call_count, 3)
+
+
+class MenuImportTests(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.media = media.name
+
+    def import_csv(self, text, images=None, **kwargs):
+        return menu_import.import_menu(self.restaurant, io.BytesIO(text.encode()), 'menu.csv', images, **kwargs)
+
+    def images_zip(self, files):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name, data in files.items():
+                archive.writestr(name, data)
+        buffer.seek(0)
+        return buffer
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media) for name in names]
+
+    def test_names_without_latin_letters_get_distinct_skus(self):
+        diff = self.import_csv('kind,name,price\naddon,ክትፎ,100\naddon,ሽሮ,80\naddon,!!!,10\n')
+        self.assertTrue(diff['applied'], diff['errors'])
+        skus = set(Addon.objects.filter(restaurant=self.restaurant).values_list('sku', flat=True))
+        self.assertEqual(len(skus), 3)
+        self.assertIn('ክትፎ', skus)
+        self.assertNotIn('', skus)
+
+    def test_rows_without_sku_or_name_are_rejected(self):
+        diff = self.import_csv('kind,sku,name,price\naddon,,,10\n')
+        self.assertFalse(diff['applied'])
+        self.assertIn('sku is required when there is no name', diff['errors'][0]['errors'])
+
+    def test_oversized_images_are_rejected(self):
+        images = self.images_zip({'tibs.png': lunch_rush.tiny_png()})
+        with mock.patch.object(menu_import, 'MAX_IMAGE_BYTES', 10):
+            diff = self.import_csv('name,price,image\nTibs,100,tibs.png\n', images)
+        self.assertFalse(diff['applied'])
+        self.assertIn('larger than', diff['errors'][0]['errors'][0])
+
+    def test_images_of_a_rejected_file_are_not_left_behind(self):
+        images = self.images_zip({'tibs.png': lunch_rush.tiny_png(), 'broken.png': b'not an image'})
+        diff = self.import_csv('name,price,image\nTibs,100,tibs.png\nShiro,80,broken.png\n', images)
+        self.assertFalse(diff['applied'])
+        self.assertEqual(self.stored_files(), [])
+
+        images = self.images_zip({'tibs.png': lunch_rush.tiny_png()})
+        with mock.patch.object(menu_import, '_write', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.import_csv('name,price,image\nTibs,100,tibs.png\n', images)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_update_without_sku_keeps_it(self):
+        addon = Addon.objects.create(restaurant=self.restaurant, name='Extra injera', price=10, sku='injera')
+        serializer = AddonSerializer(addon, data={'restaurant': self.restaurant.pk, 'name': 'Injera', 'price': '12'})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        addon.refresh_from_db()
+        self.assertEqual((addon.name, addon.sku), ('Injera', 'injera'))
+
+
+class ProfileTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        self.user = User.objects.create_user(
+            'admin', email='admin@example.com', password='pw', role='restaurant_admin', restaurant=self.restaurant
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def get(self, etag=None):
+        return self.client.get('/api/profile/', HTTP_IF_NONE_MATCH=etag) if etag else self.client.get('/api/profile/')
+
+    def test_unchanged_profile_is_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['restaurant']['name'], 'Test Kitchen')
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        for if_none_match in (etag, f'"other", {etag}', f'W/{etag}'):
+            response = self.get(if_none_match)
+            self.assertEqual(response.status_code, 304, if_none_match)
+            self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get('"other"').status_code, 200)
+
+    def test_changes_change_the_etag(self):
+        etag = self.get()['ETag']
+        self.user.email = 'kitchen@example.com'
+        self.user.save()
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['email'], 'kitchen@example.com')
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self.restaurant.name = 'Habesha House'
+        self.restaurant.save()
+        response = self.get(etag)
+        self.assertEqual((response.status_code, response.data['restaurant']['name']), (200, 'Habesha House'))
+
+
+class AdminSearchTests(TestCase):
+    def test_user_search_is_case_insensitive_and_covers_names_and_email(self):
+        john = User.objects.create_user('John', email='jsmith@example.com', first_name='Johnny', last_name='Smith')
+        User.objects.create_user('alice', email='alice@example.com')
+        user_admin = admin.site._registry[User]
+        for term in ('john', 'JOHNNY', 'smi', 'jsmith@'):
+            queryset, _ = user_admin.get_search_results(None, User.objects.all(), term)
+            self.assertEqual(list(queryset), [john], term)
+
+
+
+class ResponseCacheTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        self.other = Restaurant.objects.create(name='Other Kitchen', shard='default')
+        self.tibs = MenuItem.objects.create(
+            restaurant=self.restaurant, name='Tibs', description='', price=100, image='x.png'
+        )
+        MenuItem.objects.create(restaurant=self.other, name='Pizza', description='', price=200, image='x.png')
+        self.addon = Addon.objects.create(restaurant=self.restaurant, name='Injera', price=10)
+        self.account = PaymentAccount.objects.create(
+            restaurant=self.restaurant, account_type='CBE', account_number='1000'
+        )
+        PaymentAccount.objects.create(restaurant=self.other, account_type='Telebirr', account_number='2000')
+        self.customer = User.objects.create_user('customer', password='pw', role='customer')
+        self.admins = [
+            User.objects.create_user(name, password='pw', role='restaurant_admin', restaurant=restaurant)
+            for name, restaurant in (('admin1', self.restaurant), ('admin2', self.other))
+        ]
+
+    def get(self, path, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertInvalidates(self, path, models, change, user=None):
+        self.get(path, user)
+        self.assertEqual(self.get(path, user)['X-Cache'], 'HIT')
+        before = get_versions(models)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertTrue(all(new > old for old, new in zip(before, get_versions(models))), path)
+        response = self.get(path, user)
+        self.assertEqual(response['X-Cache'], 'MISS', path)
+        return response
+
+    def test_saves_and_deletes_invalidate_the_cached_responses(self):
+        def rename():
+            self.tibs.name = 'Derek Tibs'
+            self.tibs.save()
+
+        response = self.assertInvalidates('/api/menu-items/', [MenuItem], rename)
+        self.assertIn('Derek Tibs', [item['name'] for item in response.data])
+        rating = lambda: Rating.objects.create(menu_item=self.tibs, customer=self.customer, stars=5)
+        self.assertInvalidates(f'/api/menu-items/{self.tibs.pk}/', [Rating], rating)
+        self.assertInvalidates('/api/menu-items/', [MenuItem], self.tibs.delete)
+
+        response = self.assertInvalidates('/api/addons/', [Addon], self.addon.delete)
+        self.assertEqual(response.data, [])
+
+        def rename_restaurant():
+            self.other.name = 'Pizza Place'
+            self.other.save()
+
+        self.assertInvalidates('/api/restaurants/', [Restaurant], rename_restaurant)
+        self.assertInvalidates('/api/restaurants/', [PaymentAccount], self.account.delete)
+        account = lambda: PaymentAccount.objects.create(
+            restaurant=self.restaurant, account_type='CBE', account_number='3'
+        )
+        response = self.assertInvalidates('/api/payment-accounts/', [PaymentAccount], account, user=self.admins[0])
+        self.assertEqual([row['account_number'] for row in response.data], ['3'])
+
+    def test_responses_are_not_shared_between_roles_or_restaurants(self):
+        names = {}
+        for user in (None, self.customer, *self.admins, None, self.customer, *self.admins):
+            response = self.get('/api/menu-items/', user)
+            names.setdefault(user, sorted(item['name'] for item in response.data))
+            self.assertEqual(sorted(item['name'] for item in response.data), names[user])
+        self.assertEqual(
+            [names[None], names[self.customer], names[self.admins[0]], names[self.admins[1]]],
+            [['Pizza', 'Tibs'], ['Pizza', 'Tibs'], ['Tibs'], ['Pizza']],
+        )
+        for admin, number in zip(self.admins, ('1000', '2000')):
+            response = self.get('/api/payment-accounts/', admin)
+            self.assertEqual([row['account_number'] for row in response.data], [number])
+        # The second admin's request didn't get the first one's cached response
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+
+class SearchIndexTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.restaurant = Restaurant.objects.create(name='Test Kitchen', address='Bole Road', shard='default')
+        self.tibs = MenuItem.objects.create(
+            restaurant=self.restaurant, name='Spicy Tibs', description='Beef with awaze', price=100, image='x.png'
+        )
+        MenuItem.objects.create(restaurant=self.restaurant, name='Shiro Wat', description='', price=80, image='x.png')
+
+    def titles(self, query):
+        entries, corrected = search.search(query)
+        return sorted(entry.title for entry in entries), corrected
+
+    def test_prefix_and_typo_matching(self):
+        self.assertEqual(self.titles('tibs'), (['Spicy Tibs'], False))
+        self.assertEqual(self.titles('spi aw'), (['Spicy Tibs'], False))
+        self.assertEqual(self.titles('bole'), (['Test Kitchen'], False))
+        self.assertEqual(self.titles('tibbs'), (['Spicy Tibs'], True))
+        self.assertEqual(self.titles('pizza'), ([], False))
+
+    def test_edits_and_deletes_update_the_index(self):
+        self.tibs.name = 'Derek Tibs'
+        self.tibs.save()
+        self.assertEqual(self.titles('spicy'), ([], False))
+        self.assertEqual(self.titles('derek'), (['Derek Tibs'], False))
+
+        # Menu entries carry the restaurant's name
+        self.restaurant.name = 'Habesha House'
+        self.restaurant.save()
+        self.assertEqual(self.titles('habesha'), (['Derek Tibs', 'Habesha House', 'Shiro Wat'], False))
+
+        self.tibs.delete()
+        self.assertEqual(self.titles('tibs'), ([], False))
+
+    def test_migration_indexes_existing_rows(self):
+        migration = importlib.import_module('api.migrations.0011_searchentry')
+        SearchEntry.objects.all().delete()
+        self.assertEqual(self.titles('tibs'), ([], False))
+        migration.index_existing_rows(django_apps, SimpleNamespace(connection=connections['default']))
+        self.assertEqual(SearchEntry.objects.count(), 3)
+        self.assertEqual(self.titles('tibs'), (['Spicy Tibs'], False))
+
+
+class SearchViewTests(SimpleTestCase):
+    def test_restaurant_must_be_an_id(self):
+        with mock.patch.object(search, 'search') as search_entries:
+            response = APIClient().get('/api/search/', {'q': 'tibs', 'restaurant': '1 OR 1'})
+        self.assertEqual(response.status_code, 400)
+        search_entries.assert_not_called()
+
+    def test_limit_is_clamped(self):
+        with mock.patch.object(search, 'search', return_value=([], None)) as search_entries:
+            for limit, expected in (('-5', 1), ('0', 1), ('500', 50)):
+                APIClient().get('/api/search/', {'q': 'tibs', 'limit': limit})
+                self.assertEqual(search_entries.call_args.kwargs['limit'], expected)
+
+
+
+class ActivityLogTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        customer = User.objects.create_user('customer', password='pw', role='customer')
+        self.order = Order.objects.create(customer=customer, restaurant=restaurant)
+
+    def entry(self, **kwargs):
+        return ActivityLog(restaurant_id=self.order.restaurant_id, order_id=self.order.pk,
+                           action_type=ActivityLog.ActionType.ORDER_APPROVED, **kwargs)
+
+    def buffer(self, **kwargs):
+        buffer = activity.ActivityBuffer(**{'max_size': 100, 'batch_size': 2, 'flush_seconds': 3600, **kwargs})
+        # No writer thread: it would write outside the test's transaction
+        buffer._ensure_started = lambda: None
+        return buffer
+
+    def test_flush_writes_everything_queued_in_batches(self):
+        buffer = self.buffer()
+        for _ in range(5):
+            buffer.put(self.entry())
+        with mock.patch.object(activity, 'write', wraps=activity.write) as write:
+            buffer.flush()
+        self.assertEqual([len(call.args[0]) for call in write.call_args_list], [2, 2, 1])
+        self.assertEqual(ActivityLog.objects.count(), 5)
+
+    def test_entries_are_written_right_away_when_the_queue_is_full(self):
+        buffer = self.buffer(max_size=1)
+        buffer.put(self.entry())
+        buffer.put(self.entry())
+        self.assertEqual(ActivityLog.objects.count(), 1)
+        buffer.flush()
+        self.assertEqual(ActivityLog.objects.count(), 2)
+
+    def test_a_bad_entry_only_loses_itself(self):
+        entries = [self.entry(details=str(number)) for number in range(3)]
+        save = ActivityLog.save
+
+        def save_unless_bad(entry, *args, **kwargs):
+            if entry is entries[1]:
+                raise IntegrityError('order deleted')
+            return save(entry, *args, **kwargs)
+
+        with mock.patch.object(ShardedQuerySet, 'bulk_create', side_effect=IntegrityError('order deleted')), \
+                mock.patch.object(ActivityLog, 'save', save_unless_bad), \
+                self.assertLogs(activity.logger, 'WARNING'):
+            activity.write(entries)
+        self.assertEqual(sorted(ActivityLog.objects.values_list('details', flat=True)), ['0', '2'])
+
+    def test_prune_deletes_only_entries_past_retention(self):
+        now = timezone.now()
+        for days in (1, 29, 31, 400):
+            self.entry(details=str(days), timestamp=now - timedelta(days=days)).save()
+        out = io.StringIO()
+        call_command('prune_activity_logs', days=30, batch_size=1, stdout=out)
+        self.assertEqual(sorted(ActivityLog.objects.values_list('details', flat=True)), ['1', '29'])
+        self.assertIn('Deleted 2 activity log entries', out.getvalue())
+
+
+
+class ThrottlingTests(TestCase):
+    databases = '__all__'
+    RATES = {'api': {'guest': '5/min'}, 'catalogue': {'guest': '2/min'}}
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.enterContext(override_settings(THROTTLE_RATES=self.RATES))
+
+    def test_workers_cannot_spend_the_same_token(self):
+        request = SimpleNamespace(user=AnonymousUser(), META={'REMOTE_ADDR': '203.0.113.7'})
+        view = SimpleNamespace(throttle_scope='api')
+        allowed = []
+        barrier = threading.Barrier(20)
+
+        def client():
+            barrier.wait()
+            allowed.append(throttling.RoleScopedThrottle().allow_request(request, view))
+
+        threads = [threading.Thread(target=client) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(allowed.count(True), 5)
+
+    def test_guests_cannot_choose_their_bucket_with_x_forwarded_for(self):
+        view = SimpleNamespace(throttle_scope='catalogue')
+
+        def allowed(forwarded_for, remote_addr='203.0.113.7'):
+            request = SimpleNamespace(
+                user=AnonymousUser(), META={'REMOTE_ADDR': remote_addr, 'HTTP_X_FORWARDED_FOR': forwarded_for}
+            )
+            return throttling.RoleScopedThrottle().allow_request(request, view)
+
+        # Directly exposed: only REMOTE_ADDR counts
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 0}):
+            self.assertEqual([allowed(f'198.51.100.{n}') for n in range(3)], [True, True, False])
+        # Behind one proxy: the address it appended, not what the client sent before it
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            self.assertEqual(
+                [allowed(f'198.51.100.{n}, 192.0.2.1', remote_addr='10.0.0.1') for n in range(3)],
+                [True, True, False],
+            )
+            self.assertTrue(allowed('192.0.2.2', remote_addr='10.0.0.1'))
+
+    def test_async_endpoints_are_throttled(self):
+        responses = [self.client.get('/api/async/menu-items/') for _ in range(3)]
+        self.assertEqual([response.status_code for response in responses], [200, 200, 429])
+        self.assertGreater(int(responses[-1]['Retry-After']), 0)
+
+    @override_settings(MAX_CONCURRENT_REQUESTS=0, MAX_CONCURRENT_REQUESTS_ALL_WORKERS=1)
+    def test_requests_in_flight_are_counted_across_workers(self):
+        # Two single-request workers: the second is asked while the first is busy
+        second_worker = throttling.ConcurrencyLimitMiddleware(lambda request: HttpResponse())
+        first_worker = throttling.ConcurrencyLimitMiddleware(second_worker)
+        self.assertEqual(first_worker(None).status_code, 503)
+        self.assertEqual(second_worker(None).status_code, 200)
+
+
+
+class AsyncViewTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        other = Restaurant.objects.create(name='Other Kitchen', shard='default')
+        for restaurant, name in ((self.restaurant, 'Tibs'), (self.restaurant, 'Shiro'), (other, 'Pizza')):
+            MenuItem.objects.create(restaurant=restaurant, name=name, description='', price=100, image='x.png')
+        self.customer = User.objects.create_user('customer', password='pw', role='customer')
+        self.admin = User.objects.create_user('admin', password='pw', role='restaurant_admin', restaurant=self.restaurant)
+        self.order = Order.objects.create(customer=self.customer, restaurant=self.restaurant, status='Pending Approval')
+
+    def get(self, path, user=None, **params):
+        headers = {}
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+        return self.client.get(path, params, **headers)
+
+    def test_menu_items_match_the_drf_endpoint(self):
+        without_restaurant = User.objects.create_user('new-admin', password='pw', role='restaurant_admin')
+        for user, count in ((None, 3), (self.customer, 3), (self.admin, 2), (without_restaurant, 0)):
+            expected = sorted(self.get('/api/menu-items/', user).json(), key=lambda item: item['id'])
+            response = self.get('/api/async/menu-items/', user)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), expected)
+            self.assertEqual(len(expected), count)
+
+    def test_bad_tokens_and_guests(self):
+        response = self.client.get('/api/async/menu-items/', HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.get(f'/api/async/orders/{self.order.pk}/status/').status_code, 401)
+        self.assertEqual(self.get('/api/async/chat-messages/').status_code, 401)
+
+    @override_settings(THROTTLE_RATES={'catalogue': {'guest': '2/min', 'customer': '5/min'}})
+    def test_throttled_per_role(self):
+        statuses = [self.get('/api/async/menu-items/').status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        # Customers have their own, bigger bucket
+        self.assertEqual(self.get('/api/async/menu-items/', self.customer).status_code, 200)
+        response = self.get('/api/async/menu-items/')
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_order_status_permissions(self):
+        path = f'/api/async/orders/{self.order.pk}/status/'
+        stranger = User.objects.create_user('stranger', password='pw', role='customer')
+        response = self.get(path, self.customer)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'Pending Approval')
+        self.assertEqual(self.get(path, stranger).status_code, 404)
+        # Restaurants only see orders once they have been approved
+        self.assertEqual(self.get(path, self.admin).status_code, 404)
+        self.order.status = 'Preparing'
+        self.order.save()
+        self.assertEqual(self.get(path, self.admin).json()['status'], 'Preparing')
+        sub_admin = User.objects.create_user('subadmin', password='pw', role='sub_admin')
+        self.assertEqual(self.get(path, sub_admin).status_code, 200)
+
+    def test_chat_messages_of_other_customers_are_hidden(self):
+        conversation = Conversation.objects.create(customer=self.customer)
+        first = ChatMessage.objects.create(conversation=conversation, sender=self.customer, message='Hello')
+        ChatMessage.objects.create(conversation=conversation, sender=self.customer, message='Anyone?')
+        response = self.get('/api/async/chat-messages/', self.customer, conversation=conversation.pk, after=first.pk)
+        self.assertEqual([message['message'] for message in response.json()], ['Anyone?'])
+        stranger = User.objects.create_user('stranger', password='pw', role='customer')
+        response = self.get('/api/async/chat-messages/', stranger, conversation=conversation.pk)
+        self.assertEqual(response.status_code, 404)
+
+
+class ListFilterTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        self.other = Restaurant.objects.create(name='Other Kitchen', shard='default')
+        for restaurant, name, price, rating in (
+            (self.restaurant, 'Tibs', 250, 4.5), (self.restaurant, 'Shiro', 80, 3.0),
+            (self.restaurant, 'Kitfo', 300, 4.8), (self.other, 'Pizza', 200, 4.9),
+        ):
+            MenuItem.objects.create(
+                restaurant=restaurant, name=name, description='', price=price, image='x.png', average_rating=rating
+            )
+        self.customer = User.objects.create_user('customer', password='pw', role='customer')
+        self.admin = User.objects.create_user('admin', password='pw', role='restaurant_admin', restaurant=self.restaurant)
+        self.client = APIClient()
+
+    def names(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['name'] for row in response.data]
+
+    def test_price_and_rating_ranges(self):
+        names = self.names('/api/menu-items/', restaurant=self.restaurant.pk, min_price=100, max_price=250)
+        self.assertEqual(names, ['Tibs'])
+        names = self.names('/api/menu-items/', min_rating=4.5, ordering='-average_rating')
+        self.assertEqual(names, ['Pizza', 'Kitfo', 'Tibs'])
+        names = self.names('/api/menu-items/', max_rating=4, min_price=50)
+        self.assertEqual(names, ['Shiro'])
+        response = self.client.get('/api/menu-items/', {'min_price': 'cheap'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_ordering_is_ignored(self):
+        by_id = self.names('/api/menu-items/', ordering='id')
+        # Not in MENU_ITEM_ORDERING, so not sorted by, even though it's a field
+        self.assertEqual(self.names('/api/menu-items/', ordering='description,restaurant__name'), by_id)
+        self.assertEqual(self.names('/api/menu-items/', ordering='-description,price'), ['Shiro', 'Pizza', 'Tibs', 'Kitfo'])
+
+    def test_filters_stay_within_the_restaurant_admins_restaurant(self):
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.names('/api/menu-items/', min_rating=4.5, ordering='price'), ['Tibs', 'Kitfo'])
+
+        orders = [
+            Order.objects.create(customer=self.customer, restaurant=restaurant, status=status, total_price=total)
+            for restaurant, status, total in (
+                (self.restaurant, 'Preparing', 100), (self.restaurant, 'Completed', 300),
+                (self.restaurant, 'Pending Approval', 200), (self.other, 'Preparing', 400),
+            )
+        ]
+        response = self.client.get('/api/orders/', {'status': ['Preparing', 'Pending Approval'], 'min_total': 50})
+        self.assertEqual([row['id'] for row in response.data], [orders[0].pk])
+        # Asking for another restaurant's orders doesn't widen what they see
+        response = self.client.get('/api/orders/', {'restaurant': self.other.pk})
+        self.assertEqual(response.data, [])
+        response = self.client.get('/api/orders/', {'ordering': '-total_price'})
+        self.assertEqual([row['id'] for row in response.data], [orders[1].pk, orders[0].pk])
+        response = self.client.get('/api/orders/', {'status': 'Eaten'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RatingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        self.tibs, self.shiro, self.kitfo = (
+            MenuItem.objects.create(restaurant=restaurant, name=name, description='', price=100, image='x.png')
+            for name in ('Tibs', 'Shiro', 'Kitfo')
+        )
+        self.customers = [
+            User.objects.create_user(f'customer{number}', password='pw', role='customer') for number in range(2)
+        ]
+        self.orders = []
+        for customer in self.customers:
+            order = Order.objects.create(customer=customer, restaurant=restaurant, status='Completed')
+            OrderItem.objects.bulk_create([OrderItem(order=order, menu_item=item) for item in (self.tibs, self.shiro)])
+            self.orders.append(order)
+
+    def rate(self, number, ratings, order=None):
+        client = APIClient()
+        client.force_authenticate(self.customers[number])
+        order = order or self.orders[number]
+        return client.post('/api/ratings/bulk/', {'order': order.pk, 'ratings': ratings}, format='json')
+
+    def aggregates(self, item):
+        item.refresh_from_db()
+        entry = SearchEntry.objects.get(kind=SearchEntry.Kind.MENU_ITEM, object_id=item.pk)
+        self.assertEqual(entry.average_rating, item.average_rating)
+        return item.average_rating, item.rating_count
+
+    def test_rating_again_replaces_the_rating(self):
+        response = self.rate(0, [{'menu_item': self.tibs.pk, 'stars': 4}, {'menu_item': self.shiro.pk, 'stars': 2}])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.rate(1, [{'menu_item': self.tibs.pk, 'stars': 5}])
+        self.assertEqual(self.aggregates(self.tibs), (4.5, 2))
+
+        # Listed twice, the last one wins
+        self.rate(0, [{'menu_item': self.tibs.pk, 'stars': 3}, {'menu_item': self.tibs.pk, 'stars': 1}])
+        self.assertEqual(self.aggregates(self.tibs), (3.0, 2))
+        self.assertEqual(self.aggregates(self.shiro), (2.0, 1))
+        self.assertEqual(Rating.objects.filter(customer=self.customers[0]).count(), 2)
+
+    def test_only_items_of_the_customers_delivered_order(self):
+        response = self.rate(0, [{'menu_item': self.kitfo.pk, 'stars': 5}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ratings', response.data)
+        response = self.rate(0, [{'menu_item': self.tibs.pk, 'stars': 5}], order=self.orders[1])
+        self.assertEqual(response.status_code, 400)
+        Order.objects.filter(pk=self.orders[0].pk).update(status='Preparing')
+        self.assertEqual(self.rate(0, [{'menu_item': self.tibs.pk, 'stars': 5}]).status_code, 400)
+        self.assertEqual(self.aggregates(self.tibs), (0, 0))
+
+    def test_deleting_a_rating_recomputes_the_aggregates(self):
+        self.rate(0, [{'menu_item': self.tibs.pk, 'stars': 4}])
+        self.rate(1, [{'menu_item': self.tibs.pk, 'stars': 2}])
+        client = APIClient()
+        client.force_authenticate(self.customers[1])
+        rating = Rating.objects.get(customer=self.customers[1])
+        self.assertEqual(client.delete(f'/api/ratings/{rating.pk}/').status_code, 204)
+        self.assertEqual(self.aggregates(self.tibs), (4.0, 1))
+        Rating.objects.get(customer=self.customers[0]).delete()
+        self.assertEqual(self.aggregates(self.tibs), (0, 0))
+
+
+class OrderArchiveTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        item = MenuItem.objects.create(restaurant=restaurant, name='Tibs', description='', price=100, image='x.png')
+        self.customer = User.objects.create_user('customer', password='pw', role='customer')
+        self.old, self.open, self.recent = (
+            Order.objects.create(customer=self.customer, restaurant=restaurant, status=status, total_price=100)
+            for status in ('Completed', 'Preparing', 'Completed')
+        )
+        for order in (self.old, self.open, self.recent):
+            OrderItem.objects.create(order=order, menu_item=item, quantity=2)
+            ActivityLog.objects.create(
+                order=order, restaurant=restaurant, action_type=ActivityLog.ActionType.ORDER_APPROVED, details='ok'
+            )
+        Order.objects.filter(pk__in=[self.old.pk, self.open.pk]).update(created_at=timezone.now() - timedelta(days=90))
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def archive(self, *args):
+        out = io.StringIO()
+        call_command('archive_orders', '--days=30', '--batch-size=1', *args, stdout=out)
+        return out.getvalue()
+
+    def test_old_finished_orders_leave_the_hot_tables(self):
+        self.assertIn('1 order(s) would be archived', self.archive('--dry-run'))
+        self.assertEqual(ArchivedOrder.objects.count(), 0)
+
+        self.assertIn('Archived 1 order(s)', self.archive())
+        self.assertEqual(sorted(Order.objects.values_list('pk', flat=True)), sorted([self.open.pk, self.recent.pk]))
+        self.assertFalse(OrderItem.objects.filter(order_id=self.old.pk).exists())
+        self.assertFalse(ActivityLog.objects.filter(order_id=self.old.pk).exists())
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual((archived.pk, archived.order_code), (self.old.pk, self.old.order_code))
+        self.assertEqual(list(archived.items.values_list('quantity', flat=True)), [2])
+        self.assertEqual(ArchivedActivityLog.objects.get().order_id, self.old.pk)
+        # Nothing left to do
+        self.assertIn('Archived 0 order(s)', self.archive())
+
+    def test_archived_orders_stay_readable(self):
+        self.archive()
+        response = self.client.get(f'/api/orders/{self.old.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['order_code'], response.data['status']), (self.old.order_code, 'Completed'))
+        self.assertIsNotNone(response.data['archived_at'])
+        self.assertEqual([item['quantity'] for item in response.data['items']], [2])
+
+        listed = self.client.get('/api/orders/').data
+        self.assertNotIn(self.old.pk, [row['id'] for row in listed])
+        listed = self.client.get('/api/orders/', {'archived': '1'}).data
+        self.assertEqual([row['id'] for row in listed], [self.old.pk])
+
+        # Still only for the customer who placed it
+        self.client.force_authenticate(User.objects.create_user('other', password='pw', role='customer'))
+        self.assertEqual(self.client.get(f'/api/orders/{self.old.pk}/').status_code, 404)
+        self.assertEqual(self.client.get('/api/orders/', {'archived': '1'}).data, [])
+
+
+class ReplicaRoutingTests(TestCase):
+    databases = '__all__'
+
+    class ReadingViewSet(routers.ReplicaReadMixin, viewsets.ViewSet):
+        def list(self, request):
+            return Response({'replica': router.db_for_read(Restaurant) == routers.REPLICA})
+
+        def create(self, request):
+            router.db_for_write(Restaurant)
+            return Response({'replica': router.db_for_read(Restaurant) == routers.REPLICA}, status=201)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.enterContext(mock.patch.object(routers, 'replica_configured', return_value=True))
+        self.user = User.objects.create_user('customer', password='pw', role='customer')
+        self.factory = APIRequestFactory()
+
+    def call(self, method, action, user=None):
+        view = routers.ReplicaRoutingMiddleware(self.ReadingViewSet.as_view({method: action}))
+        request = getattr(self.factory, method)('/')
+        if user is not None:
+            force_authenticate(request, user)
+        return view(request).data['replica']
+
+    def test_replica_router(self):
+        replica_router = routers.PrimaryReplicaRouter()
+        # Outside a request, or in a request that didn't ask for the replica
+        self.assertEqual(replica_router.db_for_read(Restaurant), 'default')
+        state = routers.RoutingState()
+        token = routers._routing.set(state)
+        self.addCleanup(routers._routing.reset, token)
+        self.assertEqual(replica_router.db_for_read(Restaurant), 'default')
+        state.use_replica = True
+        self.assertEqual(replica_router.db_for_read(Restaurant), routers.REPLICA)
+        # Reads after a write see it
+        self.assertEqual(replica_router.db_for_write(Restaurant), 'default')
+        self.assertEqual(replica_router.db_for_read(Restaurant), 'default')
+        self.assertFalse(replica_router.allow_migrate(routers.REPLICA, 'api'))
+        self.assertTrue(replica_router.allow_migrate('default', 'api'))
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        self.assertTrue(self.call('get', 'list'))
+        self.assertTrue(self.call('get', 'list', self.user))
+        # Read in the request that wrote, and by that user for a while after
+        self.assertFalse(self.call('post', 'create', self.user))
+        self.assertFalse(self.call('get', 'list', self.user))
+        other = User.objects.create_user('other', password='pw', role='customer')
+        self.assertTrue(self.call('get', 'list', other))
+        cache.delete(routers.STICKY_KEY.format(self.user.pk))
+        self.assertTrue(self.call('get', 'list', self.user))
+
+    @unittest.skipUnless(sharding.enabled(), 'needs DATABASE_SHARDS')
+    def test_sharded_models_are_routed_by_the_shard_router(self):
+        state = routers.RoutingState()
+        state.use_replica = True
+        token = routers._routing.set(state)
+        self.addCleanup(routers._routing.reset, token)
+        self.assertEqual(router.db_for_read(MenuItem), 'default')
+        self.assertEqual(router.db_for_read(Restaurant), routers.REPLICA)
+
+
+# Processing in the request, and TransactionTestCase so it runs when the chunk is committed
+@override_settings(UPLOAD_PROCESSING_IN_BACKGROUND=False, UPLOAD_CHUNK_MAX_BYTES=1024)
+class PaymentProofUploadTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        for name in ('MEDIA_ROOT', 'UPLOAD_SESSION_DIR'):
+            directory = tempfile.TemporaryDirectory()
+            self.addCleanup(directory.cleanup)
+            self.enterContext(override_settings(**{name: directory.name}))
+        restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        customer = User.objects.create_user('customer', password='pw', role='customer')
+        self.order = Order.objects.create(customer=customer, restaurant=restaurant)
+        self.client = APIClient()
+        self.client.force_authenticate(customer)
+
+    def photo(self):
+        # Taken sideways, with the camera's details in EXIF
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'PhoneMaker'
+        output = io.BytesIO()
+        Image.new('RGB', (64, 48), 'red').save(output, format='JPEG', exif=exif)
+        return output.getvalue()
+
+    def start(self, data):
+        response = self.client.post('/api/payment-proof-uploads/', {
+            'order': self.order.pk, 'filename': 'proof.jpg', 'size': len(data),
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        return f"/api/payment-proof-uploads/{response.data['id']}/"
+
+    def put(self, url, chunk, offset):
+        return self.client.generic('PUT', url, chunk, 'application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_chunks_resume_from_the_received_offset(self):
+        data = self.photo()
+        url = self.start(data)
+        self.assertEqual(self.put(url, data[:500], 0)['Upload-Offset'], '500')
+
+        # A retry of the first chunk after a dropped connection
+        response = self.put(url, data[:500], 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '500')
+
+        received = self.client.get(url).data['received']
+        for offset in range(received, len(data), 1000):
+            response = self.put(url, data[offset:offset + 1000], offset)
+        self.assertEqual(response.status_code, 200)
+        # Processed in the request, so the answer already says so
+        self.assertEqual(response.data['status'], 'done')
+        self.assertEqual(self.put(url, b'x', len(data)).status_code, 409)
+
+    def test_oversized_chunks_are_rejected(self):
+        url = self.start(b'x' * 2000)
+        self.assertEqual(self.put(url, b'x' * 1025, 0).status_code, 413)
+        self.put(url, b'x' * 1000, 0)
+        self.assertEqual(self.put(url, b'x' * 1001, 1000).status_code, 413)
+        self.assertEqual(self.client.get(url).data['received'], 1000)
+
+    def test_proof_is_stored_upright_without_exif(self):
+        data = self.photo()
+        url = self.start(data)
+        self.put(url, data[:1000], 0)
+        self.put(url, data[1000:], 1000)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'Pending Approval')
+        with Image.open(self.order.payment_proof.path) as proof:
+            self.assertEqual(proof.size, (48, 64))
+            self.assertEqual(len(proof.getexif()), 0)
+
+    def test_nothing_is_left_behind_when_the_order_is_deleted_meanwhile(self):
+        data = lunch_rush.tiny_png()
+        url = self.start(data)
+        clean_image = uploads.clean_image
+
+        def clean_then_delete_order(path):
+            cleaned = clean_image(path)
+            Order.objects.filter(pk=self.order.pk).delete()
+            return cleaned
+
+        with mock.patch.object(uploads, 'clean_image', clean_then_delete_order):
+            response = self.put(url, data, 0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([name for _, _, names in os.walk(settings.MEDIA_ROOT) for name in names], [])
+        self.assertEqual(os.listdir(settings.UPLOAD_SESSION_DIR), [])
+
+
+
+class MinifyJSTests(SimpleTestCase):
+    def assertMinifiesTo(self, source, expected):
+        self.assertEqual(frontend.minify_js(source), expected + '\n')
+
+    def test_regular_expressions_and_divisions(self):
+        self.assertMinifiesTo('x = a / b / c;', 'x=a/b/c;')
+        self.assertMinifiesTo('y = (a + b) / 2 / items[0];', 'y=(a+b)/2/items[0];')
+        self.assertMinifiesTo('half = i++ / 2;', 'half=i++/2;')
+        # Kept exactly, spaces and // included
+        self.assertMinifiesTo('ok = /a  b/.test(s) && /[/]  \\/\\//g.test(s);', 'ok=/a  b/.test(s)&&/[/]  \\/\\//g.test(s);')
+        self.assertMinifiesTo('return /^\\d+ (h|m)$/i.exec(s)', 'return/^\\d+ (h|m)$/i.exec(s)')
+
+    def test_template_literals_are_kept(self):
+        self.assertMinifiesTo(
+            'html = `<b>  ${ user.name + `  ${ {a: 1}.a }` }  </b> // not a comment`;',
+            'html=`<b>  ${ user.name + `  ${ {a: 1}.a }` }  </b> // not a comment`;',
+        )
+
+    def test_comments_and_strings(self):
+        self.assertMinifiesTo(
+            "/* header */\nlet url = 'http://x/*y*/' + \"a  b\"; // done\nlet z = a /* c */ b",
+            "let url='http://x/*y*/'+\"a  b\";let z=a b",
+        )
+        self.assertMinifiesTo('a + +b; a - -b; a + ++b', 'a+ +b;a- -b;a+ ++b')
+
+    def test_line_breaks_automatic_semicolon_insertion_needs_are_kept(self):
+        self.assertMinifiesTo('function f() {\n  return\n  x\n}', 'function f(){return\nx}')
+        self.assertMinifiesTo('a = b\n(c)', 'a=b\n(c)')
+        self.assertMinifiesTo('a\n++b', 'a\n++b')
+        self.assertMinifiesTo('f(a,\n  b)\nconst o = {\n  a: 1\n}\ng()', 'f(a,b)\nconst o={a:1}\ng()')
+
+    @unittest.skipUnless(shutil.which('node'), 'needs Node.js')
+    def test_minified_code_behaves_the_same(self):
+        source = (
+            'let i = 4, a = 1, b = 2, s = "3 h"\n'
+            'const half = i++ / 2 / 1\n'
+            'const m = /^(\\d+)  ?(h|m)$/i.exec(s) || /x/.exec(s)\n'
+            'let c = a\n++b\n'
+            'function f() {\n  return\n  42\n}\n'
+            'const t = `${ a + `${ {k: b}.k }` } // ${ half }`\n'
+            'console.log(JSON.stringify([half, m && m[2], a, b, c, f(), t, a - -b, a+ +b]))\n'
+        )
+        outputs = [
+            subprocess.run(['node', '-e', code], capture_output=True, text=True, check=True).stdout
+            for code in (source, frontend.minify_js(source))
+        ]
+        self.assertEqual(outputs[0], outputs[1])
+
+    @unittest.skipUnless(shutil.which('node'), 'needs Node.js')
+    def test_frontend_scripts_still_parse(self):
+        for path in sorted(settings.FRONTEND_DIR.rglob('*')):
+            if path.suffix == '.html':
+                scripts = frontend.extract_scripts(path.read_text(encoding='utf-8'), path.stem)[1].values()
+            elif path.suffix == '.js':
+                scripts = [path.read_text(encoding='utf-8')]
+            else:
+                continue
+            for script in scripts:
+                with tempfile.NamedTemporaryFile('w', suffix='.js', encoding='utf-8') as minified:
+                    minified.write(frontend.minify_js(script))
+                    minified.flush()
+                    process = subprocess.run(['node', '--check', minified.name], capture_output=True, text=True)
+                self.assertEqual(process.returncode, 0, f'{path.name}: {process.stderr}')
+
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        self.customer = User.objects.create_user('customer', password='pw', role='customer')
+        self.items = [
+            MenuItem.objects.create(restaurant=self.restaurant, name=name, description='', price=100, image='x.png')
+            for name in ('Tibs', 'Shiro', 'Kitfo', 'Firfir')
+        ]
+        self.addons = [Addon.objects.create(restaurant=self.restaurant, name=name, price=10) for name in ('Injera', 'Awaze')]
+
+    def complete(self, items=(), addons=()):
+        order = Order.objects.create(customer=self.customer, restaurant=self.restaurant, status='Completed')
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, menu_item=item) for item in items]
+            + [OrderItem(order=order, addon=addon) for addon in addons]
+        )
+        return order
+
+    def stored(self):
+        pairs = set(ItemPair.objects.values_list('menu_item_id', 'other_kind', 'other_id', 'count'))
+        # The rebuild also stores the empty lists of items never ordered
+        lists = {row.menu_item_id: row.suggestions for row in Recommendation.objects.all() if row.suggestions}
+        return pairs, lists
+
+    def test_sparse_counts_match_the_dense_product(self):
+        rng = np.random.default_rng(7)
+        menu_item_ids, addon_ids = list(range(1, 31)), list(range(1, 11))
+        rows = [
+            (order, int(rng.integers(1, 31)), None) if rng.random() < 0.7 else (order, None, int(rng.integers(1, 11)))
+            for order in range(200) for _ in range(int(rng.integers(1, 6)))
+        ]
+        incidence = np.zeros((200, 40), dtype=np.int64)
+        for order, menu_item_id, addon_id in rows:
+            incidence[order, menu_item_id - 1 if menu_item_id else 30 + addon_id - 1] = 1
+        dense = incidence.T @ incidence
+        # Small chunks, so cells counted in several chunks are added up
+        with mock.patch.object(recommendations, 'ORDER_CHUNK', 7):
+            sources, targets, counts = recommendations.cooccurrence_counts(rows, menu_item_ids, addon_ids)
+        sparse = np.zeros_like(dense)
+        sparse[sources, targets] = counts
+        np.testing.assert_array_equal(sparse, dense)
+        self.assertEqual(len(counts), np.count_nonzero(dense))
+
+    def test_incremental_updates_match_a_full_rebuild(self):
+        tibs, shiro, kitfo, firfir = self.items
+        injera, awaze = self.addons
+        for items, addons in (
+            ([tibs, shiro], [injera]), ([tibs, kitfo], [injera, awaze]), ([tibs, shiro], []),
+            ([shiro], [awaze]), ([tibs, shiro, kitfo, firfir], [injera]), ([tibs, tibs], []),
+        ):
+            recommendations.record_order(self.complete(items, addons))
+        incremental = self.stored()
+        recommendations.build_restaurant(self.restaurant.pk)
+        self.assertEqual(self.stored(), incremental)
+        self.assertEqual(incremental[1][tibs.pk][0], {'kind': 'menu_item', 'id': shiro.pk, 'count': 3, 'confidence': 0.6})
+
+    def test_endpoint_serves_resolved_suggestions(self):
+        tibs, shiro = self.items[:2]
+        recommendations.record_order(self.complete([tibs, shiro], [self.addons[0]]))
+        response = APIClient().get(f'/api/menu-items/{tibs.pk}/recommendations/', {'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(s['kind'], s['id'], s['name']) for s in response.data], [('menu_item', shiro.pk, 'Shiro')])
+
+    def test_cached_lists_only_drop_when_their_item_or_menu_changes(self):
+        tibs, shiro, kitfo = self.items[:3]
+        with self.captureOnCommitCallbacks(execute=True):
+            recommendations.record_order(self.complete([tibs, shiro]))
+        recommendations.suggestions_for(tibs.pk)
+
+        other = Restaurant.objects.create(name='Other Kitchen', shard='default')
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.create(restaurant=other, name='Pizza', description='', price=1, image='x.png')
+            recommendations.record_order(self.complete([kitfo]))
+        with self.assertNumQueries(0):
+            recommendations.suggestions_for(tibs.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            shiro.name = 'Shiro wot'
+            shiro.save()
+        self.assertEqual(recommendations.suggestions_for(tibs.pk)[0]['name'], 'Shiro wot')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recommendations.record_order(self.complete([tibs, kitfo]))
+            recommendations.record_order(self.complete([tibs, kitfo]))
+        self.assertEqual(recommendations.suggestions_for(tibs.pk)[0]['id'], kitfo.pk)
+
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user('customer', password='pw', role='customer')
+        self.calls = []
+        test = self
+
+        class CheckoutView(viewsets.ViewSet):
+            @idempotency.idempotent
+            def create(self, request):
+                test.calls.append(request.data.get('total'))
+                if test.during_call:
+                    test.during_call()
+                return Response({'call': len(test.calls)}, status=201)
+
+        self.view = CheckoutView.as_view({'post': 'create'})
+        self.during_call = None
+
+    def post(self, total, key='checkout-1', user=None):
+        request = APIRequestFactory().post('/checkout/', {'total': total}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        force_authenticate(request, user or self.customer)
+        return self.view(request)
+
+    def test_retry_replays_the_stored_response(self):
+        first, retry = self.post('10'), self.post('10')
+        self.assertEqual((retry.status_code, retry.data), (201, {'call': 1}))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(first.data, retry.data)
+        self.assertEqual(self.calls, ['10'])
+
+    def test_key_reused_for_a_different_request_is_rejected(self):
+        self.post('10')
+        self.assertEqual(self.post('99').status_code, 422)
+        self.assertEqual(self.calls, ['10'])
+
+    def test_retry_during_the_first_request_gets_409(self):
+        retries = []
+        # The retry arrives while the view is still running
+        self.during_call = lambda: retries.append(self.post('10'))
+        self.assertEqual(self.post('10').status_code, 201)
+        self.assertEqual(retries[0].status_code, 409)
+        self.assertEqual(retries[0]['Retry-After'], '1')
+
+    def test_abandoned_key_is_taken_over(self):
+        now = timezone.now()
+        IdempotencyKey.objects.create(
+            user=self.customer, key='checkout-1', fingerprint='from a dead worker',
+            created_at=now - idempotency.ABANDONED_AFTER - timedelta(seconds=1), expires_at=now + timedelta(hours=1),
+        )
+        self.assertEqual(self.post('10').status_code, 201)
+        self.assertEqual(self.calls, ['10'])
+
+    def test_keys_are_per_user(self):
+        other = User.objects.create_user('other', password='pw', role='customer')
+        self.post('10')
+        self.assertEqual(self.post('10', user=other).data, {'call': 2})
+        self.assertEqual(self.calls, ['10', '10'])
+
+
+class PrepTimeEstimateTests(TestCase):
+    databases = '__all__'
+
+    def test_p2_estimates_are_close_to_the_exact_quantiles(self):
+        rng = random.Random(7)
+        sample = [rng.lognormvariate(6.5, 0.4) for _ in range(2000)]
+        deciles = statistics.quantiles(sample, n=10)
+        for p, exact in ((0.5, deciles[4]), (0.9, deciles[8])):
+            estimator = eta.P2Quantile(p)
+            for x in sample:
+                estimator.add(x)
+            self.assertAlmostEqual(estimator.value() / exact, 1, delta=0.03)
+
+    def test_fewer_than_five_observations(self):
+        estimators = {p: eta.P2Quantile(p) for p in eta.QUANTILES}
+        self.assertIsNone(estimators[0.5].value())
+        for x in (300, 100, 200):
+            for estimator in estimators.values():
+                estimator.add(x)
+        self.assertEqual((estimators[0.5].value(), estimators[0.9].value()), (200, 300))
+
+    def test_eta_is_on_the_order_and_learns_from_ready_orders(self):
+        restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        customer = User.objects.create_user('customer', password='pw', role='customer')
+        done, waiting = (
+            Order.objects.create(customer=customer, restaurant=restaurant, status='Preparing') for _ in range(2)
+        )
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('subadmin', password='pw', role='sub_admin'))
+        # Nothing to go on yet
+        response = client.get(f'/api/orders/{waiting.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['eta'])
+
+        Order.objects.filter(pk=done.pk).update(created_at=timezone.now() - timedelta(minutes=10))
+        response = client.patch(f'/api/orders/{done.pk}/mark_as_ready_for_pickup/')
+        self.assertEqual(response.status_code, 200, response.data)
+
+        estimate = client.get(f'/api/orders/{waiting.pk}/').data['eta']
+        self.assertEqual((estimate['samples'], estimate['hourly']), (1, False))
+        self.assertAlmostEqual(estimate['p50_minutes'], 10, delta=0.1)
+        self.assertAlmostEqual(estimate['p90_minutes'], 10, delta=0.1)
+        # Ready orders have no ETA
+        self.assertIsNone(client.get(f'/api/orders/{done.pk}/').data['eta'])
+
+
+# The local receiver is on 127.0.0.1
+@override_settings(ORDER_EVENT_SETTLE_SECONDS=0, WEBHOOK_ALLOW_PRIVATE_URLS=True)
+class WebhookDeliveryTests(TestCase):
+    # deliver_due() goes through every shard
+    databases = '__all__'
+
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        self.customer = User.objects.create_user('customer', password='pw', role='customer')
+        self.received = []
+        self.receiver = webhooks.make_receiver('s3cret', on_delivery=self.received.append)
+        thread = threading.Thread(target=self.receiver.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.receiver.server_close)
+        self.addCleanup(self.receiver.shutdown)
+        self.endpoint = WebhookEndpoint.objects.create(
+            restaurant=self.restaurant, secret='s3cret',
+            url=f'http://127.0.0.1:{self.receiver.server_address[1]}/hooks',
+        )
+
+    def place_order(self):
+        return Order.objects.create(customer=self.customer, restaurant=self.restaurant)
+
+    def move(self, order, *statuses):
+        for status in statuses:
+            order.status = status
+            order.save()
+
+    def test_status_changes_are_written_to_the_outbox(self):
+        order = self.place_order()
+        self.move(order, 'Pending Approval', 'Pending Approval', 'Preparing')
+        events = list(OrderEvent.objects.filter(order_id=order.pk).order_by('id'))
+        self.assertEqual(
+            [(e.event_type, e.from_status, e.to_status) for e in events],
+            [('order.created', '', 'Pending Payment'),
+             ('order.status_changed', 'Pending Payment', 'Pending Approval'),
+             ('order.status_changed', 'Pending Approval', 'Preparing')],
+        )
+
+    def test_batches_are_signed_coalesced_and_acknowledged(self):
+        first, second = self.place_order(), self.place_order()
+        self.move(first, 'Pending Approval', 'Preparing', 'Ready for Pickup')
+        self.move(second, 'Pending Approval')
+
+        # Four changes (creations in Pending Payment aren't sent), one POST, one event per order
+        self.assertEqual(webhooks.deliver_due(), (4, 0))
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(len(self.received[0]['events']), 2)
+        orders = {event['order']['id']: event['order'] for event in self.received[0]['events']}
+        self.assertEqual(orders[first.pk]['previous_status'], 'Pending Payment')
+        self.assertEqual(orders[first.pk]['status'], 'Ready for Pickup')
+        self.assertEqual(orders[second.pk]['status'], 'Pending Approval')
+
+        self.endpoint.refresh_from_db()
+        self.assertEqual(self.endpoint.last_event_id, OrderEvent.objects.latest('id').pk)
+        # Nothing new, nothing sent
+        self.assertEqual(webhooks.deliver_due(), (0, 0))
+        self.assertEqual(len(self.received), 1)
+
+    def test_failed_delivery_backs_off_and_is_retried(self):
+        self.move(self.place_order(), 'Pending Approval')
+        self.receiver.status = 503
+        self.assertEqual(webhooks.deliver_due(), (0, 1))
+        self.endpoint.refresh_from_db()
+        self.assertEqual(self.endpoint.failure_count, 1)
+        self.assertGreater(self.endpoint.next_attempt_at, timezone.now())
+        self.assertEqual(self.endpoint.last_event_id, 0)
+        # Not due yet
+        self.assertEqual(webhooks.deliver_due(), (0, 0))
+
+        self.receiver.status = 200
+        WebhookEndpoint.objects.filter(pk=self.endpoint.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(webhooks.deliver_due(), (1, 0))
+        self.endpoint.refresh_from_db()
+        self.assertEqual(self.endpoint.failure_count, 0)
+
+    def test_wrong_secret_is_rejected_by_the_receiver(self):
+        self.move(self.place_order(), 'Pending Approval')
+        WebhookEndpoint.objects.filter(pk=self.endpoint.pk).update(secret='wrong')
+        self.assertEqual(webhooks.deliver_due(), (0, 1))
+        self.assertEqual(self.received, [])
+
+    def test_feed_limit_is_at_least_one(self):
+        self.move(self.place_order(), 'Pending Approval')
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('subadmin', password='pw', role='sub_admin'))
+        response = client.get('/api/order-events/', {'limit': -5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['events']), 1)
+        self.assertTrue(response.data['has_more'])
+        response = client.get('/api/order-events/', {'limit': -5, 'since': response.data['next_since']})
+        self.assertEqual((len(response.data['events']), response.data['has_more']), (1, False))
+
+    def test_private_addresses_are_not_called(self):
+        self.move(self.place_order(), 'Pending Approval')
+        with override_settings(WEBHOOK_ALLOW_PRIVATE_URLS=False):
+            self.assertEqual(webhooks.deliver_due(), (0, 1))
+        self.assertEqual(self.received, [])
+        self.endpoint.refresh_from_db()
+        self.assertEqual(self.endpoint.last_error, 'Webhook URLs must be https URLs')
+
+
+class WebhookURLTests(SimpleTestCase):
+    def test_only_https_urls_of_public_addresses_are_accepted(self):
+        for url in (
+            'http://93.184.216.34/hooks', 'https://127.0.0.1/hooks', 'https://localhost:8000/',
+            'https://169.254.169.254/latest/meta-data/', 'https://10.0.0.5/', 'https://192.168.1.1/',
+            'https://[::1]/', 'https://[::ffff:127.0.0.1]/', 'https://100.64.0.1/', 'ftp://example.com/',
+        ):
+            with self.assertRaises(webhooks.UnsafeURL, msg=url):
+                webhooks.check_url(url)
+        webhooks.check_url('https://93.184.216.34/hooks')
+
+    def test_endpoints_with_unsafe_urls_are_refused(self):
+        serializer = WebhookEndpointSerializer(data={'url': 'https://169.254.169.254/'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('url', serializer.errors)
+
+
+class TunedSQLiteTests(SimpleTestCase):
+    def test_connections_use_wal_and_begin_immediate(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        wrapper = sqlite3_backend.DatabaseWrapper({
+            **connections['default'].settings_dict,
+            'ENGINE': 'api.backends.sqlite3', 'NAME': os.path.join(directory.name, 'smoke.sqlite3'), 'OPTIONS': {},
+        }, alias='sqlite_smoke')
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+        wrapper.force_debug_cursor = True
+        wrapper.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        self.assertEqual(wrapper.queries_log[-1]['sql'], 'BEGIN IMMEDIATE')
+        wrapper.rollback()
+        wrapper.set_autocommit(True)
+
+
+class ColdStartTests(SimpleTestCase):
+    def test_cold_start_is_within_budget(self):
+        for api_only in (False, True):
+            result = startup.measure('/api/', api_only=api_only, runs=3)
+            self.assertEqual(result['status'], 200)
+            self.assertLess(result['total'], settings.COLD_START_BUDGET_MS, result)
+            # Each would add tens of milliseconds to every cold start
+            self.assertEqual(result['heavy_modules'], [])
+
+    def test_api_only_keeps_the_admin_log(self):
+        # Deleting a user cascades to admin.LogEntry, which needs the admin app
+        script = (
+            'import sys, django; django.setup(); from api.models import User; '
+            'print(sorted(r.related_model._meta.label for r in User._meta.related_objects), "api.admin" in sys.modules)'
+        )
+        process = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            env={**os.environ, 'API_ONLY': 'True', 'DJANGO_SETTINGS_MODULE': 'food_ordering_backend.settings'},
+        )
+        self.assertIn("'admin.LogEntry'", process.stdout)
+        self.assertTrue(process.stdout.strip().endswith('False'), process.stdout)
+
+
+class DashboardCounterTests(TestCase):
+    def setUp(self):
+        # Both on 'default', where counters.read() looks by default
+        self.restaurant = Restaurant.objects.create(name='Test Kitchen', shard='default')
+        self.other = Restaurant.objects.create(name='Other Kitchen', shard='default')
+        self.customer = User.objects.create_user('customer', password='pw', role='customer')
+
+    def place_order(self, restaurant):
+        return Order.objects.create(customer=self.customer, restaurant=restaurant)
+
+    def test_status_changes_move_the_counts(self):
+        order = self.place_order(self.restaurant)
+        self.place_order(self.other)
+        for status in ('Pending Approval', 'Preparing'):
+            order.status = status
+            order.save()
+
+        self.assertEqual(counters.read(self.restaurant.pk)['preparing'], 1)
+        self.assertEqual(counters.read(self.restaurant.pk)['pending_payment'], 0)
+        totals = counters.read()
+        self.assertEqual((totals['pending_payment'], totals['pending_approval'], totals['preparing']), (1, 0, 1))
+
+        # Finished and deleted orders are no longer counted
+        order.status = 'Completed'
+        order.save()
+        Order.objects.get(restaurant=self.other).delete()
+        self.assertEqual(sum(counters.read().values()), 0)
+
+    def test_open_conversations_are_counted(self):
+        conversation = Conversation.objects.create(customer=self.customer)
+        Conversation.objects.create(customer=self.customer)
+        self.assertEqual(counters.read()['open_conversations'], 2)
+        conversation.is_open = False
+        conversation.save()
+        self.assertEqual(counters.read()['open_conversations'], 1)
+
+    def test_reconcile_corrects_drift(self):
+        order = self.place_order(self.restaurant)
+        # Behind the model's back, so the counters don't see it
+        Order.objects.filter(pk=order.pk).update(status='Preparing')
+
+        corrections = counters.reconcile()
+        self.assertIn((self.restaurant.pk, 'pending_payment', 1, 0), corrections)
+        self.assertIn((None, 'preparing', 0, 1), corrections)
+        self.assertEqual(counters.read(self.restaurant.pk)['preparing'], 1)
+        self.assertEqual(counters.reconcile(), [])
+
+
+class ApprovalQueueTests(TestCase):
+    def setUp(self):
+        restaurant = Restaurant.objects.create(name='Test Kitchen')
+        customer = User.objects.create_user('customer', password='pw', role='customer')
+        self.orders = [
+            Order.objects.create(customer=customer, restaurant=restaurant, status='Pending Approval') for _ in range(5)
+        ]
+        self.first = User.objects.create_user('subadmin1', password='pw', role='sub_admin')
+        self.second = User.objects.create_user('subadmin2', password='pw', role='sub_admin')
+
+    def test_sub_admins_get_disjoint_batches(self):
+        first, _ = approval_queue.claim(self.first, 3)
+        second, _ = approval_queue.claim(self.second, 3)
+        self.assertEqual([order.pk for order in first], [order.pk for order in self.orders[:3]])
+        self.assertEqual([order.pk for order in second], [order.pk for order in self.orders[3:]])
+        # Claiming again renews the claimer's own orders
+        again, _ = approval_queue.claim(self.first, 3)
+        self.assertEqual([order.pk for order in again], [order.pk for order in first])
+
+    def test_expired_claims_go_back_to_the_queue(self):
+        approval_queue.claim(self.first, 5)
+        Order.objects.update(claim_expires_at=timezone.now() - timedelta(seconds=1))
+        claimed, _ = approval_queue.claim(self.second, 2)
+        self.assertEqual([order.pk for order in claimed], [order.pk for order in self.orders[:2]])
+        self.assertTrue(approval_queue.hold(claimed[0], self.second))
+        self.assertFalse(approval_queue.hold(claimed[0], self.first))
+
+    def test_release(self):
+        claimed, _ = approval_queue.claim(self.first, 1)
+        self.assertFalse(approval_queue.release(claimed[0], self.second))
+        self.assertTrue(approval_queue.release(claimed[0], self.first))
+        claimed, _ = approval_queue.claim(self.second, 1)
+        self.assertEqual(claimed[0].pk, self.orders[0].pk)
+
+    def test_only_the_claimer_can_review_a_claimed_order(self):
+        # Read before the first sub-admin claimed it, as by a request racing the claim
+        stale = Order.objects.get(pk=self.orders[0].pk)
+        approval_queue.claim(self.first, 1)
+        client = APIClient()
+        client.force_authenticate(self.second)
+        with mock.patch.object(OrderViewSet, 'get_object', return_value=stale):
+            response = client.patch(f'/api/orders/{stale.pk}/', {'status': 'Preparing'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.get(pk=stale.pk).status, 'Pending Approval')
+
+        client.force_authenticate(self.first)
+        response = client.patch(f'/api/orders/{stale.pk}/', {'status': 'Preparing'})
+        self.assertEqual(response.status_code, 200, response.data)
+        order = Order.objects.get(pk=stale.pk)
+        self.assertEqual((order.status, order.claimed_by_id), ('Preparing', None))
+
+
+class LunchRushReportTests(SimpleTestCase):
+    def test_event_histories_are_checked(self):
+        problems = lunch_rush.check_events({
+            1: [('', 'Pending Payment'), ('Pending Payment', 'Pending Approval'), ('Pending Approval', 'Preparing')],
+            # Two sub-admins approved the same order
+            2: [('', 'Pending Payment'), ('Pending Payment', 'Pending Approval'),
+                ('Pending Approval', 'Preparing'), ('Pending Approval', 'Preparing')],
+            3: [('', 'Pending Payment'), ('Pending Payment', 'Delivered')],
+        })
+        self.assertEqual(problems, {'lost update': 1, 'illegal Pending Payment -> Delivered': 1})
+
+    def test_server_errors_are_split_by_phase_and_cause(self):
+        log = (
+            'Internal Server Error: /api/orders/7/mark_as_delivered/\n'
+            'Traceback (most recent call last):\n'
+            'django.db.utils.OperationalError: database is locked\n'
+            'Internal Server Error: /api/orders/\n'
+            'Traceback (most recent call last):\n'
+            "KeyError: 'items'\n"
+        )
+        errors = lunch_rush.parse_server_errors(log)
+        self.assertEqual(errors['mark_delivered'], {'lock': 1})
+        self.assertEqual(errors['place_order'], {'other': 1})
+
+@unittest.skipUnless(len(settings.DATABASE_SHARDS) > 2, 'needs DATABASE_SHARDS with two shards besides default')
+class ShardingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.delete(sharding.MAP_KEY)
+        self.first, self.second = settings.DATABASE_SHARDS[1:3]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer = User.objects.create_user('customer', password='pw', role='customer')
+            self.restaurant = Restaurant.objects.create(name='First Kitchen', shard=self.first)
+            self.other = Restaurant.objects.create(name='Second Kitchen', shard=self.second)
+
+    def place_order(self, restaurant):
+        with sharding.using_shard(sharding.instance_shard(restaurant)):
+            return Order.objects.create(customer=self.customer, restaurant=restaurant)
+
+    def test_users_and_restaurants_are_mirrored(self):
+        for alias in settings.DATABASE_SHARDS:
+            self.assertTrue(User.objects.using(alias).filter(pk=self.customer.pk).exists())
+            self.assertEqual(Restaurant.objects.using(alias).get(pk=self.restaurant.pk).shard, self.first)
+
+    def test_rows_are_written_to_their_restaurants_shard(self):
+        item = MenuItem.objects.create(restaurant=self.restaurant, name='Tibs', price=100)
+        order = self.place_order(self.other)
+        self.assertEqual(item._state.db, self.first)
+        self.assertEqual(order._state.db, self.second)
+        self.assertFalse(MenuItem.objects.using('default').filter(pk=item.pk).exists())
+        # The order's event is on the order's shard, in its id range
+        self.assertTrue(OrderEvent.objects.using(self.second).filter(order_id=order.pk).exists())
+        self.assertGreaterEqual(order.pk, settings.DATABASE_SHARDS.index(self.second) * sharding.SHARD_ID_RANGE)
+
+    def test_claims_take_the_oldest_orders_of_every_shard(self):
+        # The first shard has the bigger backlog, but the second's orders are as old
+        start = timezone.now() - timedelta(hours=1)
+        orders = []
+        for minutes, restaurant in enumerate([self.other, self.restaurant, self.other] + [self.restaurant] * 2):
+            order = self.place_order(restaurant)
+            Order.objects.using(order._state.db).filter(pk=order.pk).update(
+                status='Pending Approval', created_at=start + timedelta(minutes=minutes)
+            )
+            orders.append(order)
+        # Mirrored to the shards on commit, as claimed_by points at them there
+        with self.captureOnCommitCallbacks(execute=True):
+            first, second = (
+                User.objects.create_user(name, password='pw', role='sub_admin') for name in ('subadmin1', 'subadmin2')
+            )
+        claimed, _ = approval_queue.claim(first, 3, aliases=sharding.shards())
+        self.assertEqual([order.pk for order in claimed], [order.pk for order in orders[:3]])
+        claimed, _ = approval_queue.claim(second, 3, aliases=sharding.shards())
+        self.assertEqual([order.pk for order in claimed], [order.pk for order in orders[3:]])
+
+    def test_manager_writes_go_to_their_restaurants_shard(self):
+        item, _ = MenuItem.objects.get_or_create(restaurant=self.restaurant, name='Shiro', defaults={'price': 80})
+        self.assertEqual(item._state.db, self.first)
+        self.assertEqual(MenuItem.objects.get_or_create(restaurant=self.restaurant, name='Shiro')[1], False)
+        MenuItem.objects.bulk_create([
+            MenuItem(restaurant=self.restaurant, name='Tibs', price=100),
+            MenuItem(restaurant=self.other, name='Kitfo', price=150),
+        ])
+        self.assertEqual(MenuItem.objects.using(self.first).count(), 2)
+        self.assertEqual(MenuItem.objects.using(self.second).count(), 1)
+        self.assertFalse(MenuItem.objects.using('default').exists())
+
+    def test_fan_out_merges_in_queryset_ordering(self):
+        orders = [self.place_order(restaurant) for restaurant in (self.restaurant, self.other, self.restaurant)]
+        merged = sharding.fan_out(Order.objects.order_by('-created_at'))
+        self.assertEqual([order.pk for order in merged], [order.pk for order in reversed(orders)])
+        self.assertEqual(len(sharding.fan_out(Order.objects.order_by('-created_at'), limit=2)), 2)
+
+    def test_move_keeps_ids_and_updates_the_map(self):
+        item = MenuItem.objects.create(restaurant=self.restaurant, name='Tibs', price=100)
+        order = self.place_order(self.restaurant)
+        moved = sharding.move_restaurant(self.restaurant, self.second)
+
+        self.assertEqual(moved['api.MenuItem'], 1)
+        self.assertEqual(moved['api.Order'], 1)
+        self.assertEqual(sharding.shard_for(self.restaurant.pk), self.second)
+        self.assertTrue(MenuItem.objects.using(self.second).filter(pk=item.pk).exists())
+        self.assertTrue(Order.objects.using(self.second).filter(pk=order.pk).exists())
+        self.assertFalse(Order.objects.using(self.first).filter(restaurant=self.restaurant).exists())
+        self.assertEqual(sharding.locate(order.pk, Order), self.second)
+
+    @override_settings(ORDER_EVENT_SETTLE_SECONDS=0, WEBHOOK_ALLOW_PRIVATE_URLS=True)
+    def test_webhooks_are_delivered_from_every_shard(self):
+        received = []
+        receiver = webhooks.make_receiver('s3cret', on_delivery=received.append)
+        threading.Thread(target=receiver.serve_forever, daemon=True).start()
+        self.addCleanup(receiver.server_close)
+        self.addCleanup(receiver.shutdown)
+        endpoint = WebhookEndpoint.objects.create(
+            restaurant=self.other, secret='s3cret', url=f'http://127.0.0.1:{receiver.server_address[1]}/hooks',
+        )
+        self.assertEqual(endpoint._state.db, self.second)
+        order = self.place_order(self.other)
+        order.status = 'Pending Approval'
+        order.save()
+
+        self.assertEqual(webhooks.deliver_due(), (1, 0))
+        self.assertEqual([event['order']['id'] for event in received[0]['events']], [order.pk])
+        endpoint.refresh_from_db()
+        self.assertEqual(endpoint.last_event_id, OrderEvent.objects.using(self.second).latest('id').pk)
+
+    def test_move_to_an_unknown_shard_is_rejected(self):
+        with self.assertRaises(sharding.ShardingError):
+            sharding.move_restaurant(self.restaurant, 'nowhere')
@@ -0,0 +1,250 @@
+"""
+Request throttling and load shedding.
+
+RoleScopedThrottle gives every client a token bucket per endpoint class
+(the view's `throttle_scope`: catalogue, orders, chat, or api by default). The
+bucket size and refill rate depend on the client's role, see THROTTLE_RATES in
+settings. Buckets live in the default cache, so they are per process with the
+local memory cache and shared between workers with Redis. With Redis a bucket
+is read and updated by one Lua script, so workers can't both spend the same
+token; with the local memory cache a lock does the same within the process.
+The file cache has neither and may let a few extra requests through.
+Users are told apart by id and guests by IP address (set NUM_PROXIES in
+REST_FRAMEWORK to the number of proxies in front of the app).
+The async endpoints (api/async_views.py) aren't DRF views and call throttle().
+
+ConcurrencyLimitMiddleware answers 503 with Retry-After once a process is
+already serving MAX_CONCURRENT_REQUESTS requests, so a burst is turned away
+quickly instead of queueing until every worker is stuck. That only helps
+workers with threads or an event loop: a sync gunicorn worker serves one
+request at a time. MAX_CONCURRENT_REQUESTS_ALL_WORKERS limits the requests in
+flight across every worker sharing the cache, which covers sync workers too.
+"""
+import math
+import threading
+import time
+from types import SimpleNamespace
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.http import JsonResponse
+from rest_framework.throttling import BaseThrottle
+
+from .context import get_user_context
+
+DEFAULT_SCOPE = 'api'
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'120/min' -> (120, 60). None means no limit."""
+    if rate is None:
+        return None
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def role_of(request):
+    context = get_user_context(request)
+    if not context.is_authenticated:
+        return 'guest'
+    if context.is_sub_admin:
+        return 'sub_admin'
+    return context.role
+
+
+class RoleScopedThrottle(BaseThrottle):
+    """Token bucket per (scope, client), sized by the client's role"""
+    cache_format = 'throttle:{scope}:{ident}'
+    # Serializes the read-modify-write of a bucket within this process
+    lock = threading.Lock()
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_rate(self, request, view):
+        scope = getattr(view, 'throttle_scope', None) or DEFAULT_SCOPE
+        rates = settings.THROTTLE_RATES.get(scope) or settings.THROTTLE_RATES[DEFAULT_SCOPE]
+        return scope, parse_rate(rates.get(role_of(request)))
+
+    def allow_request(self, request, view):
+        scope, rate = self.get_rate(request, view)
+        if rate is None:
+            return True
+        capacity, period = rate
+        refill_per_second = capacity / period
+
+        ident = f'user:{request.user.pk}' if request.user.is_authenticated else f'ip:{self.get_ident(request)}'
+        key = self.cache_format.format(scope=scope, ident=ident)
+        # Wall clock time, so workers sharing the cache agree on it
+        now = time.time()
+
+        # Once the bucket would be full again the entry can go
+        timeout = int(period) + 1
+        if isinstance(caches['default'], RedisCache):
+            allowed, tokens = take_token_redis(key, capacity, refill_per_second, now, timeout)
+        else:
+            allowed, tokens = self.take_token(key, capacity, refill_per_second, now, timeout)
+        if not allowed:
+            self.wait_seconds = (1 - tokens) / refill_per_second
+        return allowed
+
+    def take_token(self, key, capacity, refill_per_second, now, timeout):
+        with self.lock:
+            tokens, updated_at = cache.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0, now - updated_at) * refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            cache.set(key, (tokens, now), timeout=timeout)
+        return allowed, tokens
+
+    def wait(self):
+        return self.wait_seconds
+
+
+# The same bucket update as take_token(), run atomically by Redis
+TAKE_TOKEN_SCRIPT = """
+local capacity, refill, now, timeout = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * refill)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], timeout)
+return {allowed, tostring(tokens)}
+"""
+
+
+def take_token_redis(key, capacity, refill_per_second, now, timeout):
+    redis_key = cache.make_and_validate_key(key)
+    client = cache._cache.get_client(redis_key, write=True)
+    allowed, tokens = client.register_script(TAKE_TOKEN_SCRIPT)(
+        keys=[redis_key], args=[capacity, refill_per_second, now, timeout]
+    )
+    return bool(allowed), float(tokens)
+
+
+async def throttle(request, user, scope):
+    """
+    RoleScopedThrottle for the plain Django views in api/async_views.py: the
+    429 response to send if `user` (None for guests) is over the rate of
+    `scope`, otherwise None.
+    """
+    request.user = user if user is not None else AnonymousUser()
+    throttle = RoleScopedThrottle()
+    # The Redis call is network I/O; don't queue it behind the main thread's work
+    if await sync_to_async(throttle.allow_request, thread_sensitive=False)(request, SimpleNamespace(throttle_scope=scope)):
+        return None
+    wait = math.ceil(throttle.wait())
+    response = JsonResponse({'detail': f'Request was throttled. Expected available in {wait} seconds.'}, status=429)
+    response['Retry-After'] = str(wait)
+    return response
+
+
+# Requests in flight across workers are counted per slot of this many seconds,
+# and only the current and previous slots are read. A request whose worker was
+# killed before it could decrement the count (e.g. by gunicorn's 30s timeout)
+# stops counting at most two slots later.
+IN_FLIGHT_SLOT_SECONDS = 60
+
+
+class ConcurrencyLimitMiddleware:
+    """Shed load with 503 + Retry-After when too many requests are in flight"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limit = settings.MAX_CONCURRENT_REQUESTS
+        self.shared_limit = settings.MAX_CONCURRENT_REQUESTS_ALL_WORKERS
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enter():
+            return self.busy()
+        try:
+            slot = self.enter_shared()
+            if slot is False:
+                return self.busy()
+            try:
+                return self.get_response(request)
+            finally:
+                self.leave_shared(slot)
+        finally:
+            self.leave()
+
+    async def __acall__(self, request):
+        if not self.enter():
+            return self.busy()
+        try:
+            slot = await sync_to_async(self.enter_shared, thread_sensitive=False)() if self.shared_limit else None
+            if slot is False:
+                return self.busy()
+            try:
+                return await self.get_response(request)
+            finally:
+                if slot is not None:
+                    await sync_to_async(self.leave_shared, thread_sensitive=False)(slot)
+        finally:
+            self.leave()
+
+    def enter(self):
+        if not self.limit:
+            return True
+        with self.lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        if self.limit:
+            with self.lock:
+                self.in_flight -= 1
+
+    def enter_shared(self):
+        """
+        Count the request in the cache. Returns the key it was counted under
+        (None without a limit), or False if all workers together are full.
+        """
+        if not self.shared_limit:
+            return None
+        slot = int(time.time() // IN_FLIGHT_SLOT_SECONDS)
+        key = f'in_flight:{slot}'
+        cache.add(key, 0, timeout=IN_FLIGHT_SLOT_SECONDS * 2 + 1)
+        try:
+            in_flight = cache.incr(key) + (cache.get(f'in_flight:{slot - 1}') or 0)
+        except ValueError:
+            # The slot expired in between
+            return None
+        if in_flight > self.shared_limit:
+            self.leave_shared(key)
+            return False
+        return key
+
+    def leave_shared(self, key):
+        if key is None:
+            return
+        try:
+            cache.decr(key)
+        except ValueError:
+            pass
+
+    def busy(self):
+        response = JsonResponse({'error': 'Server is busy, please try again shortly'}, status=503)
+        response['Retry-After'] = str(settings.LOAD_SHED_RETRY_AFTER)
+        return response
@@ -0,0 +1,223 @@
+"""
+Resumable payment-proof uploads.
+
+A phone on a slow network uploads the proof in chunks instead of one multipart
+request:
+
+  POST /api/payment-proof-uploads/        {order, filename, size} -> session id
+  PUT  /api/payment-proof-uploads/<id>/   raw bytes, Upload-Offset: <received>
+  GET  /api/payment-proof-uploads/<id>/   -> received, status
+
+Each chunk is copied from the request stream to a temporary file in small
+blocks, so memory stays bounded whatever the size. After a dropped connection
+the client asks for `received` and carries on from there.
+
+When the last byte arrives the image is checked, EXIF data (GPS position
+included) stripped and the image downscaled in a background thread pool, and
+only then is it attached to the order, which moves to Pending Approval. If that
+fails the session's status is `failed` and its `error` says why.
+`manage.py cleanup_upload_sessions` retries processing interrupted by a restart
+and removes abandoned uploads.
+"""
+import contextvars
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, router, transaction
+from django.utils import timezone
+
+from .models import Order, UploadSession
+
+logger = logging.getLogger(__name__)
+
+# Bytes copied from the request to the file at a time
+BLOCK_SIZE = 64 * 1024
+# Decoding a bigger image would take more memory than the upload size suggests
+MAX_PIXELS = 40_000_000
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+# --- Receiving ---
+def temp_path(session):
+    return os.path.join(settings.UPLOAD_SESSION_DIR, f'{session.pk}.part')
+
+
+def start(session):
+    """Create the empty temporary file of a new session"""
+    os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+    open(temp_path(session), 'wb').close()
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Append `length` bytes read from `stream` at `offset`, which must be what the
+    session has received so far. Returns the new offset.
+    """
+    if session.status != UploadSession.Status.RECEIVING:
+        raise UploadError('This upload is already complete', status=409, offset=session.received)
+    if offset != session.received:
+        raise UploadError('Upload-Offset does not match the bytes received', status=409, offset=session.received)
+    if length > settings.UPLOAD_CHUNK_MAX_BYTES:
+        raise UploadError(f'A chunk can be at most {settings.UPLOAD_CHUNK_MAX_BYTES} bytes', status=413)
+    if offset + length > session.size:
+        raise UploadError('The chunk goes past the declared size', status=413)
+
+    written = 0
+    with open(temp_path(session), 'r+b') as part:
+        part.seek(offset)
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            part.write(block)
+            written += len(block)
+        # Whatever a dropped connection left after the last full block is not kept
+        part.truncate(offset + written)
+
+    # Only advances if no other request moved the offset meanwhile
+    if not UploadSession.objects.filter(
+        pk=session.pk, status=UploadSession.Status.RECEIVING, received=offset
+    ).update(received=offset + written):
+        session.refresh_from_db()
+        raise UploadError('Upload-Offset does not match the bytes received', status=409, offset=session.received)
+    session.received = offset + written
+
+    if session.received == session.size and UploadSession.objects.filter(
+        pk=session.pk, status=UploadSession.Status.RECEIVING
+    ).update(status=UploadSession.Status.PROCESSING):
+        session.status = UploadSession.Status.PROCESSING
+        transaction.on_commit(lambda: submit(session.pk), using=session._state.db)
+    return session.received
+
+
+# --- Processing ---
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=settings.UPLOAD_PROCESSING_WORKERS, thread_name_prefix='upload'
+                )
+    return _pool
+
+
+def submit(session_id):
+    if settings.UPLOAD_PROCESSING_IN_BACKGROUND:
+        # In a copy of this context, so the worker uses the same database shard
+        get_pool().submit(contextvars.copy_context().run, _process_in_thread, session_id)
+    else:
+        process(session_id)
+
+
+def _process_in_thread(session_id):
+    try:
+        process(session_id)
+    except Exception:
+        logger.exception('Could not process upload %s', session_id)
+    finally:
+        close_old_connections()
+
+
+def clean_image(path):
+    """
+    Check an uploaded image and return (bytes, extension) of a copy without EXIF
+    data, turned upright and no larger than PAYMENT_PROOF_MAX_SIDE.
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as image:
+            image.verify()
+        with Image.open(path) as image:
+            if image.format not in FORMATS:
+                raise UploadError('Upload a JPEG, PNG or WebP image')
+            if image.width * image.height > MAX_PIXELS:
+                raise UploadError('The image is too large')
+            image_format = image.format
+            upright = ImageOps.exif_transpose(image)
+            upright.thumbnail((settings.PAYMENT_PROOF_MAX_SIDE, settings.PAYMENT_PROOF_MAX_SIDE))
+            if image_format == 'JPEG' and upright.mode not in ('RGB', 'L'):
+                upright = upright.convert('RGB')
+            # Saving without exif= drops the metadata
+            output = io.BytesIO()
+            upright.save(output, format=image_format, quality=85)
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise UploadError('The file is not a valid image')
+    return output.getvalue(), FORMATS[image_format]
+
+
+def process(session_id):
+    """Clean a completely received upload and attach it to its order"""
+    session = UploadSession.objects.filter(pk=session_id, status=UploadSession.Status.PROCESSING).first()
+    if session is None:
+        return
+    path = temp_path(session)
+    try:
+        data, extension = clean_image(path)
+        _attach(session, data, extension)
+    except UploadError as exc:
+        _fail(session, str(exc))
+    except Exception:
+        # Recorded on the session too, or the client would poll `processing` forever
+        logger.exception('Could not process upload %s', session_id)
+        _fail(session, 'The image could not be processed')
+    _remove(path)
+
+
+def _attach(session, data, extension):
+    name = default_storage.save(f'payment_proofs/{session.order_id}-{session.pk.hex[:8]}.{extension}', ContentFile(data))
+    db = router.db_for_write(Order, instance=session)
+    try:
+        with transaction.atomic(using=db):
+            order = Order.objects.db_manager(db).select_for_update().filter(pk=session.order_id).first()
+            if order is None:
+                raise UploadError('The order no longer exists')
+            order.payment_proof = name
+            fields = ['payment_proof']
+            if order.status == 'Pending Payment':
+                order.status = 'Pending Approval'
+                fields.append('status')
+            order.save(update_fields=fields)
+            session.status = UploadSession.Status.DONE
+            session.save(update_fields=['status', 'updated_at'])
+    except BaseException:
+        # Nothing refers to the stored image
+        default_storage.delete(name)
+        raise
+
+
+def _fail(session, error):
+    session.status, session.error = UploadSession.Status.FAILED, error[:255]
+    # Not save(): the session is gone if its order was deleted
+    UploadSession.objects.using(session._state.db).filter(pk=session.pk).update(
+        status=session.status, error=session.error, updated_at=timezone.now()
+    )
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_temp_file(session):
+    _remove(temp_path(session))
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, async_views
 
 router = DefaultRouter()
 router.register(r'users', views.UserViewSet)
@@ -12,9 +12,20 @@ router.register(r'payment-accounts', views.PaymentAccountViewSet)
 router.register(r'conversations', views.ConversationViewSet)
 router.register(r'chat-messages', views.ChatMessageViewSet)
 router.register(r'ratings', views.RatingViewSet)
+router.register(r'payment-proof-uploads', views.PaymentProofUploadViewSet, basename='payment-proof-upload')
+router.register(r'webhook-endpoints', views.WebhookEndpointViewSet, basename='webhook-endpoint')
 
 # The 'profile' path has been removed from here and moved to the main urls.py
 urlpatterns = [
+    # Async read endpoints, see api/async_views.py
+    path('async/menu-items/', async_views.menu_items, name='async-menu-items'),
+    path('async/orders/<int:pk>/status/', async_views.order_status, name='async-order-status'),
+    path('async/chat-messages/', async_views.chat_messages, name='async-chat-messages'),
+
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('cache-stats/', views.CacheStatsView.as_view(), name='cache-stats'),
+    path('order-events/', views.OrderEventFeedView.as_view(), name='order-events'),
+    path('dashboard-counters/', views.DashboardCountersView.as_view(), name='dashboard-counters'),
     path('', include(router.urls)),
 ]
 
@@ -1,18 +1,45 @@
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend 
 
+import hashlib
+import json
+import secrets
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.utils.http import parse_etags, quote_etag
+
+from . import approval_queue, counters, eta, menu_import, recommendations, search, sharding, uploads, webhooks
+from .activity import log_activity
+from .cache import cache_responses, stats as cache_stats
+from .context import get_user_context
+from .filters import (
+    MenuItemFilter, AddonFilter, OrderFilter, ArchivedOrderFilter, RatingFilter,
+    MENU_ITEM_ORDERING, ADDON_ORDERING, ORDER_ORDERING, RATING_ORDERING
+)
+from .idempotency import idempotent
+from .routers import ReplicaReadMixin
+from .sharding import ShardRoutingMixin
+
 from .models import (
     User, Restaurant, MenuItem, Order, Addon, PaymentAccount, 
-    Conversation, ChatMessage, ActivityLog, Rating
+    Conversation, ChatMessage, ActivityLog, Rating, ArchivedOrder, UploadSession, WebhookEndpoint
 )
 from .serializers import (
     UserSerializer, UserProfileSerializer, RestaurantSerializer, MenuItemSerializer, 
     OrderListSerializer, OrderDetailSerializer, AddonSerializer, PaymentAccountSerializer, 
-    ConversationSerializer, ChatMessageSerializer, ActivityLogSerializer, RatingSerializer
+    ConversationSerializer, ChatMessageSerializer, ActivityLogSerializer, RatingSerializer,
+    BulkRatingSerializer, ArchivedOrderListSerializer, ArchivedOrderDetailSerializer, UploadSessionSerializer,
+    WebhookEndpointSerializer
 )
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -31,20 +58,108 @@ class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        serializer = UserProfileSerializer(request.user)
-        return Response(serializer.data)
+        # The user and restaurant were loaded in one query during authentication
+        data = UserProfileSerializer(get_user_context(request).user).data
+
+        # Login pages keep the profile and send the ETag back; an unchanged profile is a 304
+        etag = quote_etag(hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest())
+        # If-None-Match compares weakly: a proxy that compressed the response may have sent W/"..."
+        if etag in [tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))]:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        response['Vary'] = 'Authorization'
+        return response
+
+# --- Cache Stats View ---
+class CacheStatsView(APIView):
+    """Hit/miss counters of the cached endpoints (this worker only)"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if not get_user_context(request).is_sub_admin:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        return Response(cache_stats.snapshot())
+
+# --- Dashboard Counters View ---
+class DashboardCountersView(APIView):
+    """
+    Open orders per status and open conversations (api/counters.py): of all
+    restaurants or ?restaurant= for sub-admins, of their own restaurant for
+    restaurant admins.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'orders'
+
+    def get(self, request):
+        context = get_user_context(request)
+        if context.is_sub_admin:
+            restaurant_id = request.query_params.get('restaurant')
+            if not restaurant_id:
+                return Response(counters.read(aliases=sharding.shards()))
+            if not restaurant_id.isdigit():
+                return Response({'error': 'restaurant must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+            names = list(counters.ORDER_COUNTERS.values())
+        elif context.is_restaurant_admin and context.restaurant_id:
+            restaurant_id, names = context.restaurant_id, counters.RESTAURANT_ADMIN_COUNTERS
+        else:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        alias = sharding.shard_for(restaurant_id)
+        if alias is None:
+            raise Http404
+        return Response(counters.read(int(restaurant_id), aliases=[alias], names=names))
+
+# --- Search View ---
+class SearchView(APIView):
+    """Full-text search over menu items, addons and restaurants"""
+    throttle_scope = 'catalogue'
+    permission_classes = [AllowAny]
+    MAX_LIMIT = 50
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        restaurant_id = request.query_params.get('restaurant')
+        kinds = [kind for kind in request.query_params.get('kind', '').split(',') if kind]
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 20)), self.MAX_LIMIT))
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        # Goes into the SQL as a bigint
+        if restaurant_id and not (restaurant_id.isascii() and restaurant_id.isdigit()):
+            return Response({'error': 'restaurant must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        entries, corrected = search.search(query, restaurant_id=restaurant_id, kinds=kinds, limit=limit)
+        results = [
+            {
+                'kind': entry.kind,
+                'id': entry.object_id,
+                'name': entry.title,
+                'restaurant': entry.restaurant_id,
+                'restaurant_name': entry.restaurant_name,
+                'price': str(entry.price) if entry.price is not None else None,
+                'image': request.build_absolute_uri(default_storage.url(entry.image)) if entry.image else None,
+                'average_rating': entry.average_rating,
+                'score': round(entry.relevance, 4),
+            }
+            for entry in entries
+        ]
+        return Response({'query': query, 'corrected': corrected, 'results': results})
 
 # --- Chat ViewSets ---
 class ConversationViewSet(viewsets.ModelViewSet):
+    throttle_scope = 'chat'
     queryset = Conversation.objects.all().order_by('-created_at')
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == 'customer':
-            return self.queryset.filter(customer=user)
-        elif user.role in ['sub_admin', 'restaurant_admin'] or user.is_superuser:
+        context = get_user_context(self.request)
+        if context.is_customer:
+            return self.queryset.filter(customer=context.user)
+        elif context.is_sub_admin or context.is_restaurant_admin:
             return self.queryset
         return Conversation.objects.none()
 
@@ -52,6 +167,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
         serializer.save(customer=self.request.user)
 
 class ChatMessageViewSet(viewsets.ModelViewSet):
+    throttle_scope = 'chat'
     queryset = ChatMessage.objects.all().order_by('timestamp')
     serializer_class = ChatMessageSerializer
     permission_classes = [IsAuthenticated]
@@ -66,7 +182,9 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
         serializer.save(sender=self.request.user)
 
 # --- Restaurant and Menu ViewSets ---
-class RestaurantViewSet(viewsets.ModelViewSet):
+@cache_responses(Restaurant, PaymentAccount)
+class RestaurantViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    throttle_scope = 'catalogue'
     queryset = Restaurant.objects.all()
     serializer_class = RestaurantSerializer
     permission_classes = [AllowAny]  # Allow public access for browsing
@@ -81,28 +199,34 @@ class RestaurantViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # For authenticated users, apply role-based filtering
-        if self.request.user.is_authenticated:
-            user = self.request.user
-            if user.role == 'sub_admin' or user.is_superuser:
+        context = get_user_context(self.request)
+        if context.is_authenticated:
+            if context.is_sub_admin:
                 return super().get_queryset()
-            elif user.role == 'customer':
+            elif context.is_customer:
                 return super().get_queryset()  # Customers can see all restaurants
-            elif user.restaurant:
-                return super().get_queryset().filter(id=user.restaurant.id)
+            elif context.restaurant_id:
+                return super().get_queryset().filter(id=context.restaurant_id)
             return Restaurant.objects.none()
         else:
             # For guests, return all restaurants
             return super().get_queryset()
 
 
-class MenuItemViewSet(viewsets.ModelViewSet):
+@cache_responses(MenuItem, Rating)
+class MenuItemViewSet(ShardRoutingMixin, ReplicaReadMixin, viewsets.ModelViewSet):
+    throttle_scope = 'catalogue'
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
     permission_classes = [AllowAny]  # Allow public access for browsing
+    # ?min_price=, ?min_rating=, ... (api/filters.py) and ?ordering=price, -average_rating, -id (newest)
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = MenuItemFilter
+    ordering_fields = MENU_ITEM_ORDERING
     
     def get_permissions(self):
         # Require authentication for write operations
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'import_menu', 'export_menu']:
             permission_classes = [IsAuthenticated]
         else:
             permission_classes = [AllowAny]  # Allow public read access
@@ -117,23 +241,97 @@ class MenuItemViewSet(viewsets.ModelViewSet):
             return queryset.filter(restaurant_id=restaurant_id)
 
         # For authenticated users, apply role-based filtering
-        if self.request.user.is_authenticated:
-            user = self.request.user
-            if user.role == 'sub_admin' or user.is_superuser:
+        context = get_user_context(self.request)
+        if context.is_authenticated:
+            if context.is_sub_admin:
                 return queryset # Superusers and sub-admins can see all items
-            elif user.role == 'customer':
+            elif context.is_customer:
                 return queryset # Customers can see all menu items
-            elif user.restaurant:
-                return queryset.filter(restaurant=user.restaurant) # Restaurant admins see only their restaurant's items
+            elif context.restaurant_id:
+                return queryset.filter(restaurant_id=context.restaurant_id) # Restaurant admins see only their restaurant's items
             return MenuItem.objects.none()
         else:
             # For guests, return all menu items
             return queryset
 
-class AddonViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'])
+    def recommendations(self, request, pk=None):
+        """Items most often ordered together with this one"""
+        # Served from the precomputed table (api/recommendations.py) without loading the item
+        if not pk.isdigit():
+            raise Http404
+        try:
+            limit = min(int(request.query_params.get('limit', 5)), settings.RECOMMENDATIONS_TOP_K)
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+
+        suggestions = recommendations.suggestions_for(int(pk))[:max(limit, 0)]
+        return Response([
+            {**suggestion, 'image': request.build_absolute_uri(suggestion['image']) if suggestion['image'] else None}
+            for suggestion in suggestions
+        ])
+
+    def _menu_restaurant(self, request):
+        """The restaurant whose menu is imported/exported, or None if not allowed"""
+        context = get_user_context(request)
+        if context.is_sub_admin:
+            restaurant_id = request.data.get('restaurant') or request.query_params.get('restaurant')
+            if not str(restaurant_id or '').isdigit():
+                return None
+            return Restaurant.objects.filter(id=restaurant_id).first()
+        if context.is_restaurant_admin and context.restaurant_id:
+            return context.restaurant
+        return None
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_menu(self, request):
+        """
+        Create and update menu items and addons from a CSV/XLSX file plus a zip of
+        images (see api/menu_import.py). dry_run=1 only returns the diff.
+        """
+        restaurant = self._menu_restaurant(request)
+        if restaurant is None:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        menu_file = request.FILES.get('file')
+        if menu_file is None:
+            return Response({'error': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        try:
+            diff = menu_import.import_menu(
+                restaurant, menu_file, menu_file.name, request.FILES.get('images'), dry_run=dry_run
+            )
+        except menu_import.MenuImportError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if diff['errors']:
+            return Response(diff, status=status.HTTP_400_BAD_REQUEST)
+        return Response(diff)
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export_menu(self, request):
+        """The restaurant's menu in the import format, ?file_format=csv (default) or xlsx"""
+        # Not ?format=, which DRF uses to pick a renderer
+        restaurant = self._menu_restaurant(request)
+        if restaurant is None:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        file_format = 'xlsx' if request.query_params.get('file_format') == 'xlsx' else 'csv'
+        content_type = {
+            'csv': 'text/csv',
+            'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        }[file_format]
+        response = HttpResponse(menu_import.export_menu(restaurant, file_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="menu-{restaurant.id}.{file_format}"'
+        return response
+
+@cache_responses(Addon)
+class AddonViewSet(ShardRoutingMixin, viewsets.ModelViewSet):
+    throttle_scope = 'catalogue'
     queryset = Addon.objects.all()
     serializer_class = AddonSerializer
     permission_classes = [AllowAny]  # Allow public access for browsing
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = AddonFilter
+    ordering_fields = ADDON_ORDERING
     
     def get_permissions(self):
         # Require authentication for write operations
@@ -151,87 +349,157 @@ class AddonViewSet(viewsets.ModelViewSet):
             return queryset.filter(restaurant_id=restaurant_id)
 
         # For authenticated users, apply role-based filtering
-        if self.request.user.is_authenticated:
-            user = self.request.user
-            if user.role == 'sub_admin' or user.is_superuser:
+        context = get_user_context(self.request)
+        if context.is_authenticated:
+            if context.is_sub_admin:
                 return queryset
-            elif user.role == 'customer':
+            elif context.is_customer:
                 return queryset # Customers can see all addons
-            elif user.restaurant:
-                return queryset.filter(restaurant=user.restaurant)
+            elif context.restaurant_id:
+                return queryset.filter(restaurant_id=context.restaurant_id)
             return Addon.objects.none()
         else:
             # For guests, return all addons
             return queryset
 
-class PaymentAccountViewSet(viewsets.ModelViewSet):
+@cache_responses(PaymentAccount)
+class PaymentAccountViewSet(ShardRoutingMixin, viewsets.ModelViewSet):
     queryset = PaymentAccount.objects.all()
     serializer_class = PaymentAccountSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
+        context = get_user_context(self.request)
         queryset = super().get_queryset()
         
         restaurant_id = self.request.query_params.get('restaurant')
         if restaurant_id:
             return queryset.filter(restaurant_id=restaurant_id)
 
-        if user.role == 'sub_admin' or user.is_superuser:
+        if context.is_sub_admin:
             return queryset
-        elif user.restaurant:
-            return queryset.filter(restaurant=user.restaurant)
+        elif context.restaurant_id:
+            return queryset.filter(restaurant_id=context.restaurant_id)
             
         return PaymentAccount.objects.none()
 
 # --- Order ViewSet ---
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ShardRoutingMixin, viewsets.ModelViewSet):
+    throttle_scope = 'orders'
     queryset = Order.objects.all().order_by('-created_at') 
     permission_classes = [IsAuthenticated]
+    shard_models = (Order, ArchivedOrder)
+    # ?status= (repeatable), ?created_after=, ?restaurant=, ... and ?ordering=created_at, -total_price
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    ordering_fields = ORDER_ORDERING
+
+    @property
+    def filterset_class(self):
+        return ArchivedOrderFilter if self.reads_archive else OrderFilter
     
     def get_serializer_class(self):
+        if self.reads_archive:
+            return ArchivedOrderDetailSerializer if self.action == 'retrieve' else ArchivedOrderListSerializer
         if self.action == 'list':
             return OrderListSerializer
         if self.action == 'retrieve':
             return OrderDetailSerializer
         return OrderListSerializer
 
+    @property
+    def reads_archive(self):
+        """Old finished orders live in the archive tables (api/archive.py); ?archived=1 reads those"""
+        if self.action not in ('list', 'retrieve'):
+            return False
+        if getattr(self, '_fall_back_to_archive', False):
+            return True
+        return self.request.query_params.get('archived', '').lower() in ('1', 'true')
+
     def get_queryset(self):
-        user = self.request.user
-        queryset = super().get_queryset()
-        
+        context = get_user_context(self.request)
+
         # Optimize queries by prefetching related objects
-        queryset = queryset.select_related('customer', 'restaurant').prefetch_related(
-            'orderitem_set__menu_item', 
-            'orderitem_set__addon'
-        )
+        if self.reads_archive:
+            queryset = ArchivedOrder.objects.select_related('customer', 'restaurant').prefetch_related(
+                'items__menu_item',
+                'items__addon'
+            )
+        else:
+            queryset = super().get_queryset().select_related('customer', 'restaurant').prefetch_related(
+                'orderitem_set__menu_item', 
+                'orderitem_set__addon'
+            )
         
-        if user.role == 'customer':
-            queryset = queryset.filter(customer=user)
-        elif user.role == 'sub_admin' or user.is_superuser:
+        if context.is_customer:
+            queryset = queryset.filter(customer=context.user)
+        elif context.is_sub_admin:
             # Sub-admins can see all orders
             pass 
-        elif user.role == 'restaurant_admin' and user.restaurant:
+        elif context.is_restaurant_admin and context.restaurant_id:
             # Restaurant admins can only see orders that have been approved by sub-admin
             # They cannot see orders with status 'Pending Payment' or 'Pending Approval'
             queryset = queryset.filter(
-                restaurant=user.restaurant
+                restaurant_id=context.restaurant_id
             ).exclude(
                 status__in=['Pending Payment', 'Pending Approval']
             )
-        
-        status = self.request.query_params.get('status')
-        if status:
-            queryset = queryset.filter(status=status)
         return queryset
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            if self.reads_archive:
+                raise
+        # Links to an order keep working after it has been archived
+        self._fall_back_to_archive = True
+        return super().retrieve(request, *args, **kwargs)
+
+    # Status changes made through PATCH /api/orders/<id>/ that go in the activity log
+    LOGGED_STATUS_CHANGES = {
+        'Preparing': ActivityLog.ActionType.ORDER_APPROVED,
+        'Cancelled': ActivityLog.ActionType.ORDER_CANCELLED,
+    }
+
+    def update(self, request, *args, **kwargs):
+        order = self.get_object()
+        if order.status != 'Pending Approval':
+            return super().update(request, *args, **kwargs)
+        # Checked and changed in one transaction: a check on `order` could be
+        # overtaken by a claim or approval made since it was read
+        with transaction.atomic(using=order._state.db):
+            if not approval_queue.hold(order, request.user):
+                return Response({'error': 'Order is being reviewed by another sub-admin'}, status=status.HTTP_409_CONFLICT)
+            return super().update(request, *args, **kwargs)
+
+    def perform_update(self, serializer):
+        previous_status = serializer.instance.status
+        if serializer.validated_data.get('status', previous_status) != 'Pending Approval':
+            # Reviewed: the claim on it is over
+            order = serializer.save(claimed_by=None, claim_expires_at=None)
+        else:
+            order = serializer.save()
+        if order.status == 'Completed' and previous_status != 'Completed':
+            recommendations.record_order(order)
+        action_type = self.LOGGED_STATUS_CHANGES.get(order.status)
+        if action_type and order.status != previous_status:
+            log_activity(
+                action_type, order, actor=self.request.user,
+                details=f"{action_type.label}: {order.order_code} by {self.request.user.username}"
+            )
+
     @action(detail=True, methods=['patch'])
+    @idempotent
     def mark_as_delivered(self, request, pk=None):
         """Mark order as delivered by customer"""
         order = self.get_object()
         
         # Only customers can mark their own orders as delivered
-        if request.user.role != 'customer' or order.customer != request.user:
+        if not get_user_context(request).is_customer or order.customer_id != request.user.id:
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         
         # Only orders in 'Preparing' or 'Ready for Pickup' status can be marked as delivered
@@ -244,12 +512,13 @@ class OrderViewSet(viewsets.ModelViewSet):
         return Response({'status': 'Order marked as delivered'})
 
     @action(detail=True, methods=['patch'])
+    @idempotent
     def mark_as_ready_for_pickup(self, request, pk=None):
         """Mark order as ready for pickup by sub-admin"""
         order = self.get_object()
         
         # Only sub-admins can mark orders as ready for pickup
-        if request.user.role != 'sub_admin' and not request.user.is_superuser:
+        if not get_user_context(request).is_sub_admin:
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         
         # Only orders in 'Preparing' status can be marked as ready for pickup
@@ -261,20 +530,28 @@ class OrderViewSet(viewsets.ModelViewSet):
         order.status = 'Ready for Pickup'
         order.ready_for_pickup_at = timezone.now()
         order.save()
+        eta.record(order)
+
+        log_activity(
+            ActivityLog.ActionType.ORDER_READY, order, actor=request.user,
+            details=f"Order {order.order_code} ready for pickup, marked by {request.user.username}"
+        )
         
         return Response({'status': 'Order marked as ready for pickup'})
 
     @action(detail=True, methods=['patch'])
+    @idempotent
     def mark_as_ready_for_pickup_restaurant(self, request, pk=None):
         """Mark order as ready for pickup by restaurant admin"""
         order = self.get_object()
         
         # Only restaurant admins can use this endpoint
-        if request.user.role != 'restaurant_admin' or not request.user.restaurant:
+        context = get_user_context(request)
+        if not context.is_restaurant_admin or not context.restaurant_id:
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         
         # Restaurant admin can only mark orders from their own restaurant
-        if order.restaurant != request.user.restaurant:
+        if order.restaurant_id != context.restaurant_id:
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         
         # Only orders in 'Preparing' status can be marked as ready for pickup
@@ -286,16 +563,23 @@ class OrderViewSet(viewsets.ModelViewSet):
         order.status = 'Ready for Pickup'
         order.ready_for_pickup_at = timezone.now()
         order.save()
+        eta.record(order)
+
+        log_activity(
+            ActivityLog.ActionType.ORDER_READY, order, actor=request.user,
+            details=f"Order {order.order_code} ready for pickup, marked by {request.user.username}"
+        )
         
         return Response({'status': 'Order marked as ready for pickup'})
 
     @action(detail=True, methods=['patch'])
+    @idempotent
     def mark_as_completed(self, request, pk=None):
         """Mark order as completed by sub-admin"""
         order = self.get_object()
         
         # Only sub-admins can mark orders as completed
-        if request.user.role != 'sub_admin' and not request.user.is_superuser:
+        if not get_user_context(request).is_sub_admin:
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         
         # Only orders in 'Delivered' status can be marked as completed
@@ -304,23 +588,49 @@ class OrderViewSet(viewsets.ModelViewSet):
         
         order.status = 'Completed'
         order.save()
+        recommendations.record_order(order)
         
-        # Create activity log
-        ActivityLog.objects.create(
-            actor=request.user,
-            restaurant=order.restaurant,
-            order=order,
-            action_type=ActivityLog.ActionType.ORDER_DELIVERED,
+        log_activity(
+            ActivityLog.ActionType.ORDER_DELIVERED, order, actor=request.user,
             details=f"Order {order.order_code} completed by {request.user.username}"
         )
         
         return Response({'status': 'Order marked as completed'})
 
+    @action(detail=False, methods=['post'])
+    def claim(self, request):
+        """Lease the next orders waiting for approval to this sub-admin (api/approval_queue.py)"""
+        if not get_user_context(request).is_sub_admin:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            limit = int(request.data.get('limit', settings.APPROVAL_CLAIM_BATCH))
+        except (TypeError, ValueError):
+            raise ValidationError({'limit': 'Must be a number'})
+        limit = max(1, min(limit, 50))
+
+        shard = sharding.current_shard()
+        orders, expires = approval_queue.claim(
+            request.user, limit, aliases=[shard] if shard else sharding.shards()
+        )
+        return Response({
+            'orders': OrderListSerializer(orders, many=True, context=self.get_serializer_context()).data,
+            'claim_expires_at': expires,
+        })
+
+    @action(detail=True, methods=['post'])
+    def release(self, request, pk=None):
+        """Hand a claimed order back to the queue"""
+        if not get_user_context(request).is_sub_admin:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        if not approval_queue.release(self.get_object(), request.user):
+            return Response({'error': 'Order is not claimed by you'}, status=status.HTTP_409_CONFLICT)
+        return Response({'status': 'Order released'})
+
     @action(detail=False, methods=['post'])
     def auto_deliver_orders(self, request):
         """Manually trigger auto-delivery check for orders ready for pickup"""
         # Only sub-admins can trigger auto-delivery
-        if request.user.role != 'sub_admin' and not request.user.is_superuser:
+        if not get_user_context(request).is_sub_admin:
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
         
         # Find orders that should be auto-delivered
@@ -332,7 +642,8 @@ class OrderViewSet(viewsets.ModelViewSet):
         auto_delivered_count = 0
         auto_delivered_orders = []
         
-        for order in orders_to_auto_deliver:
+        # Every restaurant's orders, so every shard's
+        for order in sharding.fan_out(orders_to_auto_deliver):
             if order.should_auto_deliver():
                 order.status = 'Delivered'
                 order.save()
@@ -348,36 +659,175 @@ class OrderViewSet(viewsets.ModelViewSet):
             'auto_delivered_orders': auto_delivered_orders
         })
 
+# --- Payment Proof Uploads ---
+class PaymentProofUploadViewSet(ShardRoutingMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                                viewsets.GenericViewSet):
+    """
+    Resumable chunked upload of an order's payment proof (see api/uploads.py).
+    POST starts an upload, PUT sends the next chunk as the raw request body with
+    Upload-Offset, GET tells how much arrived and whether processing finished.
+    """
+    throttle_scope = 'uploads'
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+    shard_lookups = {'order': Order}
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        session = serializer.save(user=self.request.user)
+        uploads.start(session)
+
+    def update(self, request, *args, **kwargs):
+        session = self.get_object()
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response({'error': 'Upload-Offset and Content-Length are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # request.stream is read as it arrives, request.data would buffer the whole body
+            uploads.write_chunk(session, offset, request.stream, length)
+        except uploads.UploadError as exc:
+            headers = {'Upload-Offset': str(exc.offset)} if exc.offset is not None else {}
+            return Response({'error': str(exc), 'received': exc.offset}, status=exc.status, headers=headers)
+        if session.status == UploadSession.Status.PROCESSING:
+            # Already processed if UPLOAD_PROCESSING_IN_BACKGROUND is off (or the pool was quick)
+            session = UploadSession.objects.filter(pk=session.pk).first() or session
+        return Response(self.get_serializer(session).data, headers={'Upload-Offset': str(session.received)})
+
+# --- Order Events and Webhooks ---
+class OrderEventFeedView(APIView):
+    """
+    Change feed of order events, oldest first: GET /api/order-events/?since=<id>.
+    Pass the returned next_since as `since` to get the following events. Across
+    several shards it is one id per shard, comma-separated (see webhooks.read_feed).
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'orders'
+    MAX_LIMIT = 500
+
+    def get(self, request):
+        try:
+            cursors = [int(cursor) for cursor in request.query_params.get('since', '0').split(',')]
+            limit = max(1, min(int(request.query_params.get('limit', 100)), self.MAX_LIMIT))
+        except ValueError:
+            return Response({'error': 'since and limit must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        context = get_user_context(request)
+        events = webhooks.settled_events()
+        restaurant_id = None
+        if context.is_sub_admin:
+            restaurant_id = request.query_params.get('restaurant')
+            if restaurant_id:
+                events = events.filter(restaurant_id=restaurant_id)
+        elif context.is_restaurant_admin and context.restaurant_id:
+            restaurant_id = context.restaurant_id
+            events = webhooks.restaurant_events(restaurant_id, 0)
+        elif context.is_customer:
+            events = events.filter(customer_id=context.user.id)
+        else:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        # A restaurant's events are on its shard, everyone's on all of them
+        aliases = [sharding.shard_for(restaurant_id)] if restaurant_id else sharding.shards()
+        page, cursors = webhooks.read_feed(events, aliases, cursors, limit + 1)
+        has_more = len(page) > limit
+        page = page[:limit]
+        if page:
+            cursors = webhooks.feed_cursors(page, aliases, cursors)
+        return Response({
+            'events': [event.to_payload() for event in page],
+            'next_since': cursors[0] if len(cursors) == 1 else ','.join(map(str, cursors)),
+            'has_more': has_more,
+        })
+
+
+class WebhookEndpointViewSet(ShardRoutingMixin, viewsets.ModelViewSet):
+    """Webhook URLs of a restaurant; sub-admins manage those of every restaurant"""
+    serializer_class = WebhookEndpointSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        context = get_user_context(self.request)
+        if context.is_sub_admin:
+            return WebhookEndpoint.objects.all()
+        if context.is_restaurant_admin and context.restaurant_id:
+            return WebhookEndpoint.objects.filter(restaurant_id=context.restaurant_id)
+        return WebhookEndpoint.objects.none()
+
+    def perform_create(self, serializer):
+        context = get_user_context(self.request)
+        if context.is_sub_admin:
+            restaurant = serializer.validated_data.get('restaurant')
+        elif context.is_restaurant_admin and context.restaurant_id:
+            restaurant = context.restaurant
+        else:
+            raise PermissionDenied('Permission denied')
+        if restaurant is None:
+            raise ValidationError({'restaurant': 'This field is required.'})
+        # A new endpoint gets the events from now on, not the whole history
+        serializer.save(
+            restaurant=restaurant, secret=secrets.token_hex(32), last_event_id=webhooks.latest_event_id()
+        )
+
+    def perform_update(self, serializer):
+        if not get_user_context(self.request).is_sub_admin:
+            serializer.validated_data.pop('restaurant', None)
+        serializer.save()
+
 # --- Rating ViewSet ---
-class RatingViewSet(viewsets.ModelViewSet):
+class RatingViewSet(ShardRoutingMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Rating.objects.all()
     serializer_class = RatingSerializer
     permission_classes = [IsAuthenticated]
+    shard_lookups = {'menu_item': MenuItem, 'order': Order}
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = RatingFilter
+    ordering_fields = RATING_ORDERING
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == 'customer':
-            return self.queryset.filter(customer=user)
-        elif user.role in ['sub_admin', 'restaurant_admin'] or user.is_superuser:
+        context = get_user_context(self.request)
+        if context.is_customer:
+            return self.queryset.filter(customer=context.user)
+        elif context.is_sub_admin or context.is_restaurant_admin:
             return self.queryset
         return Rating.objects.none()
 
     def perform_create(self, serializer):
+        # Rating the same item again updates the existing rating
+        serializer.instance = Rating.objects.filter(
+            customer=self.request.user, menu_item=serializer.validated_data['menu_item']
+        ).first()
         serializer.save(customer=self.request.user)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Rate all menu items of a delivered order in one request"""
+        if not get_user_context(request).is_customer:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = BulkRatingSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        ratings = serializer.save()
+        return Response(RatingSerializer(ratings, many=True).data, status=status.HTTP_201_CREATED)
+
 # --- Activity Log ViewSet ---
-class ActivityLogViewSet(viewsets.ReadOnlyModelViewSet):
+class ActivityLogViewSet(ShardRoutingMixin, ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = ActivityLogSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == 'restaurant_admin' and user.restaurant:
-            return ActivityLog.objects.filter(restaurant=user.restaurant)
+        context = get_user_context(self.request)
+        queryset = ActivityLog.objects.select_related('actor', 'order')
+        if context.is_restaurant_admin and context.restaurant_id:
+            return queryset.filter(restaurant_id=context.restaurant_id)
         
         # Superusers and sub-admins can see all logs
-        if user.role == 'sub_admin' or user.is_superuser:
-            return ActivityLog.objects.all()
+        if context.is_sub_admin:
+            return queryset
             
         return ActivityLog.objects.none()
 
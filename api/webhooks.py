@@ -0,0 +1,299 @@
+"""
+Order event webhooks.
+
+Every order status change is written to the OrderEvent outbox in the same
+transaction as the change itself (Order.save), so an event exists if and only
+if the change was committed. `manage.py deliver_webhooks` drains the outbox:
+
+- each WebhookEndpoint keeps the id of the last event it acknowledged, and
+  gets the events after it in batches of WEBHOOK_BATCH_SIZE, one POST each;
+- several changes of one order in a batch are coalesced into one event
+  carrying the first previous status and the latest status;
+- the body is signed: X-Webhook-Signature: t=<unix time>,v1=<hex HMAC-SHA256
+  of "<t>.<body>" keyed with the endpoint secret> (see verify());
+- endpoints are delivered shard by shard, from the events on their
+  restaurant's shard (api/sharding.py);
+- a failed delivery is retried with exponential backoff, and the batch is only
+  skipped once the receiver answers 2xx, so delivery is at least once. The
+  `id` of each event lets receivers drop duplicates.
+
+Endpoints must be https URLs of public addresses, checked when an endpoint is
+saved and again before each POST (the name may resolve elsewhere by then), and
+redirects aren't followed: otherwise any restaurant admin could make the worker
+probe internal services and read the answer from last_error.
+WEBHOOK_ALLOW_PRIVATE_URLS=True lifts this for local testing (webhook_receiver).
+
+Events younger than ORDER_EVENT_SETTLE_SECONDS are left for the next round:
+ids are taken when a transaction inserts, not when it commits, so this gives a
+slower transaction with a smaller id time to commit before later ids are sent.
+Known gap: an event whose transaction takes longer than that to commit can end
+up below a cursor that already moved past its id, and is then never delivered
+nor shown in the change feed. Order.save() writes the event at the end of its
+own short transaction, so this takes a caller holding the order's transaction
+open for seconds; raise ORDER_EVENT_SETTLE_SECONDS if yours do.
+
+`manage.py webhook_receiver` runs a local stand-in receiver (make_receiver())
+that checks signatures and prints what it gets.
+"""
+import hashlib
+import heapq
+import hmac
+import ipaddress
+import json
+import logging
+import random
+import socket
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from . import sharding
+from .models import OrderEvent, WebhookEndpoint
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'X-Webhook-Signature'
+# Orders restaurants aren't told about yet: nothing has been paid
+HIDDEN_FROM_RESTAURANTS = ('Pending Payment',)
+
+
+# --- Signatures ---
+def sign(secret, timestamp, body):
+    message = f'{timestamp}.'.encode() + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def signature_header(secret, body, timestamp=None):
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    return f't={timestamp},v1={sign(secret, timestamp, body)}'
+
+
+def verify(secret, header, body, tolerance=300):
+    """Whether a signature header is valid for the body and recent enough"""
+    try:
+        parts = dict(part.split('=', 1) for part in (header or '').split(','))
+        timestamp = int(parts['t'])
+    except (ValueError, KeyError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(parts.get('v1', ''), sign(secret, timestamp, body))
+
+
+# --- Outbox ---
+def settled_events():
+    """Events old enough that no event with a smaller id should still appear (see the known gap above)"""
+    cutoff = timezone.now() - timedelta(seconds=settings.ORDER_EVENT_SETTLE_SECONDS)
+    return OrderEvent.objects.filter(created_at__lte=cutoff).order_by('id')
+
+
+def restaurant_events(restaurant_id, after_id):
+    return settled_events().filter(restaurant_id=restaurant_id, id__gt=after_id).exclude(
+        to_status__in=HIDDEN_FROM_RESTAURANTS
+    )
+
+
+def coalesce(events):
+    """One payload per order: its latest event, with the status before the first one"""
+    latest, first_previous = {}, {}
+    for event in events:
+        first_previous.setdefault(event.order_id, event.from_status)
+        latest[event.order_id] = event
+    payloads = []
+    for event in sorted(latest.values(), key=lambda e: e.pk):
+        payload = event.to_payload()
+        payload['order']['previous_status'] = first_previous[event.order_id] or None
+        payloads.append(payload)
+    return payloads
+
+
+def latest_event_id():
+    return OrderEvent.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+
+# --- Change feed ---
+def read_feed(events, aliases, cursors, count):
+    """
+    The first `count` of `events` after the cursors, oldest first, and the
+    cursors padded to one per shard in `aliases`. Ids only order the events of
+    one shard, so each shard has its own cursor and their events are merged by
+    time.
+    """
+    cursors = (cursors + [0] * len(aliases))[:len(aliases)]
+    pages = [list(events.using(alias).filter(id__gt=since)[:count]) for alias, since in zip(aliases, cursors)]
+    return list(islice(heapq.merge(*pages, key=lambda event: (event.created_at, event.pk)), count)), cursors
+
+
+def feed_cursors(page, aliases, cursors):
+    """The cursors to continue after `page`: the last id it has from each shard"""
+    return [
+        max((event.pk for event in page if event._state.db == alias), default=since)
+        for alias, since in zip(aliases, cursors)
+    ]
+
+
+# --- Delivery ---
+class UnsafeURL(ValueError):
+    """A webhook URL the worker must not call"""
+
+
+def check_url(url):
+    """Raise UnsafeURL unless `url` is https and its host resolves only to public addresses"""
+    if settings.WEBHOOK_ALLOW_PRIVATE_URLS:
+        return
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme != 'https' or not parts.hostname:
+        raise UnsafeURL('Webhook URLs must be https URLs')
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, parts.port or 443, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise UnsafeURL(f'{parts.hostname} does not resolve')
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split('%')[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        # Loopback, link-local (cloud metadata), private, shared and reserved ranges
+        if not address.is_global:
+            raise UnsafeURL(f'{parts.hostname} is not a public address')
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    # A redirect could point anywhere; the 3xx is reported as a failed delivery
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirects)
+
+
+def post(url, body, headers):
+    """POST a body, returns the status code (raises OSError if there is no answer, UnsafeURL)"""
+    check_url(url)
+    request = urllib.request.Request(url, data=body, headers=headers, method='POST')
+    try:
+        with _opener.open(request, timeout=settings.WEBHOOK_TIMEOUT_SECONDS) as response:
+            return response.status
+    except urllib.error.HTTPError as exc:
+        return exc.code
+
+
+def backoff(failures):
+    """Seconds before the next attempt after `failures` failures in a row, with jitter"""
+    delay = min(settings.WEBHOOK_BACKOFF_MAX_SECONDS, settings.WEBHOOK_BACKOFF_BASE_SECONDS * 2 ** (failures - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def deliver_batch(endpoint):
+    """
+    Send the next batch of events to an endpoint. Returns the number of events
+    acknowledged, or None if the delivery failed.
+    """
+    events = list(restaurant_events(endpoint.restaurant_id, endpoint.last_event_id)[:settings.WEBHOOK_BATCH_SIZE])
+    if not events:
+        return 0
+
+    body = json.dumps({'restaurant': endpoint.restaurant_id, 'events': coalesce(events)}).encode()
+    headers = {
+        'Content-Type': 'application/json',
+        'User-Agent': 'food-ordering-webhooks',
+        SIGNATURE_HEADER: signature_header(endpoint.secret, body),
+    }
+    try:
+        status = post(endpoint.url, body, headers)
+        error = '' if 200 <= status < 300 else f'HTTP {status}'
+    except (OSError, ValueError) as exc:
+        error = str(exc)[:255] or exc.__class__.__name__
+
+    if not error:
+        endpoint.last_event_id = events[-1].pk
+        endpoint.failure_count = 0
+        endpoint.last_error = ''
+        endpoint.save(update_fields=['last_event_id', 'failure_count', 'last_error'])
+        return len(events)
+
+    endpoint.failure_count += 1
+    endpoint.next_attempt_at = timezone.now() + timedelta(seconds=backoff(endpoint.failure_count))
+    endpoint.last_error = error
+    endpoint.save(update_fields=['failure_count', 'next_attempt_at', 'last_error'])
+    logger.warning('Webhook delivery to %s failed (%s), attempt %s', endpoint.url, error, endpoint.failure_count)
+    return None
+
+
+def lease(endpoint_id):
+    """Take an endpoint for this worker; False if another worker has it"""
+    now = timezone.now()
+    return bool(WebhookEndpoint.objects.filter(
+        Q(leased_until__isnull=True) | Q(leased_until__lt=now), pk=endpoint_id,
+    ).update(leased_until=now + timedelta(seconds=settings.WEBHOOK_LEASE_SECONDS)))
+
+
+def deliver_due(max_batches=10):
+    """
+    One round of delivery: every active endpoint whose next attempt is due gets
+    up to `max_batches` batches. Returns (events delivered, failed deliveries).
+    """
+    delivered = failed = 0
+    # Endpoints and their restaurant's events are on the restaurant's shard
+    for alias in sharding.shards():
+        with sharding.using_shard(alias):
+            shard_delivered, shard_failed = _deliver_due_on_shard(max_batches)
+        delivered += shard_delivered
+        failed += shard_failed
+    return delivered, failed
+
+
+def _deliver_due_on_shard(max_batches):
+    delivered = failed = 0
+    due = WebhookEndpoint.objects.filter(is_active=True, next_attempt_at__lte=timezone.now())
+    for endpoint_id in due.values_list('pk', flat=True):
+        if not lease(endpoint_id):
+            continue
+        try:
+            endpoint = WebhookEndpoint.objects.get(pk=endpoint_id)
+            for _ in range(max_batches):
+                sent = deliver_batch(endpoint)
+                if sent is None:
+                    failed += 1
+                    break
+                delivered += sent
+                if sent < settings.WEBHOOK_BATCH_SIZE:
+                    break
+        finally:
+            WebhookEndpoint.objects.filter(pk=endpoint_id).update(leased_until=None)
+    return delivered, failed
+
+
+# --- Local receiver ---
+def make_receiver(secret, port=0, on_delivery=None, status=200):
+    """
+    An HTTP server standing in for a restaurant's webhook receiver. Answers
+    `status` to correctly signed deliveries, 401 to others, and passes each
+    valid body (decoded) to on_delivery. Call serve_forever() to run it.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if not verify(secret, self.headers.get(SIGNATURE_HEADER), body):
+                self.send_response(401)
+            else:
+                if on_delivery is not None:
+                    on_delivery(json.loads(body))
+                self.send_response(server.status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    # Can be changed while running, e.g. to make deliveries fail
+    server.status = status
+    return server
@@ -0,0 +1,12 @@
+"""
+WSGI entry point of the serverless function serving /api/ (see vercel.json).
+
+The same application as wsgi.py, without the admin, sessions, messages and static
+files: see API_ONLY in settings.
+"""
+
+import os
+
+os.environ.setdefault('API_ONLY', 'True')
+
+from food_ordering_backend.wsgi import application  # noqa: E402,F401
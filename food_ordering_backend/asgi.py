@@ -3,6 +3,11 @@ ASGI config for food_ordering_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+To serve the app in ASGI mode (needed for the async endpoints under /api/async/
+to pay off), run it with uvicorn, e.g. via serve_asgi.sh:
+
+    uvicorn food_ordering_backend.asgi:application --workers 4
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
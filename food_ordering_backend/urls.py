@@ -1,4 +1,3 @@
-from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
@@ -12,8 +11,6 @@ from rest_framework_simplejwt.views import (
 )
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
-    
     # ADDED: Direct path to the profile view to avoid router conflicts
     path('api/profile/', ProfileView.as_view(), name='profile'),
 
@@ -22,11 +19,19 @@ urlpatterns = [
     
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-    
-    # This adds the login/logout button to the browsable API
-    path('api-auth/', include('rest_framework.urls')),
 ]
 
+# The /api/ serverless function has no admin or sessions (see API_ONLY in settings)
+if not settings.API_ONLY:
+    from django.contrib import admin
+
+    urlpatterns += [
+        path('admin/', admin.site.urls),
+
+        # This adds the login/logout button to the browsable API
+        path('api-auth/', include('rest_framework.urls')),
+    ]
+
 # This helper is for serving user-uploaded files during development
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'food_ordering_backend.settings')
 
 application = get_wsgi_application()
+
+# Build the URL resolver now, while the serverless function initializes, rather
+# than during its first request (see api/startup.py)
+from api.startup import warm_up  # noqa: E402
+
+warm_up()
@@ -0,0 +1,36 @@
+// Shared by the customer pages: where the API is, and authenticated requests to it.
+const API_BASE_URL = 'http://127.0.0.1:8000';
+
+async function fetchWithAuth(endpoint, options = {}) {
+    const token = localStorage.getItem('accessToken');
+
+    if (!token) {
+        window.location.href = 'customer_login.html';
+        return;
+    }
+
+    const headers = {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`,
+        ...options.headers,
+    };
+
+    const response = await fetch(`${API_BASE_URL}${endpoint}`, { ...options, headers });
+
+    if (response.status === 401) {
+        localStorage.removeItem('accessToken');
+        window.location.href = 'customer_login.html';
+        throw new Error('Unauthorized');
+    }
+
+    if (!response.ok) {
+        throw new Error(`API Error: ${response.status}`);
+    }
+
+    const contentType = response.headers.get("content-type");
+    if (contentType && contentType.indexOf("application/json") !== -1) {
+        return response.json();
+    } else {
+        return null;
+    }
+}
@@ -0,0 +1,14 @@
+#!/bin/bash
+# Serve the app in ASGI mode with uvicorn.
+# The async endpoints under /api/async/ (menu catalogue, order status and chat
+# polling) only free up workers while waiting when served this way.
+# Compare against gunicorn with: python manage.py loadtest_servers
+
+cd "$(dirname "$0")"
+[ -f venv/bin/activate ] && source venv/bin/activate  # if using virtual environment
+# A long-running server: activity log entries can be written in batches
+export ACTIVITY_LOG_BUFFERED="${ACTIVITY_LOG_BUFFERED:-True}"
+exec uvicorn food_ordering_backend.asgi:application \
+    --host 0.0.0.0 \
+    --port "${PORT:-8000}" \
+    --workers "${WEB_CONCURRENCY:-4}"